@@ -1,10 +1,212 @@
-from fastapi import FastAPI, Request
-import uvicorn
+import time
+# import time of this module, reported by /health/ready (see startup.py for the breakdown per package)
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Request, File, UploadFile, Query, HTTPException
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, validator
-from typing import  Union
-from joblib import load
+from typing import  Union, List
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import asyncio
+import importlib
 import json
-import pandas as pd 
+import logging
+import math
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+import settings
+from registry import LoadedModel, ModelRegistry
+from batching import records_to_frame, iter_chunks, iter_file_chunks, ndjson_lines, result_lines
+from microbatch import MicroBatcher
+from dataset import DatasetStore, DelayDataset
+from ingest import FileDropWatcher, SCHEMAS, ingest
+from jobs import FINISHED, HEARTBEAT_TIMEOUT, JobRunner, JobStore, job_info
+from sensitivity import price_curves, sweep_values
+from delay_analysis import delay_costs
+from cache import ResultCache, encode_json, etag_matches
+from responses import rows_response
+from validation import BOOLEAN_FEATURES, Vocabulary, validate_frame
+import metrics
+from metrics import stage, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Models are deserialized once and shared across requests
+registry = ModelRegistry(settings.MODEL_PATHS, reload_interval=settings.MODEL_RELOAD_INTERVAL)
+
+
+# module and class of each predictor: only the one INFERENCE_MODE selects is imported
+PREDICTORS = {"pipeline": ("fastpath", "PipelinePredictor"), "fast": ("fastpath", "FastPredictor"), "trees": ("trees", "TreePredictor")}
+
+
+@dataclass(frozen=True)
+class Pricing:
+    """The pricing model and what is built from it each time it is (re)loaded, swapped as a whole:
+    - the allowed values of the categorical features, taken from the encoder of the model
+    - the predictor, which runs the sklearn pipeline or its compiled version depending on INFERENCE_MODE"""
+    loaded: LoadedModel
+    vocabulary: Vocabulary
+    predictor: object
+
+
+pricing = None
+
+def _on_model_loaded(loaded):
+    global pricing
+    metrics.MODEL_LOAD_SECONDS.labels(loaded.name, loaded.version).set(loaded.load_seconds)
+    metrics.MODEL_LOADS.labels(loaded.name).inc()
+    if loaded.name == "pricing":
+        module, name = PREDICTORS[settings.INFERENCE_MODE]
+        pricing = Pricing(
+            loaded=loaded,
+            vocabulary=Vocabulary.from_model(loaded.model, source=f"{loaded.path} ({loaded.version})"),
+            predictor=getattr(importlib.import_module(module), name)(loaded.model),
+        )
+
+registry.listeners.append(_on_model_loaded)
+
+
+def get_pricing():
+    # registry.get() loads the model the first time, and reloads it in the background when its file changes
+    registry.get("pricing")
+    return pricing
+
+
+def get_vocabulary():
+    return get_pricing().vocabulary
+
+
+def get_predictor():
+    return get_pricing().predictor
+
+
+def predict_records(records):
+    # Price a list of feature dicts with one model call
+    return get_predictor().predict_records(records)
+
+
+# The pricing dataset is parsed once and kept in memory for the exploration endpoints
+datasets = DatasetStore(settings.PRICING_DATA_PATH, reload_interval=settings.DATASET_RELOAD_INTERVAL)
+
+# Encoded results of the aggregation endpoints, dropped whenever the dataset is reloaded
+result_cache = ResultCache(max_entries=settings.RESULT_CACHE_SIZE, ttl=settings.RESULT_CACHE_TTL)
+datasets.listeners.append(result_cache.clear)
+
+# The delay analysis dataset, with rentals sorted once for the threshold sweeps of the /delay endpoints
+delays = DatasetStore(settings.DELAY_DATA_PATH, reload_interval=settings.DATASET_RELOAD_INTERVAL, loader=DelayDataset.load)
+delays.listeners.append(result_cache.clear)
+
+# New rows for both datasets, posted to /ingest or dropped as files in INGEST_DIR
+stores = {"pricing": datasets, "delay": delays}
+watcher = FileDropWatcher(settings.INGEST_DIR, stores, get_vocabulary, interval=settings.INGEST_POLL_INTERVAL)
+
+# Files of cars priced in the background by /jobs, on a process pool. Created by the lifespan when the jobs are
+# enabled, so that importing the app (gunicorn master, pool processes, tools) does not create JOBS_DIR.
+job_store = None
+job_runner = None
+
+
+# Concurrent /predict calls are grouped into a single model call
+batcher = MicroBatcher(
+    predict_records,
+    max_batch_size=settings.MICROBATCH_MAX_SIZE,
+    max_wait=settings.MICROBATCH_MAX_WAIT_MS / 1000,
+    workers=settings.MICROBATCH_WORKERS,
+)
+
+# Startup steps, reported by /health/ready:
+# - warm_up loads the models, and the datasets unless STARTUP_MODE is "lazy". Under gunicorn the master runs it
+#   before forking the workers (see gunicorn.conf.py), which inherit the loaded objects.
+# - each worker then prices a synthetic car, so that the first request does not pay for the first call of the model
+#   (run in the worker, not the master: the thread pools the model creates do not survive a fork)
+# The worker is ready after both. In lazy mode the datasets are loaded in the background afterwards.
+warm = {"done": False, "pid": None, "import_seconds": None, "load_seconds": None,
+        "prediction_pid": None, "prediction_seconds": None, "datasets_seconds": None, "datasets_error": None}
+
+
+def warm_up(reload=False):
+    """Load the models and the datasets, unless they already are (`reload` loads them again)."""
+    if warm["done"] and not reload:
+        return
+    start = time.perf_counter()
+    registry.load_all()
+    if settings.STARTUP_MODE != "lazy":
+        load_datasets()
+    warm.update(done=True, pid=os.getpid(), load_seconds=time.perf_counter() - start)
+
+
+def load_datasets():
+    # refresh() holds the lock of the store: a request needing the dataset meanwhile waits for this load
+    start = time.perf_counter()
+    datasets.refresh()
+    delays.refresh()
+    warm["datasets_seconds"] = time.perf_counter() - start
+
+
+def _load_datasets_in_background():
+    try:
+        load_datasets()
+    except Exception as e:
+        logger.exception("Could not load the datasets")
+        warm["datasets_error"] = f"{type(e).__name__}: {e}"
+
+
+def _loaded_dataset(store):
+    """The dataset held by `store`. With STARTUP_MODE=lazy, 503 until the background load is done: waiting for it
+    in an async endpoint would block the event loop, and every other request with it."""
+    if not store.loaded and settings.STARTUP_MODE == "lazy":
+        if warm["datasets_error"] is not None:
+            raise HTTPException(status_code=503, detail=f"The datasets could not be loaded: {warm['datasets_error']}")
+        raise HTTPException(status_code=503, detail="The datasets are still loading", headers={"Retry-After": "5"})
+    return store.get()
+
+
+def warm_up_car():
+    """A car made of the first allowed value of each categorical feature."""
+    car = {column: min(values) for column, values in get_vocabulary().values.items()}
+    car.update(mileage=100000, engine_power=120)
+    car.update({column: False for column in BOOLEAN_FEATURES})
+    return car
+
+
+async def warm_up_prediction():
+    # through the micro-batcher when enabled: its worker thread is the one running the model afterwards
+    start = time.perf_counter()
+    car = warm_up_car()
+    if settings.MICROBATCH_ENABLED:
+        await batcher.submit(car)
+    else:
+        predict_records([car])
+    warm.update(prediction_pid=os.getpid(), prediction_seconds=time.perf_counter() - start)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global job_store, job_runner
+    warm_up()
+    if settings.MICROBATCH_ENABLED:
+        await batcher.start()
+    await warm_up_prediction()
+    if settings.STARTUP_MODE == "lazy" and not delays.loaded:
+        threading.Thread(target=_load_datasets_in_background, name="load_datasets", daemon=True).start()
+    if settings.INGEST_POLL_INTERVAL > 0:
+        await watcher.start()
+    if settings.JOBS_PROCESSES > 0:
+        job_store = JobStore(settings.JOBS_DIR)
+        job_runner = JobRunner(job_store, registry, PREDICTORS[settings.INFERENCE_MODE],
+                               processes=settings.JOBS_PROCESSES, retention_hours=settings.JOBS_RETENTION_HOURS)
+        job_runner.start()
+    yield
+    if job_runner is not None:
+        await run_in_threadpool(job_runner.stop)
+    await watcher.stop()
+    await batcher.stop()
 
 app = FastAPI(
 title="Getaround API",
@@ -35,13 +237,30 @@ The columns are:
 - `winter_tires`: whether the car has winter tires or not (boolean)
 - `rental_price_per_day`: the rental price of the car (in $)
 
-The API has 6 endpoints:
+The API has 23 endpoints:
+- **/models**: returns the version and load time of the models served by the API
+- **/models/batcher**: returns the queue depth and batch sizes of the /predict micro-batcher
+- **/vocabulary**: returns the allowed values of the categorical columns
+- **/dataset**: returns the version and load time of the pricing dataset, and the hit/miss counters of the result cache
 - **/preview**: returns a preview of the dataset (as a dictionary)
 - **/predict**: returns the predicted price of a car
+- **/predict/batch**: returns the predicted prices of a list of cars (streamed as NDJSON)
+- **/predict/sensitivity**: returns how the predicted price of a car changes with its mileage, engine power, equipment...
+- **/predict/batch/file**: returns the predicted prices of the cars of a CSV or NDJSON file (streamed as NDJSON)
+- **/jobs/predict**: starts pricing the cars of a CSV or NDJSON file in the background, returns the id of the job
+- **/jobs/{id}**: returns the status and progress of a pricing job
+- **/jobs/{id}/result**: returns the predicted prices of a pricing job (streamed as NDJSON, while the job runs)
 - **/unique-values**: returns the unique values of a column (as a list)
 - **/groupby**: returns the grouped data of a column (as a dictionary)
 - **/filter-by**: returns the filtered data of a column (as a dictionary)
 - **/quantile**: returns the quantile of a column (as a float or string)
+- **/delay/threshold-impact**: returns the number of rentals impacted and of conflicts solved by minimum delays between rentals
+- **/delay/summary**: returns the number of conflicts between rentals and the distribution of the checkout delays per checkin type
+- **/delay/cost**: returns the estimated revenue lost to late checkouts per checkin type
+- **/ingest/{dataset}**: appends new cars (pricing) or rentals (delay) to a dataset, the other endpoints include them right away
+- **/metrics**: returns the request, stage, cache and batcher metrics of the API (Prometheus text format)
+- **/health/live**: returns 200 while the API process is running
+- **/health/ready**: returns 200 once the models and datasets are loaded, 503 before
 
 
 The API is based on the FastAPI framework.,
@@ -51,9 +270,42 @@ contact={
         "name": "Souhail EL MOUSADDEQ",
         "url": "https://github.com/Swellisgood",
     },
-
+lifespan=lifespan,
 )
 
+def _record_request(request, status_code):
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    metrics.REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - request.state.received_at)
+    metrics.REQUESTS.labels(request.method, endpoint, status_code).inc()
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    # Count and time every request by route template (/filter-by, not /filter-by?column=...)
+    request.state.received_at = time.perf_counter()
+    profiler = None
+    if settings.PROFILING_ENABLED and "1" in (request.query_params.get("profile"), request.headers.get("x-profile")):
+        profiler = metrics.RequestProfiler()
+        profiler.start()
+    try:
+        response = await call_next(request)
+    except Exception:
+        # an unhandled error is answered 500 by the server: counted as such
+        _record_request(request, 500)
+        if profiler is not None:
+            profiler.stop()
+        raise
+    _record_request(request, response.status_code)
+    if profiler is None:
+        return response
+    # the report replaces the response, once its body (streamed or not) has been fully produced
+    async for _ in response.body_iterator:
+        pass
+    report = profiler.stop()
+    return PlainTextResponse(report, headers={"X-Profiled-Status": str(response.status_code)})
+
+
 @app.get("/")
 async def root():
     message = """Welcome to the Getaround API. Add /docs to the end of this address to see the documentation for the API on the Pricing dataset."""
@@ -61,6 +313,12 @@ async def root():
 
 
 
+def _check_category(column, v):
+    allowed = get_vocabulary()
+    assert v in allowed.values[column], allowed.error_message(column)
+    return v
+
+
 # Defining required input for the prediction endpoint
 class Features(BaseModel):
     model_key: str
@@ -79,33 +337,22 @@ class Features(BaseModel):
 
 
 # catching errors for all columns except booleans
+# allowed values are the categories the model was fitted on (see the /vocabulary endpoint)
     @validator('model_key')
     def model_key_must_be_valid(cls, v):
-        assert v in ['Citroën', 'Peugeot', 'PGO', 'Renault', 'Audi', 'BMW', 'Ford',
-       'Mercedes', 'Opel', 'Porsche', 'Volkswagen', 'KIA Motors','Alfa Romeo', 'Ferrari', 'Fiat', 'Lamborghini', 'Maserati',
-       'Lexus', 'Honda', 'Mazda', 'Mini', 'Mitsubishi', 'Nissan', 'SEAT','Subaru', 'Toyota', 'Suzuki', 'Yamaha'], \
-        f"model_key must be one of the following: ['Citroën', 'Peugeot', 'PGO', 'Renault', 'Audi', 'BMW', 'Ford', \
-       'Mercedes', 'Opel', 'Porsche', 'Volkswagen', 'KIA Motors','Alfa Romeo', 'Ferrari', 'Fiat', 'Lamborghini', 'Maserati', \
-       'Lexus', 'Honda', 'Mazda', 'Mini', 'Mitsubishi', 'Nissan', 'SEAT','Subaru', 'Toyota', 'Suzuki', 'Yamaha']"
-        return v
+        return _check_category('model_key', v)
 
     @validator('fuel')
     def fuel_must_be_valid(cls, v):
-        assert v in ['diesel', 'petrol', 'hybrid_petrol', 'electro'], \
-        f"fuel must be one of the following: ['diesel', 'petrol', 'hybrid_petrol', 'electro']"
-        return v
+        return _check_category('fuel', v)
     
     @validator('paint_color')
     def paint_color_must_be_valid(cls, v):
-        assert v in ['black', 'white', 'red', 'silver', 'grey', 'blue', 'orange','beige', 'brown', 'green'], \
-        f"paint_color must be one of the following: ['black', 'white', 'red', 'silver', 'grey', 'blue', 'orange','beige', 'brown', 'green']"
-        return v
+        return _check_category('paint_color', v)
     
     @validator('car_type')
     def car_type_must_be_valid(cls, v):
-        assert v in ['sedan', 'hatchback', 'suv', 'van', 'estate', 'convertible', 'coupe', 'subcompact'], \
-        f"car_type must be one of the following: ['sedan', 'hatchback', 'suv', 'van', 'estate', 'convertible', 'coupe', 'subcompact']"
-        return v
+        return _check_category('car_type', v)
 
     @validator('mileage')
     def mileage_must_be_positive(cls, v):
@@ -119,7 +366,7 @@ class Features(BaseModel):
 
 # endpoint to predict the price of a car
 @app.post("/predict")
-async def predict(features:Features):
+async def predict(request: Request, features:Features):
     """Get the predicted price of a car. 
     Example of input:
 
@@ -141,74 +388,528 @@ async def predict(features:Features):
 
     Should return : "prediction": 156.3555450439453
 
-    All entries are case sensitive. List of possible values for categorical columns are available in the /unique-values endpoint.
+    All entries are case sensitive. List of possible values for categorical columns are available in the /vocabulary endpoint.
     Wrong values will return a specific error message."""
-    
-    # Read data 
-    data = pd.DataFrame(dict(features), index=[0])
-    # Load model
-    loaded_model = load('gbr_model.joblib')
-    #Prediction
-    prediction = loaded_model.predict(data)
+    # body parsing and validation happen before the handler is called
+    observe_stage("parse_validate", time.perf_counter() - request.state.received_at)
+
+    if settings.MICROBATCH_ENABLED:
+        # Prediction, grouped with the other requests of the same time window
+        prediction = await batcher.submit(dict(features))
+        return Response(content=encode_json({"predictions": prediction}), media_type="application/json")
+
+    #Prediction (model loaded at startup)
+    prediction = predict_records([dict(features)])
     #Load response
-    response ={"predictions": prediction.tolist()[0]}
-    return response
+    response ={"predictions": prediction[0]}
+    return Response(content=encode_json(response), media_type="application/json")
+
+
+def _check_chunk_size(chunk_size):
+    if chunk_size is None:
+        return settings.BATCH_CHUNK_SIZE
+    if not 1 <= chunk_size <= settings.BATCH_MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=422, detail=f"chunk_size must be between 1 and {settings.BATCH_MAX_CHUNK_SIZE}")
+    return chunk_size
+
+
+def _predict_chunks(chunks):
+    # One vectorized model call per chunk, results streamed one NDJSON line per car
+    model = get_predictor()
+    for offset, chunk in chunks:
+        prediction = model.predict_frame(chunk)
+        with stage("serialize"):
+            lines = ndjson_lines({"index": offset + i, "prediction": p} for i, p in enumerate(prediction.tolist()))
+        yield lines
+
+
+def _predict_file_chunks(chunks):
+    # Rows are checked column by column, rows that fail are reported in place and left out of the prediction
+    # model and vocabulary of the same version, even if the model is reloaded meanwhile
+    current = get_pricing()
+    model, allowed = current.predictor, current.vocabulary
+    rows = 0
+    while True:
+        try:
+            item = next(chunks, None)
+        except ValueError as e:
+            # a malformed line (e.g. too many fields): the rest of the file cannot be read
+            yield ndjson_lines([{"index": rows, "error": f"file could not be read from this row on: {str(e).strip()}"}])
+            return
+        if item is None:
+            return
+        offset, chunk = item
+        rows = offset + len(chunk)
+        valid, errors = validate_frame(chunk, allowed)
+        prediction = model.predict_frame(valid) if len(valid) else None
+        with stage("serialize"):
+            lines = result_lines(offset, chunk, valid, errors, prediction)
+        yield lines
+
+
+@app.post("/predict/batch")
+async def predict_batch(features: List[Features], chunk_size: Union[int, None] = Query(default=None)):
+    """Get the predicted prices of a list of cars : Input is a JSON list of cars (same format as /predict).
+
+    The cars are priced with one model call per chunk of `chunk_size` cars (optional, default 1000).
+    The response is streamed as newline-delimited JSON, one line per car, in input order:
+
+    {"index": 0, "prediction": 156.3555450439453}"""
+    chunk_size = _check_chunk_size(chunk_size)
+    data = records_to_frame([dict(f) for f in features])
+    return StreamingResponse(_predict_chunks(iter_chunks(data, chunk_size)), media_type="application/x-ndjson")
+
+
+@app.post("/predict/batch/file")
+def predict_batch_file(file: UploadFile = File(...), chunk_size: Union[int, None] = Query(default=None)):
+    """Get the predicted prices of the cars of a file : Input is a .csv file, or a .ndjson / .json file (one car per
+    line), with the same columns as /predict.
+
+    The file is read and priced `chunk_size` rows at a time (optional, default 1000).
+    The response is streamed as newline-delimited JSON, one line per car.
+    Rows with wrong values return an error line instead of a prediction :
+
+    {"index": 3, "error": "fuel: fuel must be one of the following: [...]"}"""
+    chunk_size = _check_chunk_size(chunk_size)
+    try:
+        chunks = iter_file_chunks(file.file, file.filename, chunk_size)
+        first = next(chunks, None)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if first is None:
+        raise HTTPException(status_code=422, detail="Uploaded file is empty")
+
+    def all_chunks():
+        yield first
+        yield from chunks
+    return StreamingResponse(_predict_file_chunks(all_chunks()), media_type="application/x-ndjson")
+
+# A feature to vary in /predict/sensitivity : listed values, or a range for mileage and engine_power
+class Sweep(BaseModel):
+    feature: str
+    values: Union[List[Union[bool, int, float, str]], None] = None
+    start: Union[float, None] = None
+    stop: Union[float, None] = None
+    step: Union[float, None] = None
+
+
+class SensitivityRequest(BaseModel):
+    features: Features
+    sweeps: List[Sweep] = []
+
+
+@app.post("/predict/sensitivity")
+def predict_sensitivity(body: SensitivityRequest):
+    """Get how the predicted price of a car changes with one feature at a time (the others unchanged) :
+    Input is a car (same format as /predict) and the features to vary, each one with either
+    - values : the values to price, e.g. {"feature": "fuel", "values": ["diesel", "petrol"]}
+    - start (included), stop (excluded) and step, for mileage and engine_power, e.g.
+      {"feature": "mileage", "start": 0, "stop": 300000, "step": 10000}
+    - nothing : both values of a flag (has_gps...) or every category the model knows (fuel...)
+
+    Without sweeps, every equipment flag is toggled. Every variation of the car is priced in a single model call.
+
+    {"features": {...same as /predict...}, "sweeps": [{"feature": "mileage", "start": 0, "stop": 300000, "step": 50000},
+    {"feature": "has_gps"}]}
+
+    Should return the price of the car, then for each feature the values, their prices and the difference with the
+    price of the car :
+
+    {"prediction": 156.36, "points": 9, "curves": {"mileage": {"values": [0.0, 50000.0, ...], "predictions": [...],
+    "differences": [...]}, "has_gps": {...}}}"""
+    current = get_pricing()
+    sweeps = {}
+    try:
+        for sweep in body.sweeps or [Sweep(feature=flag) for flag in BOOLEAN_FEATURES]:
+            if sweep.feature in sweeps:
+                raise ValueError(f"{sweep.feature}: swept twice")
+            remaining = settings.SENSITIVITY_MAX_POINTS - sum(len(values) for values in sweeps.values())
+            sweeps[sweep.feature] = sweep_values(
+                sweep.feature, current.vocabulary, sweep.values, sweep.start, sweep.stop, sweep.step, max_values=remaining,
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    result = price_curves(current.predictor, dict(body.features), sweeps)
+    return Response(content=encode_json(result), media_type="application/json")
+
+
+@app.post("/jobs/predict", status_code=202)
+def create_job(file: UploadFile = File(...), chunk_size: Union[int, None] = Query(default=None)):
+    """Price the cars of a file in the background : Input is a .csv file or a .ndjson file (one car per line) with
+    the same columns as /predict, of any size.
+
+    Returns the job at once, with its id and rows_total counted from the lines of the file (exact once the job is
+    done). The file is priced `chunk_size` rows at a time (optional, default 5000)
+    on all the cores of the server; follow the progress with /jobs/{id} and get the prices with /jobs/{id}/result.
+
+    {"id": "3f2a...", "status": "queued", "rows_total": 4843, "rows_done": 0, "progress_percent": 0.0, ...}"""
+    if job_store is None:
+        raise HTTPException(status_code=503, detail="Pricing jobs are disabled")
+    chunk_size = settings.JOBS_CHUNK_SIZE if chunk_size is None else _check_chunk_size(chunk_size)
+    try:
+        job = job_store.create(file.file, file.filename, chunk_size)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    job_runner.notify()
+    return job_info(job)
+
+
+def _get_job(job_id):
+    if job_store is None:
+        raise HTTPException(status_code=503, detail="Pricing jobs are disabled")
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job {job_id}")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status (queued, running, done or failed) and progress of a pricing job : rows priced so far, rows with
+    errors, version of the model used.
+
+    Example suffix : /jobs/3f2a9c0e5d1b4e8f9a7c6b5d4e3f2a1b"""
+    return job_info(_get_job(job_id))
+
+
+async def _follow_result(job):
+    # the lines written so far by the current run of the job, then the next ones as it writes them, until it is
+    # finished. The stream ends early if the job is deleted, run again after its worker stopped, or left without
+    # heartbeat for HEARTBEAT_TIMEOUT seconds (its runner is gone, the job will be queued again).
+    job_id, token = job["id"], job["run_token"]
+    try:
+        result = open(job_store.result_path(job), "rb")
+    except FileNotFoundError:
+        return
+    with result:
+        while True:
+            block = result.read(1 << 16)
+            if block:
+                yield block
+                continue
+            job = job_store.get(job_id)
+            if job is None or job["run_token"] != token:
+                return
+            if job["status"] in FINISHED:
+                # lines written between the last read and the end of the job
+                yield result.read()
+                return
+            if datetime.fromisoformat(job["heartbeat_at"]) < datetime.now(timezone.utc) - timedelta(seconds=HEARTBEAT_TIMEOUT):
+                return
+            await asyncio.sleep(0.2)
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Get the predicted prices of a pricing job, as newline-delimited JSON (same lines as /predict/batch/file) :
+
+    {"index": 0, "prediction": 156.3555450439453}
+
+    While the job is running, the response streams the prices as they are computed and ends with the job. While it is
+    queued, returns 202 with the job (as /jobs/{id}) : ask again later.
+
+    Example suffix : /jobs/3f2a9c0e5d1b4e8f9a7c6b5d4e3f2a1b/result"""
+    job = _get_job(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['error']}")
+    if job["run_token"] is None:
+        return JSONResponse(status_code=202, content=job_info(job), headers={"Retry-After": "1"})
+    return StreamingResponse(_follow_result(job), media_type="application/x-ndjson")
+
+
+@app.get("/models")
+async def models():
+    """Get the models currently served by the API : name, file, version (content hash) and load time.
+
+    Models are reloaded automatically when their .joblib file changes on disk."""
+    return registry.info()
+
+
+@app.get("/models/batcher")
+async def batcher_stats():
+    """Get the metrics of the /predict micro-batcher : current queue depth, number of requests and batches,
+    and how many batches of each size were run."""
+    return {"enabled": settings.MICROBATCH_ENABLED, **batcher.info()}
+
+
+@app.get("/vocabulary")
+async def get_vocabulary_values(request: Request):
+    """Get the allowed values of the categorical features (model_key, fuel, paint_color, car_type).
+
+    They are the categories the served model was fitted on, any other value is rejected by /predict.
+    The response carries an ETag and only changes when a new model is loaded."""
+    current = get_pricing()
+    body = encode_json(current.vocabulary.info())
+    etag = '"{}"'.format(current.loaded.version)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "public, max-age=300"})
+
+
+@app.get("/dataset")
+async def dataset_info():
+    """Get the version (content hash), size and load time of the pricing dataset held in memory.
+
+    The dataset is reloaded automatically when df_pricing.csv changes on disk."""
+    return {**_loaded_dataset(datasets).info(), "result_cache": result_cache.info()}
 
 
 # Endpoints to explore the dataset
 
+def _check_column(dataset, column):
+    if column not in dataset.columns:
+        raise HTTPException(status_code=422, detail=f"column must be one of the following: {dataset.columns}")
+
+
+def _cached_response(request, key, compute):
+    # Serve the pre-encoded result, or 304 if the client already has this version of it
+    entry = result_cache.get_or_compute(key, compute)
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers={"ETag": entry.etag})
+    return Response(content=entry.body, media_type="application/json", headers={"ETag": entry.etag})
+
+
 @app.get("/preview")
-async def preview(rows: int):
-    """ Get preview of dataset : Input number of preview rows as integer"""
-    data = pd.read_csv('df_pricing.csv')
-    preview = data.head(rows)
-    return preview.to_dict()
+async def preview(rows: int, offset: int = 0, fields: Union[str, None] = None, format: str = "dict"):
+    """ Get preview of dataset : Input number of preview rows as integer
+
+    Optional parameters :
+    - offset : index of the first row (default 0), use it with the X-Next-Offset response header to page through the dataset
+    - fields : comma-separated list of the columns to return (default all), ex : model_key,mileage
+    - format : dict (default, {column: {row: value}}), records (list of rows), ndjson or csv (streamed)
+
+    At most 1000 rows are returned by the dict and records formats.
+
+    Example suffix : /preview?rows=10&fields=model_key,rental_price_per_day&format=records"""
+    data = _loaded_dataset(datasets).frame
+    return rows_response(data, offset, rows, fields, format, settings.MAX_PAGE_SIZE, settings.STREAM_CHUNK_SIZE)
 
 @app.get("/unique-values")
 async def get_unique(column: str):
     """ Get unique values by given column : Input name of column (string).
 
-    Example suffix : /unique-values?column=model_key
-
-    N.B.: Attempting to get unique values for the rental_price_per_day or mileage column will return an error."""
-    data = pd.read_csv('df_pricing.csv')
-    selection = data[column].unique()
-    return list(selection)
+    Example suffix : /unique-values?column=model_key"""
+    dataset = _loaded_dataset(datasets)
+    _check_column(dataset, column)
+    return dataset.unique_values(column)
 
 @app.get("/groupby")
-async def groupby_agg(column:str,parameter:str):
+async def groupby_agg(request: Request, column:str,parameter:str):
     """ Get data grouped by given column : Input parameters are 1) column (string), 2) aggregation parameter (string).
 
+    Columns the aggregation does not apply to (e.g. the mean of a categorical column) are left out.
+    Results are cached and carry an ETag : send it back in If-None-Match to get a 304 when nothing changed.
+
     Example suffix : /groupby?column=model_key&parameter=mean"""
-    data = pd.read_csv('df_pricing.csv')
-    data_group = data.groupby(column).agg(parameter)
-    return data_group.to_dict()
+    dataset = _loaded_dataset(datasets)
+    _check_column(dataset, column)
+    key = ("groupby", column, parameter, dataset.version)
+    return _cached_response(request, key, lambda: dataset.groupby(column, parameter).to_dict())
 
 @app.get("/filter-by")
-async def get_filtered(column:str,category:str):
+async def get_filtered(column:str,category:str, offset: int = 0, limit: Union[int, None] = None, fields: Union[str, None] = None, format: str = "dict"):
     """ Get filtered data for given column : Input parameters are 1) column (string), 2) category (string).
 
+    Optional parameters are the same as for /preview, plus limit (number of rows, at most 1000 for the dict and
+    records formats). Without limit, all the matching rows are returned, except by the records format which returns
+    the first 1000 and the offset of the next page.
+    The X-Total-Count response header gives the number of matching rows.
+
     Example suffix : /filter-by?column=model_key&category=Toyota"""
-    data = pd.read_csv('df_pricing.csv')
-    filtered = data.loc[data[column] == category]
-    return filtered.to_dict()
+    dataset = _loaded_dataset(datasets)
+    _check_column(dataset, column)
+    filtered = dataset.filter_rows(column, category)
+    return rows_response(filtered, offset, limit, fields, format, settings.MAX_PAGE_SIZE, settings.STREAM_CHUNK_SIZE)
 
 @app.get("/quantile")
-async def get_quantile(column:str,decimal:float):
+async def get_quantile(request: Request, column:str,decimal:float):
     """Get quantile for given column : Input parameters are 1) column (string), 2) quantile (float between 0 and 1, ex : 0.2). 
 
     The interpolation method used when the desired quantile is between 2 data points is 'nearest' for categorical data and 'linear' for numerical data.
+    Results are cached and carry an ETag, as for /groupby.
 
     Example suffix : /quantile?column=mileage&decimal=0.75"""
-    data = pd.read_csv('df_pricing.csv')
+    dataset = _loaded_dataset(datasets)
+    _check_column(dataset, column)
+    key = ("quantile", column, decimal, dataset.version)
+    return _cached_response(request, key, lambda: dataset.quantile(column, decimal))
+
+
+
+# Endpoints of the delay analysis
+
+@app.get("/delay/threshold-impact")
+async def threshold_impact(request: Request, thresholds: Union[str, None] = None, start: float = 0, stop: float = 720, step: float = 15):
+    """Get the impact of minimum delays between two rentals of a car, for each threshold (in minutes) :
+    - impacted : rentals booked less than `threshold` minutes after the previous one, which could not happen anymore
+    - solved : rentals overlapped by a late checkout of less than `threshold` minutes, which the delay would have avoided
+
+    Thresholds are either listed (thresholds=30,60,165) or taken from start (included, default 0) to stop
+    (excluded, default 720) every step minutes (default 15). Counts are given per checkin type and in total.
+
+    Example suffix : /delay/threshold-impact?start=0&stop=720&step=1"""
+    if thresholds is not None:
+        try:
+            values = [float(t) for t in thresholds.split(",") if t.strip()]
+        except ValueError:
+            raise HTTPException(status_code=422, detail="thresholds must be a comma-separated list of minutes")
+        if not all(math.isfinite(t) for t in values):
+            raise HTTPException(status_code=422, detail="thresholds must be finite numbers of minutes")
+    elif not all(math.isfinite(v) for v in (start, stop, step)):
+        raise HTTPException(status_code=422, detail="start, stop and step must be finite numbers of minutes")
+    elif step <= 0 or stop <= start:
+        raise HTTPException(status_code=422, detail="step must be positive and stop greater than start")
+    elif (stop - start) / step > settings.MAX_THRESHOLDS:
+        values = []
+    else:
+        values = np.arange(start, stop, step).tolist()
+    if not values or len(values) > settings.MAX_THRESHOLDS:
+        raise HTTPException(status_code=422, detail=f"between 1 and {settings.MAX_THRESHOLDS} thresholds must be given")
+    dataset = _loaded_dataset(delays)
+    engine = dataset.engine
+    key = ("threshold-impact", tuple(values), dataset.version)
+    return _cached_response(request, key, lambda: {
+        "rentals": engine.rentals,
+        "following_rentals": engine.following(),
+        "conflicts": engine.conflict_count(),
+        "thresholds": engine.sweep(values).to_dict("records"),
+    })
+
+
+@app.get("/delay/summary")
+async def delay_summary(request: Request, histogram: bool = False, ecdf: bool = False):
+    """Get the summary of the delay analysis : number of rentals, of rentals following another one, of conflicts
+    (rentals overlapped by a late checkout), and the distribution of the late checkout delays (count, mean,
+    standard deviation, quantiles) in total and per checkin type.
+
+    Optional : histogram=true adds the 500-bin histogram of the delays, ecdf=true their cumulative distribution
+    (percentage of delays under each minute from 0 to 720).
+
+    Example suffix : /delay/summary?histogram=true"""
+    dataset = _loaded_dataset(delays)
+    engine = dataset.engine
+    key = ("delay-summary", histogram, ecdf, dataset.version)
+    return _cached_response(request, key, lambda: {
+        "rentals": engine.rentals,
+        "following_rentals": engine.following(),
+        "conflicts": engine.conflict_count(),
+        "conflict_percent": engine.conflict_count() / engine.rentals * 100 if engine.rentals else None,
+        "late_checkouts": {
+            checkin_type: distribution.to_dict(histogram=histogram, ecdf=ecdf)
+            for checkin_type, distribution in dataset.late_checkouts.items()
+        },
+    })
+
+
+@app.get("/delay/cost")
+async def delay_cost(request: Request, price_per_day: Union[float, None] = None):
+    """Get the revenue lost to late checkouts : for each checkin type, rental price per minute x median delay x
+    number of late checkouts, and the total.
+
+    The rental price is the average rental_price_per_day of the pricing dataset, or the optional price_per_day.
+
+    Example suffix : /delay/cost?price_per_day=120"""
+    if price_per_day is not None and not (math.isfinite(price_per_day) and price_per_day > 0):
+        raise HTTPException(status_code=422, detail="price_per_day must be a positive number")
+    dataset = _loaded_dataset(delays)
+    key = ("delay-cost", price_per_day, dataset.version)
+    if price_per_day is None:
+        pricing = _loaded_dataset(datasets)
+        key += (pricing.version,)
+        price_per_day = float(pricing.frame["rental_price_per_day"].mean())
+
+    def compute():
+        costs = delay_costs(dataset.late_checkouts, price_per_day)
+        return {
+            "price_per_day": price_per_day,
+            "price_per_minute": price_per_day / (24 * 60),
+            "late_checkouts": {
+                checkin_type: {
+                    "count": distribution.count,
+                    "median_delay_minutes": distribution.median,
+                    "cost": costs[checkin_type],
+                }
+                for checkin_type, distribution in dataset.late_checkouts.items()
+                if checkin_type in costs
+            },
+            "total_cost": costs["total"],
+        }
+    return _cached_response(request, key, compute)
+
+
+@app.post("/ingest/{dataset}")
+def ingest_rows(dataset: str, rows: List[dict]):
+    """Append rows to the pricing or delay dataset. The counts, threshold sweeps, distributions and indexes of the
+    API are updated with the new rows only, and the dashboard picks them up at its next refresh.
+
+    A row of the delay dataset needs rental_id, car_id, checkin_type, state, delay_at_checkout_in_minutes,
+    previous_ended_rental_id and time_delta_with_previous_rental_in_minutes (the last three may be null);
+    delay_category and next_rental are derived. A row of the pricing dataset needs the columns of /predict, with the
+    same allowed values (see /vocabulary), and rental_price_per_day. Ids, mileage, engine_power and prices must be at
+    most 2147483647. If any row is invalid, none is added.
+
+    Files (.csv, .ndjson, .parquet) dropped in the ingest/delay or ingest/pricing directory are added the same way.
+
+    Example suffix : /ingest/delay with the body
+    [{"rental_id": 600000, "car_id": 12345, "checkin_type": "mobile", "state": "ended",
+    "delay_at_checkout_in_minutes": 35, "previous_ended_rental_id": null, "time_delta_with_previous_rental_in_minutes": null}]"""
+    if dataset not in SCHEMAS:
+        raise HTTPException(status_code=404, detail=f"dataset must be one of the following: {list(SCHEMAS)}")
+    if len(rows) > settings.INGEST_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.INGEST_MAX_ROWS} rows can be ingested per request")
     try:
-        data_quantile = data[column].quantile(decimal,interpolation='linear')
-    except:
-        data_quantile = data[column].quantile(decimal,interpolation='nearest')
-    return data_quantile
+        return ingest(stores[dataset], dataset, pd.DataFrame.from_records(rows), get_vocabulary())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Get the metrics of the API in the Prometheus text format : requests and latency per endpoint,
+    time spent per stage (parse_validate, build_frame, preprocess, predict, serialize), result cache events,
+    model loads and micro-batch sizes.
+
+    Under gunicorn, the metrics of all the workers are added up."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness probe : 200 as long as the worker answers."""
+    return {"status": "alive", "pid": os.getpid()}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness probe : 200 once the models and datasets are loaded (by this worker, or by the gunicorn master
+    before it was forked) and this worker has priced a first car, 503 until then.
+
+    Also returns how long each startup step took : import of the app, loading, warm-up prediction.
+    With STARTUP_MODE=lazy the datasets are loaded after the worker is ready ("loading" until then), 503 if that
+    load failed."""
+    if not warm["done"] or warm["prediction_pid"] != os.getpid():
+        raise HTTPException(status_code=503, detail="Models and datasets are still loading")
+    if warm["datasets_error"] is not None and not all(store.loaded for store in stores.values()):
+        raise HTTPException(status_code=503, detail=f"The datasets could not be loaded: {warm['datasets_error']}")
+
+    def seconds(key):
+        return round(warm[key], 3) if warm[key] is not None else None
+    return {
+        "status": "ready",
+        "pid": os.getpid(),
+        "startup_mode": settings.STARTUP_MODE,
+        # the process that loaded them: the gunicorn master when the app is preloaded
+        "loaded_by": warm["pid"],
+        "startup_seconds": {step: seconds(step + "_seconds") for step in ["import", "load", "datasets", "prediction"]},
+        "models": {loaded["name"]: loaded["version"] for loaded in registry.info()},
+        "datasets": {name: store.get().version if store.loaded else "loading" for name, store in stores.items()},
+    }
 
 
+warm["import_seconds"] = time.perf_counter() - _import_started
 
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host = "0.0.0.0", port = 4000, debug=True, reload=True)
\ No newline at end of file
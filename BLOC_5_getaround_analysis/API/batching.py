@@ -0,0 +1,65 @@
+import json
+
+import pandas as pd
+
+# Columns expected by the pricing model, in training order
+FEATURE_COLUMNS = [
+    "model_key",
+    "mileage",
+    "engine_power",
+    "fuel",
+    "paint_color",
+    "car_type",
+    "private_parking_available",
+    "has_gps",
+    "has_air_conditioning",
+    "automatic_car",
+    "has_getaround_connect",
+    "has_speed_regulator",
+    "winter_tires",
+]
+
+
+def records_to_frame(records):
+    """Build a single DataFrame (model column order) from a list of feature dicts."""
+    return pd.DataFrame.from_records(records, columns=FEATURE_COLUMNS)
+
+
+def iter_chunks(frame, chunk_size):
+    """Yield (offset, chunk) slices of `frame` of at most `chunk_size` rows."""
+    for start in range(0, len(frame), chunk_size):
+        yield start, frame.iloc[start:start + chunk_size]
+
+
+def iter_file_chunks(file, filename, chunk_size):
+    """Read an uploaded CSV or NDJSON file lazily, `chunk_size` rows at a time.
+
+    The format is taken from the file extension (.csv, .ndjson / .jsonl / .json, one object per line)."""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        reader = pd.read_csv(file, chunksize=chunk_size)
+    elif name.endswith((".ndjson", ".jsonl", ".json")):
+        reader = pd.read_json(file, lines=True, chunksize=chunk_size)
+    else:
+        raise ValueError("Uploaded file must be a .csv, .ndjson or .json file")
+    offset = 0
+    for chunk in reader:
+        yield offset, chunk
+        offset += len(chunk)
+
+
+def ndjson_lines(rows):
+    """Encode each dict of `rows` as one line of newline-delimited JSON."""
+    return "".join(json.dumps(row) + "\n" for row in rows)
+
+
+def result_lines(offset, chunk, valid, errors, predictions):
+    """NDJSON lines of a chunk of a file starting at row `offset`, in input order: the prediction of each `valid`
+    row, the message of each row of `errors` ({position in the chunk: message})."""
+    rows = [{"index": offset + i, "error": message} for i, message in errors.items()]
+    if len(valid):
+        index = valid.index - chunk.index[0] + offset
+        rows += [{"index": int(i), "prediction": p} for i, p in zip(index, predictions.tolist())]
+    if errors:
+        rows.sort(key=lambda row: row["index"])
+    return ndjson_lines(rows)
@@ -0,0 +1,260 @@
+"""Benchmarks of the Getaround API.
+
+Runs entirely locally: requests go through FastAPI's ASGI transport (no network, no server to start) unless
+--base-url points to a running server (e.g. a local uvicorn).
+
+    python bench.py                                  # all scenarios, results printed as JSON
+    python bench.py --output bench.json              # ... and written to bench.json
+    python bench.py --baseline bench.json            # fail (exit code 1) if slower than the stored run
+    python bench.py --scenarios predict,groupby -n 500
+
+Each scenario reports latency percentiles (p50/p95/p99, in ms) and throughput (requests per second).
+The cold_start scenario imports the app in a fresh interpreter and reports import, startup and first request
+times. Peak RSS is the peak resident memory of this process (and of the cold start interpreter).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CAR = {
+    "model_key": "Toyota",
+    "mileage": 25000,
+    "engine_power": 130,
+    "fuel": "diesel",
+    "paint_color": "red",
+    "car_type": "sedan",
+    "private_parking_available": True,
+    "has_gps": True,
+    "has_air_conditioning": True,
+    "automatic_car": False,
+    "has_getaround_connect": True,
+    "has_speed_regulator": True,
+    "winter_tires": True,
+}
+
+# Metrics compared with the baseline: name -> True when higher is better
+COMPARED_METRICS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "throughput_rps": True}
+
+
+def _cars(n):
+    return [dict(CAR, mileage=1000 * (i % 300), engine_power=80 + i % 150) for i in range(n)]
+
+
+# name -> (method, path, request kwargs, requests sent concurrently)
+SCENARIOS = {
+    "predict": ("POST", "/predict", {"json": CAR}, 1),
+    "predict_concurrent": ("POST", "/predict", {"json": CAR}, 32),
+    "predict_batch_1000": ("POST", "/predict/batch", {"json": _cars(1000)}, 1),
+    "preview": ("GET", "/preview", {"params": {"rows": 100}}, 1),
+    "preview_ndjson": ("GET", "/preview", {"params": {"rows": 5000, "format": "ndjson"}}, 1),
+    "unique_values": ("GET", "/unique-values", {"params": {"column": "model_key"}}, 1),
+    "groupby": ("GET", "/groupby", {"params": {"column": "model_key", "parameter": "mean"}}, 1),
+    "filter_by": ("GET", "/filter-by", {"params": {"column": "model_key", "category": "Citroën"}}, 1),
+    "quantile": ("GET", "/quantile", {"params": {"column": "mileage", "decimal": 0.75}}, 1),
+    "delay_threshold_impact": ("GET", "/delay/threshold-impact", {"params": {"step": 1}}, 1),
+    "delay_summary": ("GET", "/delay/summary", {}, 1),
+    "delay_cost": ("GET", "/delay/cost", {}, 1),
+}
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(latencies, elapsed):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+async def run_scenario(client, method, path, kwargs, concurrency, n, warmup):
+    async def one():
+        start = time.perf_counter()
+        response = await client.request(method, path, **kwargs)
+        await response.aread()
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}: {response.text[:200]}")
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        await one()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(0, n, concurrency):
+        latencies.extend(await asyncio.gather(*[one() for _ in range(concurrency)]))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run_scenarios(names, n, warmup, base_url=None):
+    results = {}
+    if base_url:
+        client = httpx.AsyncClient(base_url=base_url, timeout=60)
+        lifespan = None
+    else:
+        sys.path.insert(0, HERE)
+        os.chdir(HERE)
+        import app as api
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://bench", timeout=60)
+        lifespan = api.lifespan(api.app)
+        await lifespan.__aenter__()
+    try:
+        async with client:
+            for name in names:
+                method, path, kwargs, concurrency = SCENARIOS[name]
+                # batch requests are heavy: send fewer of them
+                count = max(concurrency, n // 20) if name.startswith("predict_batch") else n
+                results[name] = await run_scenario(client, method, path, kwargs, concurrency, count, warmup)
+                print(f"{name}: {results[name]}", file=sys.stderr)
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+    return results
+
+
+COLD_START = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import app as api
+imported = time.perf_counter()
+import httpx
+
+async def main():
+    async with api.lifespan(api.app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            t = time.perf_counter()
+            (await client.post("/predict", json=CAR)).raise_for_status()
+            first = time.perf_counter() - t
+            t = time.perf_counter()
+            (await client.post("/predict", json=CAR)).raise_for_status()
+            second = time.perf_counter() - t
+    return started, first, second
+
+started, first, second = asyncio.run(main())
+print(json.dumps({
+    "import_seconds": imported - start,
+    "startup_seconds": started - imported,
+    "first_predict_ms": first * 1000,
+    "warm_predict_ms": second * 1000,
+}))
+"""
+
+
+def run_cold_start(repeat):
+    """Start the app in `repeat` fresh interpreters, keep the median of each measure."""
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", f"CAR = {CAR!r}\n" + COLD_START],
+            cwd=HERE, capture_output=True, text=True, check=True,
+        )
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    result = {key: round(float(np.median([run[key] for run in runs])), 4) for key in runs[0]}
+    result["runs"] = repeat
+    result["peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    print(f"cold_start: {result}", file=sys.stderr)
+    return result
+
+
+def compare(results, baseline, tolerance, min_delta_ms=1.0):
+    """List the metrics of `results` worse than `baseline` by more than `tolerance` (a fraction).
+
+    Latency changes smaller than `min_delta_ms` are ignored: sub-millisecond timings are too noisy."""
+    regressions = []
+    for name, metrics in results.get("scenarios", {}).items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if reference is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in metrics or metric not in reference or not reference[metric]:
+                continue
+            if metric.endswith("_ms") and abs(metrics[metric] - reference[metric]) < min_delta_ms:
+                continue
+            change = (metrics[metric] - reference[metric]) / reference[metric]
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name}.{metric}: {reference[metric]} -> {metrics[metric]} ({change:+.0%})")
+    cold, reference = results.get("cold_start"), baseline.get("cold_start")
+    if cold and reference:
+        for metric in ("import_seconds", "startup_seconds", "first_predict_ms"):
+            if reference.get(metric) and (cold[metric] - reference[metric]) / reference[metric] > tolerance:
+                regressions.append(f"cold_start.{metric}: {reference[metric]} -> {cold[metric]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Getaround API")
+    parser.add_argument("--scenarios", default=",".join(list(SCENARIOS) + ["cold_start"]),
+                        help="comma-separated scenarios among: " + ", ".join(list(SCENARIOS) + ["cold_start"]))
+    parser.add_argument("-n", "--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="requests sent before measuring each scenario")
+    parser.add_argument("--cold-starts", type=int, default=3, help="interpreters started by the cold_start scenario")
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown relative to the baseline before failing (default 0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="latency differences below this many ms never count as regressions (default 1)")
+    args = parser.parse_args(argv)
+    # the in-process app is run from this directory: resolve the files given on the command line first
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS and name != "cold_start"]
+    if unknown:
+        parser.error(f"unknown scenarios {unknown}")
+
+    results = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "target": args.base_url or "in-process",
+        "settings": {key: value for key, value in os.environ.items()
+                     if key.startswith(("INFERENCE_", "MICROBATCH_", "BATCH_", "RESULT_CACHE_"))},
+    }
+    if "cold_start" in names:
+        results["cold_start"] = run_cold_start(args.cold_starts)
+    scenario_names = [name for name in names if name != "cold_start"]
+    if scenario_names:
+        results["scenarios"] = asyncio.run(run_scenarios(scenario_names, args.requests, args.warmup, args.base_url))
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"REGRESSIONS (more than {args.tolerance:.0%} worse than {args.baseline}):", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print(f"No regression compared with {args.baseline}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
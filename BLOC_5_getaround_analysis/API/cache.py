@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from metrics import CACHE_EVENTS, stage
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    """A response body encoded once, with the ETag clients can send back in If-None-Match."""
+    body: bytes
+    etag: str
+    expires_at: float
+
+
+def encode_json(content):
+    # same encoding as FastAPI's default JSON response
+    with stage("serialize"):
+        return JSONResponse(content=jsonable_encoder(content)).body
+
+
+class ResultCache:
+    """Bounded LRU cache of encoded responses, each entry expiring after `ttl` seconds."""
+
+    def __init__(self, max_entries=256, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                CACHE_EVENTS.labels("expiration").inc()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                CACHE_EVENTS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_EVENTS.labels("hit").inc()
+            return entry
+
+    def put(self, key, body):
+        entry = CachedResponse(
+            body=body,
+            etag='"{}"'.format(hashlib.sha1(body).hexdigest()),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                CACHE_EVENTS.labels("eviction").inc()
+        return entry
+
+    def get_or_compute(self, key, compute):
+        """Return the cached entry for `key`, computing and encoding `compute()` on a miss."""
+        entry = self.get(key)
+        if entry is None:
+            entry = self.put(key, encode_json(compute()))
+        return entry
+
+    def clear(self, *_):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            CACHE_EVENTS.labels("invalidation").inc(len(self._entries))
+            self._entries.clear()
+
+    def info(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches `etag` (weak comparison, as for GET requests)."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
@@ -0,0 +1,328 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from registry import file_version
+from delay_analysis import (DELAY_COLUMN, DELTA_COLUMN, Distribution, ThresholdEngine, append_distributions,
+                            distributions)
+from storage import (commit_segment, concat, discard_segment, list_segments, read_segments, read_table, resolve,
+                     stage_segment)
+
+logger = logging.getLogger(__name__)
+
+CATEGORICAL_COLUMNS = ["model_key", "fuel", "paint_color", "car_type"]
+
+# columns of the delay dataset used by the /delay endpoints, the others are not read
+DELAY_COLUMNS = ["checkin_type", DELAY_COLUMN, DELTA_COLUMN]
+
+
+def read_pricing(path, columns=None):
+    """Read the pricing dataset with compact dtypes (category, bool, int32), from its Parquet/Arrow copy if there is one."""
+    return read_table(path, columns=columns)
+
+
+def build_index(series):
+    """Map each value of a categorical series to the sorted positions of the rows holding it.
+
+    Values are kept in order of first appearance, like `Series.unique()`."""
+    codes = series.cat.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(series.cat.categories) + 1))
+    positions = {
+        category: order[bounds[code]:bounds[code + 1]]
+        for code, category in enumerate(series.cat.categories)
+    }
+    return {value: positions[value] for value in series.unique() if not pd.isna(value)}
+
+
+def extend_index(index, series, offset):
+    """`build_index` of the rows of `index` followed by the rows of `series`, which start at position `offset`."""
+    extended = dict(index)
+    for value, positions in build_index(series).items():
+        positions = positions + offset
+        extended[value] = np.concatenate([index[value], positions]) if value in index else positions
+    return extended
+
+
+def segments_version(version, segments):
+    # "<file version>+<number of segments>": segments are only ever added, so their number tells which rows it holds
+    version = version.split("+")[0]
+    return f"{version}+{len(segments)}" if segments else version
+
+
+@dataclass(frozen=True)
+class PricingDataset:
+    """The pricing dataset held in memory, with a row index for each categorical column."""
+    path: str
+    frame: pd.DataFrame
+    version: str
+    mtime: float
+    loaded_at: datetime
+    indexes: Dict[str, Dict[str, np.ndarray]]
+    # names of the segments (rows ingested since the file was written) included, in the order they were applied
+    segments: Tuple[str, ...] = ()
+
+    @classmethod
+    def load(cls, path):
+        path = resolve(path)
+        mtime = os.path.getmtime(path)
+        segments = list_segments(path)
+        frame = concat([read_pricing(path), read_segments(path, segments) if segments else None])
+        return cls(
+            path=path,
+            frame=frame,
+            version=segments_version(file_version(path), segments),
+            mtime=mtime,
+            loaded_at=datetime.now(timezone.utc),
+            indexes={column: build_index(frame[column]) for column in CATEGORICAL_COLUMNS},
+            segments=tuple(segments),
+        )
+
+    def append(self, frame, segments):
+        """The dataset with the rows of `frame` (read from `segments`) added, indexing the new rows only."""
+        combined = concat([self.frame, frame[self.columns]])
+        new = combined.iloc[len(self.frame):]
+        segments = self.segments + tuple(segments)
+        return replace(
+            self,
+            frame=combined,
+            version=segments_version(self.version, segments),
+            loaded_at=datetime.now(timezone.utc),
+            indexes={column: extend_index(self.indexes[column], new[column], len(self.frame)) for column in CATEGORICAL_COLUMNS},
+            segments=segments,
+        )
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.frame.columns)
+
+    def unique_values(self, column):
+        if column in self.indexes:
+            return list(self.indexes[column])
+        return self.frame[column].unique().tolist()
+
+    def filter_rows(self, column, value):
+        """Rows where `column == value`, answered from the index for categorical columns."""
+        if column in self.indexes:
+            return self.frame.take(self.indexes[column].get(value, np.empty(0, dtype=np.intp)))
+        return self.frame.loc[self.frame[column] == value]
+
+    def groupby(self, column, parameter):
+        """`frame.groupby(column).agg(parameter)`, leaving out the columns the aggregation does not apply to."""
+        grouped = self.frame.groupby(column, observed=True)
+        try:
+            return grouped.agg(parameter)
+        except (TypeError, ValueError):
+            pass
+        # unordered categories do not support min/max/first...: aggregate them as plain strings
+        as_object = {c: object for c in CATEGORICAL_COLUMNS if c != column}
+        try:
+            return self.frame.astype(as_object).groupby(column, observed=True).agg(parameter)
+        except (TypeError, ValueError):
+            return grouped.agg(parameter, numeric_only=True)
+
+    def quantile(self, column, q):
+        """Quantile of a column, 'linear' interpolation for numerical data and 'nearest' otherwise."""
+        data = self.frame[column]
+        if isinstance(data.dtype, pd.CategoricalDtype):
+            data = data.astype(object)
+        try:
+            return data.quantile(q, interpolation="linear")
+        except TypeError:
+            return data.quantile(q, interpolation="nearest")
+
+    def info(self):
+        return {
+            "path": self.path,
+            "version": self.version,
+            "rows": len(self.frame),
+            "segments": len(self.segments),
+            "memory_bytes": int(self.frame.memory_usage(deep=True).sum()),
+            "file_modified_at": datetime.fromtimestamp(self.mtime, timezone.utc).isoformat(),
+            "loaded_at": self.loaded_at.isoformat(),
+        }
+
+
+@dataclass(frozen=True)
+class DelayDataset:
+    """The delay analysis dataset held in memory, with its threshold engine and the distribution of the late
+    checkouts (in total and per checkin type) built once per load."""
+    path: str
+    frame: pd.DataFrame
+    version: str
+    mtime: float
+    loaded_at: datetime
+    engine: ThresholdEngine
+    late_checkouts: Dict[str, Distribution]
+    segments: Tuple[str, ...] = ()
+
+    @classmethod
+    def load(cls, path):
+        path = resolve(path)
+        mtime = os.path.getmtime(path)
+        segments = list_segments(path)
+        frame = concat([read_table(path, columns=DELAY_COLUMNS),
+                        read_segments(path, segments, DELAY_COLUMNS) if segments else None])
+        return cls(
+            path=path,
+            frame=frame,
+            version=segments_version(file_version(path), segments),
+            mtime=mtime,
+            loaded_at=datetime.now(timezone.utc),
+            engine=ThresholdEngine.from_frame(frame),
+            late_checkouts=distributions(frame[frame[DELAY_COLUMN] >= 0], DELAY_COLUMN, bins=500),
+            segments=tuple(segments),
+        )
+
+    def append(self, frame, segments):
+        """The dataset with the rows of `frame` (read from `segments`) added: the new values are merged into the
+        threshold engine and counted in the distributions, the previous rows are not read again."""
+        frame = frame[DELAY_COLUMNS]
+        segments = self.segments + tuple(segments)
+        return replace(
+            self,
+            frame=concat([self.frame, frame]),
+            version=segments_version(self.version, segments),
+            loaded_at=datetime.now(timezone.utc),
+            engine=self.engine.append(frame),
+            late_checkouts=append_distributions(self.late_checkouts, frame[frame[DELAY_COLUMN] >= 0], DELAY_COLUMN),
+            segments=segments,
+        )
+
+    def info(self):
+        return {
+            "path": self.path,
+            "version": self.version,
+            "rows": len(self.frame),
+            "segments": len(self.segments),
+            "memory_bytes": int(self.frame.memory_usage(deep=True).sum()),
+            "file_modified_at": datetime.fromtimestamp(self.mtime, timezone.utc).isoformat(),
+            "loaded_at": self.loaded_at.isoformat(),
+        }
+
+
+@dataclass
+class DatasetStore:
+    """Holds the current dataset (built by `loader`, PricingDataset by default) and reloads it when its file's
+    mtime changes, or when a Parquet/Arrow copy of the CSV appears or disappears. New segments of the dataset are
+    appended to it instead (`dataset.append`), without reloading the file.
+
+    Like the ModelRegistry, `get()` checks for changes in a background thread: requests keep being served by the
+    current dataset while the file is parsed, and the new dataset is swapped in once built completely.
+    Each callable of `listeners` is then called with the new dataset."""
+    path: str
+    reload_interval: float = 5.0
+    listeners: List = field(default_factory=list)
+    loader: Callable = PricingDataset.load
+    _dataset: PricingDataset = None
+    _last_check: float = 0.0
+    _last_error: str = None
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def load(self):
+        self._swap(self.loader(self.path))
+        return self._dataset
+
+    def _swap(self, dataset):
+        self._dataset = dataset
+        self._last_check = time.monotonic()
+        for listener in self.listeners:
+            listener(dataset)
+
+    def refresh(self):
+        """Check the file and its segments now, e.g. right after writing a segment. Return the current dataset."""
+        with self._lock:
+            if self._dataset is None:
+                self.load()
+            else:
+                self._reload()
+        return self._dataset
+
+    def append(self, frame):
+        """Add the rows of `frame` to the dataset as a new segment. Return the new dataset.
+
+        The segment is read back and appended to the dataset before it is committed: rows that cannot be appended
+        raise ValueError, and are not written."""
+        with self._lock:
+            if self._dataset is None:
+                self.load()
+            else:
+                self._reload()
+            try:
+                name = stage_segment(self.path, frame)
+            except Exception as e:
+                raise ValueError(f"The rows cannot be written: {type(e).__name__}: {e}") from e
+            try:
+                dataset = self._dataset.append(read_segments(self.path, ["." + name]), [name])
+            except Exception as e:
+                discard_segment(self.path, name)
+                raise ValueError(f"The rows cannot be added to the dataset: {type(e).__name__}: {e}") from e
+            commit_segment(self.path, name)
+            self._swap(dataset)
+        return self._dataset
+
+    @property
+    def loaded(self):
+        return self._dataset is not None
+
+    def get(self):
+        if self._dataset is None:
+            with self._lock:
+                if self._dataset is None:
+                    self.load()
+        elif self.reload_interval > 0:
+            self._maybe_reload()
+        return self._dataset
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return
+        # only one check at a time, the callers keep serving the current dataset
+        if not self._lock.acquire(blocking=False):
+            return
+        self._last_check = now
+        try:
+            threading.Thread(target=self._reload_in_background, name=f"reload-{os.path.basename(self.path)}", daemon=True).start()
+        except Exception:
+            self._lock.release()
+            raise
+
+    def _reload_in_background(self):
+        # runs in its own thread, with the lock held (released here)
+        try:
+            self._reload()
+        finally:
+            self._lock.release()
+
+    def _reload(self):
+        # called with the lock held
+        try:
+            path = resolve(self.path)
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return
+        try:
+            if path != self._dataset.path or mtime != self._dataset.mtime:
+                self.load()
+            else:
+                applied = set(self._dataset.segments)
+                segments = [name for name in list_segments(path) if name not in applied]
+                if segments:
+                    self._swap(self._dataset.append(read_segments(path, segments), segments))
+        except Exception as e:
+            # keep serving the previous dataset if the new file cannot be parsed (e.g. partially written), logged
+            # once per error rather than at every check
+            error = f"{type(e).__name__}: {e}"
+            if error != self._last_error:
+                logger.exception("Could not reload %s, still serving version %s", path, self._dataset.version)
+            self._last_error = error
+            return
+        self._last_error = None
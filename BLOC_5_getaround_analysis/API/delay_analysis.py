@@ -0,0 +1,341 @@
+"""Impact of a minimum delay between two rentals of the same car, for any set of thresholds.
+
+A rental is *impacted* by a threshold when it was booked less than `threshold` minutes after the end of the
+previous rental of the car: with the feature enabled, it could not have been booked.
+A rental is *solved* when the previous driver came back late enough to overlap it (a conflict) and that delay
+is below the threshold: the minimum delay would have absorbed it.
+
+The time deltas and the delays of the conflicts are sorted once per checkin type, after which the counts for
+any threshold are a binary search (`np.searchsorted`) in those arrays, instead of filtering the rentals again
+for each threshold.
+
+`Distribution` summarizes a column into quantiles, a histogram and an ECDF curve of fixed size, so that charts
+and responses built from it keep the same size however many rentals there are. Quantiles are exact for the rentals
+of the loaded file, and estimated by a quantile sketch once rentals are appended.
+
+New rentals are added to both without going through the previous ones again (`append`): their values are merged
+into the sorted arrays, and counted in the summaries.
+
+This module is shared by the API and the dashboard (a copy lives in each directory, as each is deployed alone;
+tests/test_shared_files.py checks that the copies are identical).
+"""
+import copy
+import math
+from dataclasses import dataclass, replace
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+CHECKIN_TYPES = ("mobile", "connect")
+
+DELTA_COLUMN = "time_delta_with_previous_rental_in_minutes"
+DELAY_COLUMN = "delay_at_checkout_in_minutes"
+
+# Resolution of the distribution summaries: ECDF evaluated every minute over 12 hours, these quantiles,
+# estimated within 0.5% of their value
+ECDF_GRID = np.arange(0, 60 * 12 + 1, dtype=np.float64)
+QUANTILES = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+RELATIVE_ACCURACY = 0.005
+
+
+def _sorted(values):
+    return np.sort(np.asarray(values, dtype=np.float64))
+
+
+def _merge_sorted(arrays, new_arrays):
+    # checkin type -> sorted array, each new sorted array inserted at its place in the previous one
+    merged = dict(arrays)
+    for key, values in new_arrays.items():
+        previous = merged.get(key)
+        merged[key] = values if previous is None else np.insert(previous, np.searchsorted(previous, values), values)
+    return merged
+
+
+@dataclass(frozen=True)
+class ThresholdEngine:
+    """Sorted time deltas and conflict delays of the rentals following another rental, per checkin type."""
+    # checkin type -> sorted time deltas with the previous rental
+    deltas: Dict[str, np.ndarray]
+    # checkin type -> sorted checkout delays of the previous rental, for the rentals it overlapped
+    conflicts: Dict[str, np.ndarray]
+    # number of rentals in the analysed data, with or without a previous rental
+    rentals: int
+
+    @classmethod
+    def from_frame(cls, data):
+        following = data.dropna(subset=[DELTA_COLUMN])
+        overlap = following[DELTA_COLUMN] - following[DELAY_COLUMN]
+        deltas, conflicts = {}, {}
+        for checkin_type, group in following.groupby("checkin_type", observed=True):
+            deltas[checkin_type] = _sorted(group[DELTA_COLUMN])
+            conflicts[checkin_type] = _sorted(group.loc[overlap.loc[group.index] < 0, DELAY_COLUMN])
+        return cls(deltas=deltas, conflicts=conflicts, rentals=len(data))
+
+    def append(self, data):
+        """The engine of the previous rentals and of `data`, merging the new values into the sorted arrays."""
+        new = ThresholdEngine.from_frame(data)
+        return ThresholdEngine(
+            deltas=_merge_sorted(self.deltas, new.deltas),
+            conflicts=_merge_sorted(self.conflicts, new.conflicts),
+            rentals=self.rentals + new.rentals,
+        )
+
+    @property
+    def checkin_types(self):
+        return list(self.deltas)
+
+    def _count_below(self, arrays, thresholds, checkin_type):
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        if checkin_type is not None:
+            values = arrays.get(checkin_type)
+            if values is None:
+                return np.zeros(thresholds.shape, dtype=np.int64)
+            # side="left": number of values strictly below each threshold
+            return np.searchsorted(values, thresholds, side="left")
+        return sum(np.searchsorted(values, thresholds, side="left") for values in arrays.values())
+
+    def impacted(self, thresholds, checkin_type=None):
+        """Number of rentals booked less than each threshold after the previous one (all checkin types by default)."""
+        return self._count_below(self.deltas, thresholds, checkin_type)
+
+    def solved(self, thresholds, checkin_type=None):
+        """Number of conflicts with the previous rental whose checkout delay is below each threshold."""
+        return self._count_below(self.conflicts, thresholds, checkin_type)
+
+    def following(self, checkin_type=None):
+        """Number of rentals with a previous rental of the same car."""
+        if checkin_type is not None:
+            return len(self.deltas.get(checkin_type, ()))
+        return sum(len(values) for values in self.deltas.values())
+
+    def conflict_count(self, checkin_type=None):
+        """Number of rentals overlapped by the late checkout of the previous one."""
+        if checkin_type is not None:
+            return len(self.conflicts.get(checkin_type, ()))
+        return sum(len(values) for values in self.conflicts.values())
+
+    def sweep(self, thresholds):
+        """Impacted and solved counts of each checkin type and in total, one row per threshold."""
+        thresholds = np.asarray(thresholds)
+        result = {"threshold": thresholds}
+        for checkin_type in self.checkin_types:
+            result[f"impacted_{checkin_type}"] = self.impacted(thresholds, checkin_type)
+            result[f"solved_{checkin_type}"] = self.solved(thresholds, checkin_type)
+        result["impacted_total"] = self.impacted(thresholds)
+        result["solved_total"] = self.solved(thresholds)
+        return pd.DataFrame(result)
+
+
+def _number(value):
+    return None if np.isnan(value) else value
+
+
+class QuantileSketch:
+    """Quantiles of a stream of values within a relative error (the DDSketch algorithm).
+
+    Each value is counted in the logarithmic bucket ceil(log_gamma(|value|)): the memory depends on the range of
+    the values, not on how many there are, and adding values never needs the previous ones."""
+
+    def __init__(self, relative_accuracy=0.005):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        # bucket -> number of values, for the positive values and for the absolute value of the negative ones
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def copy(self):
+        sketch = copy.copy(self)
+        sketch.positive = dict(self.positive)
+        sketch.negative = dict(self.negative)
+        return sketch
+
+    def add(self, values):
+        """Count an array of values (without NaN)."""
+        if not len(values):
+            return
+        self.count += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.zeros += int((values == 0).sum())
+        for buckets, magnitudes in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            keys, counts = np.unique(np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64), return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                buckets[key] = buckets.get(key, 0) + count
+
+    def _value(self, key):
+        # the point of the bucket (gamma^(key-1), gamma^key] within the relative accuracy of all of them
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        if not self.count:
+            return float("nan")
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(-self._value(key), self.min)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self._value(key), self.max)
+        return self.max
+
+
+def _clean(values):
+    values = np.asarray(values, dtype=np.float64)
+    return np.sort(values[~np.isnan(values)])
+
+
+@dataclass(frozen=True)
+class Distribution:
+    """Fixed-size summary of the values of a column: moments, quantile sketch, histogram and ECDF curve.
+
+    `append(values)` returns the summary of the previous values and the new ones, computed from the new ones only.
+    The quantiles are exact (as pandas) until values are appended, estimated by the sketch afterwards."""
+    count: int
+    mean: float
+    # sum of the squared differences to the mean, for the standard deviation
+    m2: float
+    sketch: QuantileSketch
+    # histogram: bin i holds the values in [bin_origin + i * bin_width, bin_origin + (i + 1) * bin_width)
+    bin_origin: float
+    bin_width: float
+    bins: Dict[int, int]
+    # number of values lower than or equal to each point of the ECDF grid
+    ecdf_x: np.ndarray
+    ecdf_counts: np.ndarray
+    # quantile level -> value ('linear' interpolation, as pandas) of the values of `from_values`, None once appended to
+    exact_quantiles: Dict[float, float] = None
+
+    @classmethod
+    def from_values(cls, values, bins=100, grid=ECDF_GRID, relative_accuracy=RELATIVE_ACCURACY):
+        """Summary of `values`, with `bins` histogram bins over their range (new values add bins when needed)."""
+        values = _clean(values)
+        origin = float(values[0]) if len(values) else 0.0
+        width = float(values[-1] - values[0]) / bins if len(values) else 0.0
+        empty = cls(
+            count=0, mean=0.0, m2=0.0, sketch=QuantileSketch(relative_accuracy),
+            bin_origin=origin, bin_width=width or 1.0, bins={},
+            ecdf_x=grid, ecdf_counts=np.zeros(len(grid), dtype=np.int64),
+        )
+        exact = {q: float(v) for q, v in zip(QUANTILES, np.quantile(values, QUANTILES))} if len(values) else None
+        return replace(empty.append(values), exact_quantiles=exact)
+
+    def empty(self):
+        """A summary without values, with the same histogram bins and ECDF grid."""
+        return replace(self, count=0, mean=0.0, m2=0.0, sketch=QuantileSketch(self.sketch.relative_accuracy),
+                       bins={}, ecdf_counts=np.zeros(len(self.ecdf_x), dtype=np.int64), exact_quantiles=None)
+
+    def append(self, values):
+        values = _clean(values)
+        if not len(values):
+            return self
+        # mean and m2 of the union (Chan et al. parallel variance)
+        n = len(values)
+        count = self.count + n
+        mean = float(values.mean())
+        delta = mean - self.mean
+        m2 = self.m2 + float(((values - mean) ** 2).sum()) + delta ** 2 * self.count * n / count
+        sketch = self.sketch.copy()
+        sketch.add(values)
+        bins = dict(self.bins)
+        keys, counts = np.unique(np.floor((values - self.bin_origin) / self.bin_width).astype(np.int64), return_counts=True)
+        for key, bin_count in zip(keys.tolist(), counts.tolist()):
+            bins[key] = bins.get(key, 0) + bin_count
+        return replace(
+            self, count=count, mean=self.mean + delta * n / count, m2=m2, sketch=sketch, bins=bins,
+            ecdf_counts=self.ecdf_counts + np.searchsorted(values, self.ecdf_x, side="right"), exact_quantiles=None,
+        )
+
+    @property
+    def std(self):
+        # sample standard deviation, as pandas
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float("nan")
+
+    @property
+    def quantiles(self):
+        """Quantile level -> value: exact, or within the relative accuracy of the sketch once values were appended."""
+        if self.exact_quantiles is not None:
+            return self.exact_quantiles
+        return {q: self.sketch.quantile(q) for q in QUANTILES}
+
+    @property
+    def median(self):
+        return self.quantiles[0.5]
+
+    @property
+    def histogram_counts(self):
+        if not self.bins:
+            return np.zeros(0, dtype=np.int64)
+        first = min(self.bins)
+        counts = np.zeros(max(self.bins) - first + 1, dtype=np.int64)
+        for key, count in self.bins.items():
+            counts[key - first] = count
+        return counts
+
+    @property
+    def histogram_edges(self):
+        if not self.bins:
+            return np.zeros(0)
+        keys = np.arange(min(self.bins), max(self.bins) + 2)
+        return self.bin_origin + keys * self.bin_width
+
+    @property
+    def ecdf_percent(self):
+        """Percentage of the values lower than or equal to each point of the grid."""
+        return self.ecdf_counts / self.count * 100 if self.count else np.zeros(len(self.ecdf_x))
+
+    def to_dict(self, histogram=False, ecdf=False):
+        """JSON-ready summary, NaN (no values) given as None."""
+        result = {
+            "count": self.count,
+            "mean": _number(self.mean) if self.count else None,
+            "std": _number(self.std),
+            "median": _number(self.median),
+            "quantiles": {f"{q:g}": _number(value) for q, value in self.quantiles.items()},
+        }
+        if histogram:
+            result["histogram"] = {"counts": self.histogram_counts.tolist(), "edges": self.histogram_edges.tolist()}
+        if ecdf:
+            result["ecdf"] = {"x": self.ecdf_x.tolist(), "percent": self.ecdf_percent.tolist()}
+        return result
+
+
+def distributions(frame, column, by="checkin_type", **kwargs):
+    """Distribution of `column` over all the rows ("all") and over each group of `by`."""
+    result = {"all": Distribution.from_values(frame[column], **kwargs)}
+    for key, group in frame.groupby(by, observed=True):
+        result[key] = Distribution.from_values(group[column], **kwargs)
+    return result
+
+
+def append_distributions(current, frame, column, by="checkin_type"):
+    """The `distributions()` of the rows `current` summarizes plus the rows of `frame`, computed from `frame` only."""
+    result = dict(current)
+    result["all"] = current["all"].append(frame[column])
+    for key, group in frame.groupby(by, observed=True):
+        result[key] = (current.get(key) or current["all"].empty()).append(group[column])
+    return result
+
+
+def delay_costs(late_checkouts, price_per_day):
+    """Revenue lost to late checkouts, per checkin type and in total: price per minute x median delay x number of
+    late checkouts. `late_checkouts`: distributions of the checkout delays of the late rentals, per checkin type."""
+    price_per_minute = price_per_day / (24 * 60)
+    costs = {
+        checkin_type: price_per_minute * distribution.median * distribution.count
+        for checkin_type, distribution in late_checkouts.items()
+        if checkin_type != "all" and distribution.count
+    }
+    costs["total"] = sum(costs.values())
+    return costs
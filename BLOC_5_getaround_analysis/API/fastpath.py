@@ -0,0 +1,237 @@
+"""Inference without pandas or sklearn on the hot path.
+
+The fitted ColumnTransformer of the pricing pipeline is compiled ahead of time into plain lookup tables
+(output column of each category, mean and scale of each numerical feature). Cars are then encoded straight
+into a preallocated float32 array that is handed to the XGBoost booster.
+
+The pipeline feeds XGBoost a sparse matrix, in which XGBoost treats absent entries (every 0) as missing
+values. The encoded arrays are dense, so they are predicted with `missing=0.0` to get the same trees paths.
+
+tests/test_parity.py checks that the compiled path matches the original pipeline, on the dataset and on edge
+cases; `python fastpath.py` runs the same check on the dataset and on random cars.
+"""
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import stage
+
+# largest batch of records encoded into the reusable array of a thread (see FastPredictor.predict_records); larger
+# ones, rare, get an array of their own rather than keeping a big one allocated
+MAX_BUFFER_ROWS = 1024
+
+
+@dataclass(frozen=True)
+class CompiledPreprocessor:
+    """Lookup tables equivalent to the fitted 'Preprocessing' step of the pricing pipeline."""
+    # numerical features: name, output column, mean, scale
+    numerical: List[Tuple[str, int, float, float]]
+    # categorical features: name -> {value: output column}, the dropped (first) category maps to -1
+    categorical: Dict[str, Dict[object, int]]
+    # categorical features: name -> (categories, output column of each category or -1), for whole frames
+    categories: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    n_features: int
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        preprocessor = pipeline.steps[0][1] if hasattr(pipeline, "steps") else pipeline
+        numerical, categorical, categories = [], {}, {}
+        column = 0
+        for name, transformer, features in preprocessor.transformers_:
+            if name == "remainder" or transformer == "drop":
+                continue
+            step = transformer.steps[-1][1] if hasattr(transformer, "steps") else transformer
+            if hasattr(step, "mean_"):
+                scale = step.scale_ if step.scale_ is not None else np.ones(len(features))
+                mean = step.mean_ if step.mean_ is not None else np.zeros(len(features))
+                for i, feature in enumerate(features):
+                    numerical.append((feature, column, float(mean[i]), float(scale[i])))
+                    column += 1
+            elif hasattr(step, "categories_"):
+                if getattr(step, "infrequent_categories_", None) and any(c is not None for c in step.infrequent_categories_):
+                    raise ValueError("Encoders with infrequent categories are not supported")
+                drop_idx = step.drop_idx_ if step.drop_idx_ is not None else [None] * len(features)
+                for feature, feature_categories, dropped in zip(features, step.categories_, drop_idx):
+                    outputs = np.full(len(feature_categories), -1, dtype=np.intp)
+                    for i in range(len(feature_categories)):
+                        if dropped is not None and i == dropped:
+                            continue
+                        outputs[i] = column
+                        column += 1
+                    lookup = dict(zip(feature_categories.tolist(), outputs.tolist()))
+                    if feature_categories.dtype.kind == "f":
+                        # booleans were fitted as 0.0/1.0
+                        lookup.update({bool(value): output for value, output in list(lookup.items())})
+                    categorical[feature] = lookup
+                    categories[feature] = (feature_categories, outputs)
+            else:
+                raise ValueError(f"Unsupported transformer in the preprocessor: {step!r}")
+        return cls(numerical, categorical, categories, column)
+
+    def encode_records(self, records, out=None):
+        """Encode a list of feature dicts into a (n, n_features) float32 array: the first n rows of `out` if given
+        (at least n rows, overwritten), a new array otherwise."""
+        n = len(records)
+        if out is None:
+            out = np.zeros((n, self.n_features), dtype=np.float32)
+        else:
+            out[:n] = 0
+        for row, record in enumerate(records):
+            values = out[row]
+            for feature, column, mean, scale in self.numerical:
+                values[column] = (record[feature] - mean) / scale
+            for feature, lookup in self.categorical.items():
+                column = lookup.get(record[feature])
+                if column is None:
+                    # same error as encode_frame and the pipeline
+                    raise ValueError(f"Found unknown categories {[record[feature]]} in column {feature}")
+                if column >= 0:
+                    values[column] = 1.0
+        return out[:n]
+
+    def encode_frame(self, frame):
+        """Encode a DataFrame with one vectorized operation per feature."""
+        n = len(frame)
+        out = np.zeros((n, self.n_features), dtype=np.float32)
+        for feature, column, mean, scale in self.numerical:
+            out[:, column] = (frame[feature].to_numpy(dtype=np.float64) - mean) / scale
+        rows = np.arange(n)
+        for feature, (feature_categories, outputs) in self.categories.items():
+            values = frame[feature]
+            if feature_categories.dtype.kind == "f":
+                values = values.astype(np.float64)
+            codes = pd.Categorical(values, categories=feature_categories).codes
+            if (codes < 0).any():
+                unknown = pd.unique(np.asarray(values)[codes < 0])
+                raise ValueError(f"Found unknown categories {list(unknown)} in column {feature}")
+            columns = outputs[codes]
+            kept = columns >= 0
+            out[rows[kept], columns[kept]] = 1.0
+        return out
+
+
+class FastPredictor:
+    """Pricing model predictions from the compiled preprocessor and the model's XGBoost booster."""
+
+    def __init__(self, pipeline):
+        regressor = pipeline.steps[-1][1]
+        self.preprocessor = CompiledPreprocessor.from_pipeline(pipeline)
+        self.booster = regressor.get_booster()
+        best_iteration = getattr(regressor, "best_iteration", None)
+        self.iteration_range = (0, best_iteration + 1) if best_iteration is not None else (0, 0)
+        # the array records are encoded into, one per thread (micro-batch workers, request threads)
+        self._buffers = threading.local()
+
+    def _buffer(self, n):
+        if n > MAX_BUFFER_ROWS:
+            return None
+        buffer = getattr(self._buffers, "array", None)
+        if buffer is None or len(buffer) < n:
+            # grown to the largest batch seen, by powers of two
+            buffer = np.zeros((min(1 << (n - 1).bit_length(), MAX_BUFFER_ROWS), self.preprocessor.n_features), dtype=np.float32)
+            self._buffers.array = buffer
+        return buffer
+
+    def predict_array(self, X):
+        return self.booster.inplace_predict(X, iteration_range=self.iteration_range, missing=0.0, validate_features=False)
+
+    def predict_records(self, records):
+        with stage("preprocess"):
+            X = self.preprocessor.encode_records(records, self._buffer(len(records)))
+        with stage("predict"):
+            # copied out by tolist() before the thread encodes its next batch into the same array
+            return self.predict_array(X).tolist()
+
+    def predict_frame(self, frame):
+        with stage("preprocess"):
+            X = self.preprocessor.encode_frame(frame)
+        with stage("predict"):
+            return self.predict_array(X)
+
+
+class PipelinePredictor:
+    """Pricing model predictions through the original sklearn pipeline."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        # same as pipeline.predict, in two steps so that each can be timed
+        self.preprocessor = pipeline[:-1]
+        self.regressor = pipeline.steps[-1][1]
+
+    def predict_records(self, records):
+        from batching import records_to_frame
+        with stage("build_frame"):
+            frame = records_to_frame(records)
+        return self.predict_frame(frame).tolist()
+
+    def predict_frame(self, frame):
+        with stage("preprocess"):
+            X = self.preprocessor.transform(frame)
+        with stage("predict"):
+            return self.regressor.predict(X)
+
+
+def check_parity(pipeline, frame, rtol=1e-5, atol=1e-4):
+    """Compare the compiled path with the pipeline on `frame`, return a list of failure messages."""
+    from batching import FEATURE_COLUMNS
+
+    failures = []
+    frame = frame[FEATURE_COLUMNS]
+    compiled = CompiledPreprocessor.from_pipeline(pipeline)
+    expected_X = pipeline.steps[0][1].transform(frame)
+    expected_X = expected_X.toarray() if hasattr(expected_X, "toarray") else np.asarray(expected_X)
+    for name, X in [("encode_frame", compiled.encode_frame(frame)),
+                    ("encode_records", compiled.encode_records(frame.to_dict("records")))]:
+        if X.shape != expected_X.shape:
+            failures.append(f"{name}: shape {X.shape} != {expected_X.shape}")
+        elif not np.allclose(X, expected_X, rtol=rtol, atol=atol):
+            failures.append(f"{name}: max feature difference {np.abs(X - expected_X).max()}")
+
+    expected = pipeline.predict(frame)
+    predictor = FastPredictor(pipeline)
+    for name, predictions in [("predict_frame", predictor.predict_frame(frame)),
+                              ("predict_records", np.asarray(predictor.predict_records(frame.to_dict("records"))))]:
+        if not np.allclose(predictions, expected, rtol=rtol, atol=atol):
+            failures.append(f"{name}: max prediction difference {np.abs(predictions - expected).max()}")
+    return failures
+
+
+def synthetic_frame(pipeline, n=2000, seed=0):
+    """Random cars covering every category the model knows, and mileage / engine power ranges beyond the dataset's."""
+    from batching import FEATURE_COLUMNS
+
+    rng = np.random.default_rng(seed)
+    compiled = CompiledPreprocessor.from_pipeline(pipeline)
+    data = {}
+    for feature, (feature_categories, _) in compiled.categories.items():
+        values = rng.choice(feature_categories, n)
+        data[feature] = values.astype(bool) if feature_categories.dtype.kind == "f" else values
+    data["mileage"] = rng.integers(0, 1_000_000, n)
+    data["engine_power"] = rng.integers(0, 450, n)
+    return pd.DataFrame(data)[FEATURE_COLUMNS]
+
+
+if __name__ == "__main__":
+    from joblib import load
+    from dataset import read_pricing
+    from validation import Vocabulary
+
+    model_path = sys.argv[1] if len(sys.argv) > 1 else "gbr_model.joblib"
+    data_path = sys.argv[2] if len(sys.argv) > 2 else "df_pricing.csv"
+    pipeline = load(model_path)
+    data = read_pricing(data_path).astype({"model_key": object, "fuel": object, "paint_color": object, "car_type": object})
+    # the dataset holds a few model keys the model was not fitted on
+    known = Vocabulary.from_model(pipeline).values["model_key"]
+    data = data[data["model_key"].isin(known)]
+    failures = []
+    for name, frame in [(data_path, data), ("synthetic cars", synthetic_frame(pipeline))]:
+        for failure in check_parity(pipeline, frame):
+            failures.append(f"{name}: {failure}")
+        print(f"{name}: {len(frame)} rows checked")
+    for failure in failures:
+        print("FAILED", failure)
+    sys.exit(1 if failures else 0)
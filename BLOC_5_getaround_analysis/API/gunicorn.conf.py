@@ -0,0 +1,64 @@
+# gunicorn settings, read automatically when gunicorn is started from this directory:
+#     gunicorn app:app
+#
+# The app is preloaded: the master loads the models and the datasets once (app.warm_up), then forks the workers,
+# which share these objects copy-on-write instead of each holding its own copy. gc.freeze() moves them out of the
+# garbage collector's reach, so that its passes do not write to (and so copy) the shared pages. Each worker then
+# prices a synthetic car (app.warm_up_prediction) before /health/ready reports it ready.
+#
+# `kill -HUP <master pid>` reloads gracefully: the master reloads the models and datasets, forks new workers, and the
+# old ones finish their requests (within graceful_timeout) before exiting. Code changes need a restart.
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 4000)}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# one worker per CPU by default: each one runs its predictions in its own micro-batcher thread
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+preload_app = os.environ.get("PRELOAD_APP", "1") == "1"
+timeout = int(os.environ.get("WORKER_TIMEOUT", 60))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# Each worker writes its Prometheus metrics to this directory, /metrics adds them up (see metrics.py).
+# It must be set before the app imports prometheus_client, which is before on_starting when the app is preloaded.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "getaround_metrics"))
+# values left by a previous run would be added to the new ones. Only cleared at startup: this file is read again on HUP.
+if os.environ.get("GETAROUND_METRICS_CLEARED") != str(os.getpid()):
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    os.environ["GETAROUND_METRICS_CLEARED"] = str(os.getpid())
+
+if preload_app:
+    # no collection while the app is loaded: the objects it creates are frozen in when_ready
+    gc.disable()
+
+
+def _warm_up(server, reload=False):
+    import app
+    app.warm_up(reload=reload)
+    gc.collect()
+    gc.freeze()
+    gc.enable()
+    server.log.info("Models and datasets loaded in the master in %.2fs (%d objects frozen)",
+                    app.warm["load_seconds"], gc.get_freeze_count())
+
+
+def when_ready(server):
+    # called in the master before the workers are forked
+    if server.cfg.preload_app:
+        _warm_up(server)
+
+
+def on_reload(server):
+    # HUP: the workers forked next get the current models and datasets
+    if server.cfg.preload_app:
+        _warm_up(server, reload=True)
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,206 @@
+"""Ingestion of new rows into the pricing and delay datasets, without recomputing what was already loaded.
+
+Rows come from POST /ingest/{dataset} or from files dropped in INGEST_DIR/{dataset}. They are checked, written
+as a new segment of the dataset (see storage.py), and the DatasetStore appends the segment to the dataset it
+holds: the threshold engine, distributions and row indexes are updated with the new rows only. The other
+workers, and the dashboard, pick the segment up at their next reload check.
+"""
+import asyncio
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from batching import FEATURE_COLUMNS
+from validation import BOOLEAN_FEATURES, CATEGORICAL_FEATURES, parse_booleans, parse_numbers
+from delay_analysis import CHECKIN_TYPES, DELAY_COLUMN, DELTA_COLUMN
+from storage import DTYPES
+
+logger = logging.getLogger(__name__)
+
+# Columns of each dataset: name -> kind of value. "category" values are free text, except those in CHOICES.
+SCHEMAS = {
+    "pricing": {
+        **{
+            column: "category" if column in CATEGORICAL_FEATURES else "boolean" if column in BOOLEAN_FEATURES else "integer"
+            for column in FEATURE_COLUMNS
+        },
+        "rental_price_per_day": "integer",
+    },
+    "delay": {
+        "rental_id": "integer",
+        "car_id": "integer",
+        "checkin_type": "category",
+        "state": "category",
+        DELAY_COLUMN: "number",
+        "previous_ended_rental_id": "number",
+        DELTA_COLUMN: "number",
+    },
+}
+CHOICES = {
+    "checkin_type": list(CHECKIN_TYPES),
+    "state": ["ended", "canceled"],
+}
+# columns that may be missing (NaN): a rental without checkout or without previous rental
+NULLABLE = {DELAY_COLUMN, "previous_ended_rental_id", DELTA_COLUMN}
+# numbers are positive, as for /predict, except the delay: negative when the car was returned early
+SIGNED = {DELAY_COLUMN}
+# largest value of the integer columns, stored as int32 (see storage.DTYPES): a larger one would wrap around.
+# previous_ended_rental_id is a rental_id, stored as a float only because it may be missing.
+MAXIMUMS = {
+    **{column: np.iinfo(dtype).max for column, dtype in DTYPES.items() if dtype.startswith("int")},
+    "previous_ended_rental_id": np.iinfo(DTYPES["rental_id"]).max,
+}
+
+# delay_category of the delay dataset, as computed in the delay analysis notebook
+DELAY_BINS = [-np.inf, 0, 15, 30, 60, 120, np.inf]
+DELAY_CATEGORIES = ["Early", "Late: 0-15 mins", "Late: 15-30 mins", "Late: 30-60 mins", "Late: 1-2 hours", "Late: > 2 hours"]
+
+FILE_EXTENSIONS = (".csv", ".ndjson", ".jsonl", ".parquet")
+
+
+def _rows(mask):
+    rows = np.flatnonzero(mask)
+    return f"(rows {rows[:10].tolist()}{'...' if len(rows) > 10 else ''})"
+
+
+def prepare(dataset, frame, vocabulary=None):
+    """Check the rows of `frame` for `dataset` and return them with the dataset's columns and types. The categorical
+    features of the pricing dataset must be in `vocabulary` (validation.Vocabulary), as for /predict.
+
+    Raises ValueError listing the problems if any row is invalid: a batch is ingested whole or not at all."""
+    choices = dict(CHOICES)
+    if vocabulary is not None and dataset == "pricing":
+        choices.update({column: sorted(values) for column, values in vocabulary.values.items()})
+    schema = SCHEMAS[dataset]
+    errors = []
+    clean = {}
+    for column, kind in schema.items():
+        if column not in frame:
+            errors.append(f"{column}: field required")
+            continue
+        values = frame[column]
+        negative = None
+        if kind == "boolean":
+            converted = parse_booleans(values)
+        elif kind == "category":
+            converted = values.where(values.isin(choices[column]), None) if column in choices else values
+            converted = converted.where(converted.map(lambda v: isinstance(v, str)), None)
+        else:
+            converted, negative = parse_numbers(values)
+            if kind == "integer":
+                converted = converted.where(converted == converted.round())
+        bad = converted.isna() & ~(values.isna() & (column in NULLABLE))
+        if bad.any():
+            expected = f"one of {choices[column]}" if column in choices else f"a{'n' if kind[0] in 'aeiou' else ''} {kind}"
+            errors.append(f"{column}: must be {expected} {_rows(bad.to_numpy())}")
+        if negative is not None and column not in SIGNED and negative.any():
+            errors.append(f"{column}: must be positive {_rows(negative)}")
+        if column in MAXIMUMS and (converted > MAXIMUMS[column]).any():
+            errors.append(f"{column}: must be at most {MAXIMUMS[column]} {_rows((converted > MAXIMUMS[column]).to_numpy())}")
+        clean[column] = converted
+    if errors:
+        raise ValueError("; ".join(errors))
+    frame = pd.DataFrame(clean)
+    if dataset == "delay":
+        frame["delay_category"] = pd.cut(frame[DELAY_COLUMN], DELAY_BINS, right=False, labels=DELAY_CATEGORIES).astype(object)
+        frame["next_rental"] = frame["previous_ended_rental_id"].notna()
+    return frame
+
+
+def ingest(store, dataset, frame, vocabulary=None):
+    """Append the rows of `frame` to the dataset held by `store`. Return the number of rows and the new version.
+
+    Raises ValueError if the rows are invalid (see prepare) or cannot be added to the dataset: nothing is written then."""
+    frame = prepare(dataset, frame, vocabulary)
+    current = store.append(frame) if len(frame) else store.refresh()
+    return {"dataset": dataset, "rows": len(frame), "version": current.version, "total_rows": len(current.frame)}
+
+
+def read_file(path, name):
+    """Read a dropped file: .csv, .ndjson / .jsonl or .parquet, as told by the extension of its `name`."""
+    extension = os.path.splitext(name)[1]
+    if extension == ".csv":
+        return pd.read_csv(path)
+    if extension == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_json(path, lines=True)
+
+
+class FileDropWatcher:
+    """Ingest the files dropped in `directory/<dataset>` for each dataset of `stores`, every `interval` seconds.
+
+    A file is claimed by renaming it (so that only one worker ingests it), then moved to `done/`, or to `failed/`
+    with a `.error` file giving the reason. Write files elsewhere and move them in, so that none is read half
+    written. `vocabulary()` returns the categories pricing rows are checked against (those of the current model)."""
+
+    def __init__(self, directory, stores, vocabulary, interval=5.0):
+        self.directory = directory
+        self.stores = stores
+        self.vocabulary = vocabulary
+        self.interval = interval
+        self.files = 0
+        self.failed_files = 0
+        self._task = None
+
+    async def start(self):
+        for dataset in self.stores:
+            for subdirectory in ("", "done", "failed"):
+                os.makedirs(os.path.join(self.directory, dataset, subdirectory), exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await loop.run_in_executor(None, self.scan)
+            except Exception:
+                logger.exception("Ingestion scan failed")
+
+    def scan(self):
+        for dataset, store in self.stores.items():
+            folder = os.path.join(self.directory, dataset)
+            for name in sorted(os.listdir(folder)):
+                if name.startswith(".") or not name.endswith(FILE_EXTENSIONS):
+                    continue
+                claimed = os.path.join(folder, f".{name}.{os.getpid()}")
+                try:
+                    os.replace(os.path.join(folder, name), claimed)
+                except FileNotFoundError:
+                    # claimed by another worker
+                    continue
+                self._ingest_file(store, dataset, folder, name, claimed)
+
+    def _ingest_file(self, store, dataset, folder, name, claimed):
+        try:
+            result = ingest(store, dataset, read_file(claimed, name), self.vocabulary())
+        except Exception as e:
+            self.failed_files += 1
+            os.replace(claimed, os.path.join(folder, "failed", name))
+            with open(os.path.join(folder, "failed", name + ".error"), "w") as f:
+                f.write(f"{type(e).__name__}: {e}\n")
+            logger.warning("Could not ingest %s: %s", name, e)
+            return
+        self.files += 1
+        os.replace(claimed, os.path.join(folder, "done", name))
+        logger.info("Ingested %s rows of %s into %s", result["rows"], name, dataset)
+
+    def info(self):
+        return {
+            "directory": self.directory,
+            "interval_seconds": self.interval,
+            "running": self._task is not None,
+            "files": self.files,
+            "failed_files": self.failed_files,
+        }
@@ -0,0 +1,414 @@
+"""Bulk pricing jobs: a file of cars priced in the background, on all the cores, without an external broker.
+
+POST /jobs/predict saves the uploaded file under JOBS_DIR/<id>/ and records the job in a SQLite database
+(JOBS_DIR/jobs.sqlite3) shared by the API workers. A JobRunner thread in each worker takes the queued jobs one at a
+time; a lock file makes sure only one job runs on the host at once, using a process pool of JOBS_PROCESSES
+processes. The file is read `chunk_size` rows at a time and at most two chunks per process are in flight, so the
+memory used does not depend on the size of the file. Results are appended in input order (same lines as
+/predict/batch/file) and the progress is saved after each chunk. The number of rows is counted from the lines of the
+file while it is saved, so that the upload is not parsed before the job is queued, and set to the rows read once the
+job is done.
+
+Each run of a job gets a token of its own, and writes to a result file of its own, JOBS_DIR/<id>/result-<token>.ndjson.
+The runner saves a heartbeat every HEARTBEAT_INTERVAL seconds while the job runs: a job without heartbeat for
+HEARTBEAT_TIMEOUT seconds was left by a worker that died (whatever the process ids after a restart) and is queued
+again, with a new token for its next run. Finished jobs are deleted after JOBS_RETENTION_HOURS.
+"""
+import fcntl
+import importlib
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+
+from batching import iter_file_chunks, result_lines
+from registry import load_model
+from validation import Vocabulary, validate_frame
+
+logger = logging.getLogger(__name__)
+
+FILE_EXTENSIONS = (".csv", ".ndjson", ".jsonl", ".json")
+FINISHED = ("done", "failed")
+HEARTBEAT_INTERVAL = 5.0
+HEARTBEAT_TIMEOUT = 60.0
+# longest wait of a runner before checking the queue again after failures
+MAX_BACKOFF = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    rows_total INTEGER NOT NULL,
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    rows_failed INTEGER NOT NULL DEFAULT 0,
+    model_version TEXT,
+    error TEXT,
+    run_token TEXT,
+    heartbeat_at TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+)
+"""
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def copy_counting_lines(source, out, block_size=1 << 20):
+    """Copy the file `source` to `out` by blocks (never held in memory). Return the number of lines copied."""
+    lines, last = 0, b"\n"
+    while True:
+        block = source.read(block_size)
+        if not block:
+            break
+        out.write(block)
+        lines += block.count(b"\n")
+        last = block[-1:]
+    # a last line without newline
+    return lines + (last != b"\n")
+
+
+class JobStore:
+    """Jobs and their files, kept in `directory` (SQLite database and one folder per job)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, "jobs.sqlite3")
+        os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as connection:
+            # readers do not block the writer: workers poll the jobs while one of them updates the progress
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+            # databases created before the run tokens
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            for column in ("run_token", "heartbeat_at"):
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+
+    def _connect(self):
+        # one connection per call: they are used from the event loop, the runner threads and several processes
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def input_path(self, job):
+        return os.path.join(self.job_dir(job["id"]), "input" + os.path.splitext(job["filename"])[1].lower())
+
+    def result_path(self, job):
+        """Result file of the current run of `job` (None while the job is queued)."""
+        if job["run_token"] is None:
+            return None
+        return os.path.join(self.job_dir(job["id"]), f"result-{job['run_token']}.ndjson")
+
+    def create(self, file, filename, chunk_size):
+        """Save the uploaded `file` and queue a job for it. Return the job."""
+        if not (filename or "").lower().endswith(FILE_EXTENSIONS):
+            raise ValueError("Uploaded file must be a .csv, .ndjson or .json file")
+        job = {"id": uuid.uuid4().hex, "status": "queued", "filename": filename, "chunk_size": chunk_size}
+        os.makedirs(self.job_dir(job["id"]))
+        try:
+            with open(self.input_path(job), "wb") as out:
+                lines = copy_counting_lines(file, out)
+            if lines == 0:
+                raise ValueError("Uploaded file is empty")
+            # one car per line after the header of a CSV: an estimate (quoted newlines, blank lines) until the job
+            # is done and the rows read are known
+            job["rows_total"] = lines - 1 if filename.lower().endswith(".csv") else lines
+        except Exception:
+            shutil.rmtree(self.job_dir(job["id"]))
+            raise
+        job["created_at"] = _now()
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, status, filename, chunk_size, rows_total, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [job[key] for key in ("id", "status", "filename", "chunk_size", "rows_total", "created_at")],
+            )
+        return self.get(job["id"])
+
+    def get(self, job_id):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def update(self, job, **fields):
+        """Update the current run of `job`. Return False if the job was run again or deleted since it was claimed."""
+        fields["heartbeat_at"] = _now()
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ? AND run_token = ?",
+                [*fields.values(), job["id"], job["run_token"]],
+            )
+        return cursor.rowcount > 0
+
+    def claim(self):
+        """Mark the oldest queued job as running with a new run token and return it, or None if there is none."""
+        with closing(self._connect()) as connection:
+            # an immediate transaction: no other process can claim the same job in between
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            job = {"id": row["id"], "run_token": uuid.uuid4().hex}
+            # the result file of the run exists before anyone can see the token; those of previous runs are deleted
+            # (readers still following them keep reading their own file)
+            for name in os.listdir(self.job_dir(job["id"])):
+                if name.startswith("result"):
+                    os.remove(os.path.join(self.job_dir(job["id"]), name))
+            open(self.result_path(job), "wb").close()
+            connection.execute(
+                "UPDATE jobs SET status = 'running', run_token = ?, heartbeat_at = ?, started_at = ?, "
+                "rows_done = 0, rows_failed = 0 WHERE id = ?", (job["run_token"], _now(), _now(), job["id"]),
+            )
+            connection.execute("COMMIT")
+        return self.get(job["id"])
+
+    def requeue(self, job):
+        """Queue `job` again, unless it was already run again since it was claimed."""
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'queued', run_token = NULL WHERE id = ? AND run_token = ?",
+                (job["id"], job["run_token"]),
+            )
+
+    def requeue_orphans(self, timeout=HEARTBEAT_TIMEOUT):
+        """Queue again the running jobs without heartbeat for `timeout` seconds. Return their number."""
+        limit = (datetime.now(timezone.utc) - timedelta(seconds=timeout)).isoformat()
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'queued', run_token = NULL "
+                "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)", (limit,),
+            )
+        return cursor.rowcount
+
+    def purge(self, older_than):
+        """Delete the jobs finished more than `older_than` (a timedelta) ago, and their files."""
+        limit = (datetime.now(timezone.utc) - older_than).isoformat()
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (limit,)
+            ).fetchall()
+            for row in rows:
+                shutil.rmtree(self.job_dir(row["id"]), ignore_errors=True)
+                connection.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+        return len(rows)
+
+
+# Predictor and vocabulary of a pool process, built once by _init_process
+_process = {}
+
+
+def _init_process(name, path, predictor):
+    loaded = load_model(name, path)
+    module, class_name = predictor
+    _process["predictor"] = getattr(importlib.import_module(module), class_name)(loaded.model)
+    _process["vocabulary"] = Vocabulary.from_model(loaded.model)
+
+
+def price_chunk(offset, chunk):
+    """Price one chunk in a pool process, as /predict/batch/file does: return the NDJSON lines, the number of rows
+    priced and the number of rows with errors."""
+    valid, errors = validate_frame(chunk, _process["vocabulary"])
+    prediction = _process["predictor"].predict_frame(valid) if len(valid) else None
+    return result_lines(offset, chunk, valid, errors, prediction), len(valid), len(errors)
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _Lost(Exception):
+    # the job was queued again (no heartbeat for too long) or deleted while this run was going on
+    pass
+
+
+class JobRunner:
+    """Runs the queued jobs of `store` with the current model of `registry`, in a pool of `processes` processes.
+
+    `predictor` is the (module, class) of the predictor the processes use. The pool is started for the first job,
+    started again when the model has changed, and shut down when no job is left."""
+
+    def __init__(self, store, registry, predictor, processes=None, poll_interval=1.0, retention_hours=24.0):
+        self.store = store
+        self.registry = registry
+        self.predictor = predictor
+        self.processes = processes or os.cpu_count()
+        self.poll_interval = poll_interval
+        self.retention = timedelta(hours=retention_hours)
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._pool = None
+        self._pool_version = None
+
+    def start(self):
+        self._requeue_orphans()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="jobs", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _requeue_orphans(self):
+        requeued = self.store.requeue_orphans()
+        if requeued:
+            logger.info("Queued again %d jobs of stopped workers", requeued)
+
+    def notify(self):
+        """Check the queue now (a job was just submitted)."""
+        self._wake.set()
+
+    def _run(self):
+        lock_path = os.path.join(self.store.directory, "runner.lock")
+        failures = 0
+        with open(lock_path, "w") as lock:
+            while not self._stopping:
+                # after a failure (e.g. "database is locked"), wait twice as long each time, up to MAX_BACKOFF
+                self._wake.wait(min(self.poll_interval * 2 ** failures, MAX_BACKOFF))
+                self._wake.clear()
+                try:
+                    # one job at a time on the host, whichever worker runs it: each job has all the cores
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    self._purge()
+                    self._requeue_orphans()
+                    while not self._stopping:
+                        job = self.store.claim()
+                        if job is None:
+                            break
+                        self.run(job)
+                    failures = 0
+                except Exception:
+                    # the thread keeps running: the queue is checked again after the back-off
+                    failures += 1
+                    logger.exception("Could not run the queued jobs (failure %d in a row)", failures)
+                finally:
+                    self._close_pool()
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _purge(self):
+        # old jobs left on disk do not stop the queued ones from running
+        try:
+            self.store.purge(self.retention)
+        except Exception:
+            logger.exception("Could not delete the finished jobs")
+
+    def _get_pool(self):
+        loaded = self.registry.get("pricing")
+        if self._pool is not None and self._pool_version != loaded.version:
+            self._close_pool()
+        if self._pool is None:
+            # spawned, not forked: the worker runs threads (and the model's thread pools) that a fork would break
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process, initargs=(loaded.name, loaded.path, self.predictor),
+            )
+            self._pool_version = loaded.version
+        return self._pool
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _heartbeat(self, job, done):
+        # also while a chunk takes long, or while the pool processes load the model
+        while not done.wait(HEARTBEAT_INTERVAL):
+            try:
+                if not self.store.update(job):
+                    return
+            except Exception:
+                # missed beats are tolerated up to HEARTBEAT_TIMEOUT
+                logger.exception("Could not save the heartbeat of job %s", job["id"])
+
+    def run(self, job):
+        start = time.perf_counter()
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, done), name="jobs-heartbeat", daemon=True).start()
+        try:
+            pool = self._get_pool()
+            if not self.store.update(job, model_version=self._pool_version):
+                raise _Lost()
+            with open(self.store.input_path(job), "rb") as source, open(self.store.result_path(job), "ab") as result:
+                rows = self._price(pool, job, source, result)
+        except _Stopped:
+            # the worker is shutting down: another one will run the job again
+            self.store.requeue(job)
+            return
+        except _Lost:
+            logger.warning("Job %s was queued again or deleted while running, run abandoned", job["id"])
+            return
+        except Exception as e:
+            logger.exception("Job %s failed", job["id"])
+            # a process of the pool may have died with it
+            self._close_pool()
+            self.store.update(job, status="failed", error=f"{type(e).__name__}: {e}", finished_at=_now())
+            return
+        finally:
+            done.set()
+        self.store.update(job, status="done", rows_total=rows, finished_at=_now())
+        logger.info("Job %s done in %.1fs", job["id"], time.perf_counter() - start)
+
+    def _price(self, pool, job, source, result):
+        # chunks are submitted ahead (two per process) and their results written in order
+        pending = deque()
+        rows_done = rows_failed = 0
+        chunks = iter_file_chunks(source, job["filename"], job["chunk_size"])
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * self.processes:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending.append(pool.submit(price_chunk, *chunk))
+            if not pending:
+                break
+            lines, priced, failed = pending.popleft().result()
+            result.write(lines.encode())
+            result.flush()
+            rows_done += priced + failed
+            rows_failed += failed
+            if not self.store.update(job, rows_done=rows_done, rows_failed=rows_failed):
+                raise _Lost()
+            if self._stopping:
+                raise _Stopped()
+        return rows_done
+
+
+def job_info(job):
+    """The job as returned by GET /jobs/{id}."""
+    total = job["rows_total"]
+    return {
+        **{key: job[key] for key in ("id", "status", "filename", "chunk_size", "model_version", "error")},
+        "rows_total": total,
+        "rows_done": job["rows_done"],
+        "rows_failed": job["rows_failed"],
+        "progress_percent": round(min(job["rows_done"] / total * 100, 100), 1) if total else (100.0 if job["status"] == "done" else 0.0),
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "result": f"/jobs/{job['id']}/result",
+    }
@@ -0,0 +1,103 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Prometheus metrics of the API.
+# Under gunicorn, every worker writes its values to PROMETHEUS_MULTIPROC_DIR (set by gunicorn.conf.py)
+# and /metrics adds up the values of all the workers.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUESTS = Counter("getaround_requests_total", "HTTP requests", ["method", "endpoint", "status"])
+REQUEST_LATENCY = Histogram(
+    "getaround_request_duration_seconds", "Time until the response starts, per endpoint",
+    ["method", "endpoint"], buckets=LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "getaround_stage_duration_seconds",
+    "Time spent in each stage of a request (parse_validate, build_frame, preprocess, predict, serialize)",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+CACHE_EVENTS = Counter("getaround_result_cache_events_total", "Result cache hits, misses, evictions...", ["event"])
+MODEL_LOAD_SECONDS = Gauge(
+    "getaround_model_load_seconds", "Duration of the last load of each model", ["model", "version"],
+    multiprocess_mode="max",
+)
+MODEL_LOADS = Counter("getaround_model_loads_total", "Models (re)loaded", ["model"])
+BATCH_SIZE = Histogram(
+    "getaround_microbatch_size", "Requests priced per model call by the /predict micro-batcher",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+QUEUE_DEPTH = Gauge(
+    "getaround_microbatch_queue_depth", "Requests waiting in the /predict micro-batcher",
+    multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one stage of the request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+
+def observe_stage(name, seconds):
+    STAGE_LATENCY.labels(name).observe(seconds)
+
+
+def render():
+    """Body and content type of the /metrics response, aggregated over all workers when running under gunicorn."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        from prometheus_client import REGISTRY as registry
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of a stopped worker (called by gunicorn's child_exit hook)."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
+
+
+class RequestProfiler:
+    """Profiler of a single request: `start()`, await the request, then `stop()` returns a text report.
+
+    Uses the pyinstrument sampling profiler when it is installed (following the request across awaits),
+    cProfile otherwise."""
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+        if Profiler is not None:
+            self._profiler = Profiler(interval=0.0005, async_mode="enabled")
+            self._sampling = True
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._sampling = False
+
+    def start(self):
+        if self._sampling:
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self._sampling:
+            self._profiler.stop()
+            return self._profiler.output_text(unicode=True, color=False)
+        import io
+        import pstats
+        self._profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(self._profiler, stream=report).sort_stats("cumulative").print_stats(40)
+        return report.getvalue()
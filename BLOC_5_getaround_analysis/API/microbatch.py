@@ -0,0 +1,168 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from metrics import BATCH_SIZE, QUEUE_DEPTH
+
+
+@dataclass
+class BatcherStats:
+    requests: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    max_batch_size: int = 0
+    # number of batches by size, e.g. {1: 10, 8: 3}
+    batch_sizes: dict = field(default_factory=dict)
+    busy_seconds: float = 0.0
+
+    def record(self, size, seconds):
+        self.batches += 1
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+        self.busy_seconds += seconds
+        BATCH_SIZE.observe(size)
+
+
+class MicroBatcher:
+    """Group concurrent single-row predictions into one model call.
+
+    Requests arriving within `max_wait` seconds of the first queued one (or until `max_batch_size`
+    rows are waiting) are predicted together by `predict_fn(records) -> sequence of predictions`,
+    which runs in a thread pool so the event loop keeps accepting requests meanwhile.
+
+    `stop()` lets the batches being predicted finish, and fails the requests still queued."""
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait=0.002, workers=1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.workers = workers
+        self.stats = BatcherStats()
+        self._queue = None
+        self._task = None
+        self._executor = None
+        self._slots = None
+        # batches being predicted: the event loop only keeps weak references to tasks
+        self._tasks = set()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="microbatch")
+        # at most one batch per worker thread in flight, the next one is collected meanwhile
+        self._slots = asyncio.Semaphore(self.workers)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        while self._queue is not None and not self._queue.empty():
+            self._fail([self._queue.get_nowait()])
+            QUEUE_DEPTH.dec()
+        if self._executor is not None:
+            # the threads are joined off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+            self._executor = None
+
+    @staticmethod
+    def _fail(batch):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("MicroBatcher stopped"))
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, record):
+        """Queue one record and wait for its prediction."""
+        if self._task is None:
+            raise RuntimeError("MicroBatcher is not started")
+        future = asyncio.get_running_loop().create_future()
+        self.stats.requests += 1
+        await self._queue.put((record, future))
+        QUEUE_DEPTH.inc()
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        QUEUE_DEPTH.dec()
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                QUEUE_DEPTH.dec()
+        except asyncio.CancelledError:
+            self._fail(batch)
+            raise
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                self._fail(batch)
+                raise
+            task = asyncio.create_task(self._predict(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _predict(self, batch):
+        loop = asyncio.get_running_loop()
+        records = [record for record, _ in batch]
+        start = time.perf_counter()
+        try:
+            try:
+                predictions = await loop.run_in_executor(self._executor, self.predict_fn, records)
+            except Exception:
+                self.stats.failed_batches += 1
+                # one bad row must not fail the other callers: retry the rows one by one
+                predictions = [await self._predict_one(record) for record in records]
+            self.stats.record(len(batch), time.perf_counter() - start)
+            for (_, future), prediction in zip(batch, predictions):
+                if future.done():
+                    continue
+                if isinstance(prediction, Exception):
+                    future.set_exception(prediction)
+                else:
+                    future.set_result(prediction)
+        finally:
+            self._slots.release()
+
+    async def _predict_one(self, record):
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, self.predict_fn, [record])
+            return result[0]
+        except Exception as e:
+            return e
+
+    def info(self):
+        stats = self.stats
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "requests": stats.requests,
+            "batches": stats.batches,
+            "failed_batches": stats.failed_batches,
+            "mean_batch_size": round(sum(s * n for s, n in stats.batch_sizes.items()) / stats.batches, 2) if stats.batches else 0,
+            "largest_batch_size": stats.max_batch_size,
+            "batch_sizes": dict(sorted(stats.batch_sizes.items())),
+            "busy_seconds": round(stats.busy_seconds, 4),
+        }
@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from joblib import load
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    """A deserialized model together with the metadata of the file it was loaded from."""
+    name: str
+    path: str
+    model: Any
+    version: str
+    mtime: float
+    loaded_at: datetime
+    load_seconds: float
+
+    def info(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "version": self.version,
+            "file_modified_at": datetime.fromtimestamp(self.mtime, timezone.utc).isoformat(),
+            "loaded_at": self.loaded_at.isoformat(),
+            "load_seconds": round(self.load_seconds, 4),
+        }
+
+
+def file_version(path):
+    # Short content hash, so that two deployments of the same file report the same version
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def load_model(name, path):
+    """Deserialize the model stored at `path`."""
+    start = time.perf_counter()
+    mtime = os.path.getmtime(path)
+    model = load(path)
+    return LoadedModel(
+        name=name,
+        path=path,
+        model=model,
+        version=file_version(path),
+        mtime=mtime,
+        loaded_at=datetime.now(timezone.utc),
+        load_seconds=time.perf_counter() - start,
+    )
+
+
+@dataclass
+class ModelRegistry:
+    """Models loaded once at startup and shared by every request.
+
+    `get()` watches the model file and reloads it in a background thread when it changes on disk: requests
+    keep being served by the current model meanwhile, none waits for the load. Each callable of `listeners`
+    is called with the new LoadedModel (e.g. to build what depends on it) before it replaces the old one, so
+    requests that already hold a model keep using it and new requests never see a half-loaded model."""
+    paths: Dict[str, str]
+    reload_interval: float = 5.0
+    listeners: List = field(default_factory=list)
+    _models: Dict[str, LoadedModel] = field(default_factory=dict)
+    _last_check: Dict[str, float] = field(default_factory=dict)
+    # mtime of the files that could not be loaded: not tried again until they change
+    _failed: Dict[str, float] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def load_all(self):
+        for name in self.paths:
+            self.reload(name)
+
+    def reload(self, name):
+        loaded = load_model(name, self.paths[name])
+        for listener in self.listeners:
+            listener(loaded)
+        # a single dict assignment: readers see either the old or the new model
+        self._models[name] = loaded
+        self._last_check[name] = time.monotonic()
+        return loaded
+
+    def get(self, name):
+        """Return the current model for `name`, reloading it first if its file has changed."""
+        if name not in self._models:
+            with self._lock:
+                if name not in self._models:
+                    self.reload(name)
+        elif self.reload_interval > 0:
+            self._maybe_reload(name)
+        return self._models[name]
+
+    def _maybe_reload(self, name):
+        now = time.monotonic()
+        if now - self._last_check.get(name, 0) < self.reload_interval:
+            return
+        # only one check at a time, the callers keep serving the current model
+        if not self._lock.acquire(blocking=False):
+            return
+        self._last_check[name] = now
+        try:
+            threading.Thread(target=self._reload_if_changed, args=(name,), name=f"reload-{name}", daemon=True).start()
+        except Exception:
+            self._lock.release()
+            raise
+
+    def _reload_if_changed(self, name):
+        # runs in its own thread, with the lock held (released here)
+        try:
+            try:
+                mtime = os.path.getmtime(self.paths[name])
+            except OSError:
+                return
+            if mtime != self._models[name].mtime and mtime != self._failed.get(name):
+                try:
+                    self.reload(name)
+                except Exception:
+                    # keep serving the previous model if the new file cannot be loaded (e.g. partially written)
+                    logger.exception("Could not reload model %s from %s", name, self.paths[name])
+                    self._failed[name] = mtime
+        finally:
+            self._lock.release()
+
+    def info(self):
+        return [loaded.info() for loaded in self._models.values()]
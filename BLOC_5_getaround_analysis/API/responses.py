@@ -0,0 +1,83 @@
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+# Output formats of the row endpoints (/preview, /filter-by)
+#  - dict    : column-oriented {"column": {"row": value}} (historical format)
+#  - records : {"rows": [{"column": value}, ...], "offset": ..., "next_offset": ...}
+#  - ndjson  : one JSON object per row, streamed
+#  - csv     : streamed CSV with a header line
+PAGED_FORMATS = ("dict", "records")
+STREAMED_FORMATS = ("ndjson", "csv")
+
+
+def project(frame, fields):
+    """Keep only the comma-separated `fields` of `frame` (all columns when `fields` is empty)."""
+    if not fields:
+        return frame
+    columns = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [c for c in columns if c not in frame.columns]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields {unknown}, fields must be among {list(frame.columns)}")
+    return frame[columns]
+
+
+def _records_json(frame):
+    # Encoded straight from the columns, without building Python dicts first
+    return frame.to_json(orient="records", force_ascii=False)
+
+
+def page_response(frame, offset, limit, format):
+    """One page of `frame` as JSON. The X-Next-Offset header gives the offset of the next page, if any."""
+    page = frame.iloc[offset:offset + limit]
+    # limit >= 1, so that a client following X-Next-Offset always moves forward
+    next_offset = offset + limit if limit > 0 and offset + limit < len(frame) else None
+    headers = {"X-Total-Count": str(len(frame))}
+    if next_offset is not None:
+        headers["X-Next-Offset"] = str(next_offset)
+    if format == "dict":
+        return Response(content=page.to_json(orient="columns", force_ascii=False), media_type="application/json", headers=headers)
+    body = '{{"offset":{},"next_offset":{},"total":{},"rows":{}}}'.format(
+        offset, "null" if next_offset is None else next_offset, len(frame), _records_json(page)
+    )
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _iter_ndjson(frame, chunk_size):
+    for start in range(0, len(frame), chunk_size):
+        yield frame.iloc[start:start + chunk_size].to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n"
+
+
+def _iter_csv(frame, chunk_size):
+    yield frame.iloc[:0].to_csv(index=False)
+    for start in range(0, len(frame), chunk_size):
+        yield frame.iloc[start:start + chunk_size].to_csv(index=False, header=False)
+
+
+def stream_response(frame, format, chunk_size):
+    """Stream `frame` as NDJSON or CSV, encoding `chunk_size` rows at a time."""
+    if format == "csv":
+        return StreamingResponse(_iter_csv(frame, chunk_size), media_type="text/csv")
+    return StreamingResponse(_iter_ndjson(frame, chunk_size), media_type="application/x-ndjson")
+
+
+def rows_response(frame, offset, limit, fields, format, max_page_size, chunk_size):
+    """Response of a row endpoint: a page for the JSON formats, the whole selection for the streamed ones and for the
+    dict format without `limit`."""
+    if format not in PAGED_FORMATS + STREAMED_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of the following: {list(PAGED_FORMATS + STREAMED_FORMATS)}")
+    if offset < 0:
+        raise HTTPException(status_code=422, detail="offset must be positive")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=422, detail="the number of rows must be at least 1")
+    frame = project(frame, fields)
+    if format in STREAMED_FORMATS:
+        frame = frame.iloc[offset:] if limit is None else frame.iloc[offset:offset + limit]
+        return stream_response(frame, format, chunk_size)
+    if limit is None and format == "dict":
+        # the historical format has no room to tell there is a next page: all the rows, as before pagination
+        return page_response(frame, offset, max(len(frame) - offset, 1), format)
+    if limit is None:
+        limit = max_page_size
+    if limit > max_page_size:
+        raise HTTPException(status_code=422, detail=f"At most {max_page_size} rows can be returned as JSON, use format=ndjson or format=csv to get more")
+    return page_response(frame, offset, limit, format)
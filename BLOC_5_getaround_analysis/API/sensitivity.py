@@ -0,0 +1,90 @@
+"""What-if price curves of one car: the price predicted for each value of a feature, the other features unchanged.
+
+All the curves of a request are priced at once: the grid holds the car itself, then one row per value of each
+sweep (the car with the swept feature overwritten), built column by column as arrays and priced by a single
+`predict_frame` call of the predictor.
+"""
+import numpy as np
+import pandas as pd
+
+from batching import FEATURE_COLUMNS
+from metrics import stage
+from validation import BOOLEAN_FEATURES, CATEGORICAL_FEATURES, NUMERICAL_FEATURES
+
+
+def sweep_values(feature, vocabulary, values=None, start=None, stop=None, step=None, max_values=None):
+    """Values of `feature` in a sweep: the listed `values`, or from `start` (included) to `stop` (excluded) every
+    `step` for mileage and engine_power. By default, both values of a flag and every category the model knows.
+
+    Raises ValueError when the sweep is not valid for the feature, gives both values and a range, or has more than
+    `max_values` values."""
+    if feature not in FEATURE_COLUMNS:
+        raise ValueError(f"feature must be one of the following: {FEATURE_COLUMNS}")
+    ranged = any(bound is not None for bound in (start, stop, step))
+    if ranged and feature not in NUMERICAL_FEATURES:
+        raise ValueError(f"{feature}: start, stop and step only apply to {NUMERICAL_FEATURES}")
+    if values is not None and ranged:
+        raise ValueError(f"{feature}: give either values or start, stop and step, not both")
+    if values is None and ranged:
+        if None in (start, stop, step) or step <= 0 or stop <= start:
+            raise ValueError(f"{feature}: start, stop and a positive step are needed, stop greater than start")
+        if max_values is not None and np.ceil((stop - start) / step) > max_values:
+            raise ValueError(f"{feature}: at most {max_values} more values can be priced")
+        values = np.arange(start, stop, step).tolist()
+    elif values is None:
+        if feature in BOOLEAN_FEATURES:
+            values = [False, True]
+        elif feature in CATEGORICAL_FEATURES:
+            values = sorted(vocabulary.values[feature])
+        else:
+            raise ValueError(f"{feature}: values or start, stop and step are needed")
+
+    if not values:
+        raise ValueError(f"{feature}: at least one value is needed")
+    if max_values is not None and len(values) > max_values:
+        raise ValueError(f"{feature}: at most {max_values} more values can be priced")
+    if feature in BOOLEAN_FEATURES and not all(isinstance(v, bool) for v in values):
+        raise ValueError(f"{feature}: values must be true or false")
+    if feature in CATEGORICAL_FEATURES and not set(values) <= vocabulary.values[feature]:
+        raise ValueError(f"{feature}: {vocabulary.error_message(feature)}")
+    if feature in NUMERICAL_FEATURES and not all(isinstance(v, (int, float)) and not isinstance(v, bool) and v >= 0 for v in values):
+        raise ValueError(f"{feature}: values must be positive numbers")
+    return list(values)
+
+
+def build_grid(car, sweeps):
+    """The car followed by its variations: a frame in the model's column order, and the first row of each sweep."""
+    n = 1 + sum(len(values) for values in sweeps.values())
+    columns = {}
+    for column in FEATURE_COLUMNS:
+        if column in NUMERICAL_FEATURES:
+            columns[column] = np.full(n, float(car[column]))
+        elif column in BOOLEAN_FEATURES:
+            columns[column] = np.full(n, bool(car[column]))
+        else:
+            columns[column] = np.full(n, car[column], dtype=object)
+    offsets = {}
+    offset = 1
+    for feature, values in sweeps.items():
+        columns[feature][offset:offset + len(values)] = values
+        offsets[feature] = offset
+        offset += len(values)
+    return pd.DataFrame(columns, columns=FEATURE_COLUMNS), offsets
+
+
+def price_curves(predictor, car, sweeps):
+    """Price of the car and, for each feature of `sweeps` ({feature: values}), the price at each of its values and
+    the difference with the price of the car."""
+    with stage("build_frame"):
+        grid, offsets = build_grid(car, sweeps)
+    predictions = np.asarray(predictor.predict_frame(grid), dtype=np.float64)
+    price = float(predictions[0])
+    curves = {}
+    for feature, values in sweeps.items():
+        prices = predictions[offsets[feature]:offsets[feature] + len(values)]
+        curves[feature] = {
+            "values": values,
+            "predictions": prices.tolist(),
+            "differences": (prices - price).tolist(),
+        }
+    return {"prediction": price, "points": len(grid), "curves": curves}
@@ -0,0 +1,79 @@
+import os
+
+# Runtime configuration of the Getaround API.
+# Every value can be overridden with an environment variable of the same name.
+
+# Model files served by the API (name -> path of the .joblib file)
+MODEL_PATHS = {
+    "pricing": os.environ.get("PRICING_MODEL_PATH", "gbr_model.joblib"),
+}
+
+# Minimum number of seconds between two checks of the model files on disk (0 disables hot-reloading)
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", 5))
+
+# Number of cars priced per model call by the batch endpoints, and the largest chunk a client can ask for
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", 1000))
+BATCH_MAX_CHUNK_SIZE = int(os.environ.get("BATCH_MAX_CHUNK_SIZE", 10000))
+
+# Largest number of variations of the car priced by one /predict/sensitivity request (all sweeps together)
+SENSITIVITY_MAX_POINTS = int(os.environ.get("SENSITIVITY_MAX_POINTS", 10000))
+
+# Micro-batching of /predict: requests arriving within MICROBATCH_MAX_WAIT_MS of each other
+# (up to MICROBATCH_MAX_SIZE of them) are priced with a single model call
+MICROBATCH_ENABLED = os.environ.get("MICROBATCH_ENABLED", "1") == "1"
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get("MICROBATCH_MAX_WAIT_MS", 2))
+MICROBATCH_MAX_SIZE = int(os.environ.get("MICROBATCH_MAX_SIZE", 64))
+MICROBATCH_WORKERS = int(os.environ.get("MICROBATCH_WORKERS", 1))
+
+# Pricing dataset served by the exploration endpoints, reloaded when the file's mtime changes (rows ingested
+# since then are appended without reloading it)
+PRICING_DATA_PATH = os.environ.get("PRICING_DATA_PATH", "df_pricing.csv")
+DATASET_RELOAD_INTERVAL = float(os.environ.get("DATASET_RELOAD_INTERVAL", 5))
+
+# Delay analysis dataset served by the /delay endpoints, reloaded like the pricing dataset
+DELAY_DATA_PATH = os.environ.get("DELAY_DATA_PATH", "df_delay.csv")
+# Largest number of thresholds evaluated by one /delay/threshold-impact request
+MAX_THRESHOLDS = int(os.environ.get("MAX_THRESHOLDS", 10000))
+
+# Cache of the /groupby, /quantile and /delay results: maximum number of entries and time to live in seconds
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 256))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 300))
+
+# Row endpoints (/preview, /filter-by): largest page returned as JSON, and rows encoded per chunk when streaming
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 1000))
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 500))
+
+# How the pricing model is evaluated:
+# - pipeline : the sklearn pipeline stored in the .joblib file
+# - fast     : the pipeline's preprocessing compiled into NumPy lookup tables, then the XGBoost booster
+#              (same predictions, checked by `python fastpath.py`)
+# - trees    : the same compiled preprocessing, then the trees flattened into NumPy arrays and evaluated
+#              for the whole batch at once (checked by `python trees.py check`)
+INFERENCE_MODE = os.environ.get("INFERENCE_MODE", "pipeline")
+
+# What is loaded before the API reports ready (/health/ready):
+# - eager : the models and the datasets (shared by the workers when gunicorn preloads the app)
+# - lazy  : the models only, the datasets are loaded in the background once ready (faster cold start for
+#           single-process deployments that scale to zero, where /predict is the first request to answer)
+#           The dataset endpoints answer 503 (Retry-After: 5) until the datasets are loaded.
+# Imports are the same in both modes: the first /predict needs the heavy ones (see startup.py).
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "eager")
+
+# Per-request profiling: when enabled, a request sent with ?profile=1 or the header X-Profile: 1 returns
+# a profile of its handling (pyinstrument if installed, cProfile otherwise) instead of its response
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+
+# Bulk pricing jobs (/jobs): uploads, results and the SQLite job database are kept in JOBS_DIR, one job runs at a
+# time on JOBS_PROCESSES processes (all the cores by default, 0 disables the jobs), reading the file JOBS_CHUNK_SIZE
+# rows at a time. Finished jobs are deleted after JOBS_RETENTION_HOURS.
+JOBS_DIR = os.environ.get("JOBS_DIR", "jobs")
+JOBS_PROCESSES = int(os.environ.get("JOBS_PROCESSES", os.cpu_count()))
+JOBS_CHUNK_SIZE = int(os.environ.get("JOBS_CHUNK_SIZE", 5000))
+JOBS_RETENTION_HOURS = float(os.environ.get("JOBS_RETENTION_HOURS", 24))
+
+# Ingestion of new rentals and cars: files dropped in INGEST_DIR/delay or INGEST_DIR/pricing (.csv, .ndjson,
+# .parquet) are checked every INGEST_POLL_INTERVAL seconds (0 disables the watcher) and appended to the dataset,
+# and POST /ingest/{dataset} accepts at most INGEST_MAX_ROWS rows per request
+INGEST_DIR = os.environ.get("INGEST_DIR", "ingest")
+INGEST_POLL_INTERVAL = float(os.environ.get("INGEST_POLL_INTERVAL", 5))
+INGEST_MAX_ROWS = int(os.environ.get("INGEST_MAX_ROWS", 10000))
@@ -0,0 +1,78 @@
+"""Import time of the API, per package, to keep track of its cold start.
+
+    python startup.py                    # import time of app.py and of the packages it imports
+    python startup.py --top 30 --json    # more packages, as JSON
+    python startup.py --max-seconds 2    # exit code 1 when importing app.py takes longer (CI check)
+
+Imports are timed by `python -X importtime` in a fresh interpreter. The time of each module is its own (its
+"self" time), added up per top-level package, so the package times add up to the import time of app.py.
+Loading the models and datasets and the warm-up prediction are reported by /health/ready.
+
+STARTUP_MODE=lazy defers the loading of the datasets, not imports: the packages taking most of the import time
+(pandas, numpy, pyarrow which pandas imports, fastapi and pydantic) are needed to answer the first /predict, as are
+joblib to load the model and prometheus_client to count the request. The modules only the other endpoints need
+(dataset, ingest, jobs, sensitivity) take a few milliseconds, not worth importing late.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def import_times(module="app"):
+    """Microseconds spent importing each module when importing `module`: [(name, self, cumulative)] in import order."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(own), int(cumulative)))
+    return times
+
+
+def breakdown(times, module="app", top=15):
+    """Total import time of `module` and the `top` packages taking the longest to import, in seconds."""
+    packages = defaultdict(int)
+    for name, own, _ in times:
+        packages[name.split(".")[0]] += own
+    total = next((cumulative for name, _, cumulative in times if name == module), sum(packages.values()))
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_seconds": total / 1e6,
+        "modules": len(times),
+        "packages": {name: own / 1e6 for name, own in slowest},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time of the API, per package")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--top", type=int, default=15, help="number of packages listed")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--max-seconds", type=float, help="fail when the import takes longer than this")
+    args = parser.parse_args(argv)
+
+    report = breakdown(import_times(args.module), args.module, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import {report['module']}: {report['total_seconds']:.3f}s ({report['modules']} modules)")
+        for name, seconds in report["packages"].items():
+            print(f"  {name:<30} {seconds:8.3f}s {seconds / report['total_seconds']:6.1%}")
+    if args.max_seconds is not None and report["total_seconds"] > args.max_seconds:
+        print(f"FAILED: import took longer than {args.max_seconds}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""Flat, array-based evaluation of the pricing model's trees.
+
+The XGBoost ensemble of the pricing pipeline is exported into contiguous NumPy arrays (one entry per node of
+every tree: split feature, threshold, children, default direction for missing values, leaf value).
+`FlatForest.predict` then walks all the trees for a whole batch at once, one tree level per step.
+
+    python trees.py export [model.joblib] [flat_trees.npz]   # write the arrays to disk
+    python trees.py check [model.joblib] [df_pricing.csv]    # compare with the original model (also in tests/test_parity.py)
+
+The model is fitted as a gradient-boosted regressor (`gbr_model.joblib`) with XGBoost, so the arrays are read
+from the booster's JSON model rather than from sklearn's tree structures.
+"""
+import json
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+
+from fastpath import FastPredictor, synthetic_frame
+
+
+@dataclass(frozen=True)
+class FlatForest:
+    # one entry per node, nodes of tree t start at roots[t]
+    feature: np.ndarray       # int32, split feature, -1 for leaves
+    threshold: np.ndarray     # float32, go left when x < threshold
+    left: np.ndarray          # int32, global index of the left child (the node itself for leaves)
+    right: np.ndarray         # int32, global index of the right child (the node itself for leaves)
+    default_left: np.ndarray  # bool, direction of missing values
+    value: np.ndarray         # float32, leaf value (0 for split nodes)
+    roots: np.ndarray         # int32, global index of each tree's root
+    base_score: float
+    max_depth: int
+
+    @classmethod
+    def from_booster(cls, booster):
+        model = json.loads(booster.save_raw("json"))["learner"]
+        if model["gradient_booster"]["name"] != "gbtree":
+            raise ValueError("Only tree boosters can be flattened")
+        if int(model["learner_model_param"].get("num_class", 0)) > 1:
+            raise ValueError("Only single output models can be flattened")
+        trees = model["gradient_booster"]["model"]["trees"]
+        if any(tree.get("categories_nodes") for tree in trees):
+            raise ValueError("Trees with categorical splits are not supported")
+
+        feature, threshold, left, right, default_left, value, roots = [], [], [], [], [], [], []
+        max_depth, offset = 0, 0
+        for tree in trees:
+            lefts = np.asarray(tree["left_children"], dtype=np.int64)
+            rights = np.asarray(tree["right_children"], dtype=np.int64)
+            conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+            is_leaf = lefts == -1
+            nodes = np.arange(len(lefts))
+            roots.append(offset)
+            feature.append(np.where(is_leaf, -1, tree["split_indices"]).astype(np.int32))
+            threshold.append(np.where(is_leaf, 0, conditions).astype(np.float32))
+            left.append(np.where(is_leaf, nodes, lefts) + offset)
+            right.append(np.where(is_leaf, nodes, rights) + offset)
+            default_left.append(np.asarray(tree["default_left"], dtype=bool))
+            # leaf values are stored in split_conditions
+            value.append(np.where(is_leaf, conditions, 0).astype(np.float32))
+            max_depth = max(max_depth, _depth(lefts, rights))
+            offset += len(lefts)
+
+        return cls(
+            feature=np.concatenate(feature),
+            threshold=np.concatenate(threshold),
+            left=np.concatenate(left).astype(np.int32),
+            right=np.concatenate(right).astype(np.int32),
+            default_left=np.concatenate(default_left),
+            value=np.concatenate(value),
+            roots=np.asarray(roots, dtype=np.int32),
+            base_score=float(model["learner_model_param"]["base_score"]),
+            max_depth=max_depth,
+        )
+
+    @classmethod
+    def from_pipeline(cls, pipeline, iteration_range=(0, 0)):
+        forest = cls.from_booster(pipeline.steps[-1][1].get_booster())
+        start, stop = iteration_range
+        if (start, stop) != (0, 0):
+            forest = forest.select(start, stop)
+        return forest
+
+    def select(self, start, stop):
+        """The same forest restricted to the trees of rounds [start, stop)."""
+        return FlatForest(**{**self.arrays(), "roots": self.roots[start:stop],
+                             "base_score": self.base_score, "max_depth": self.max_depth})
+
+    def arrays(self):
+        return {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "left": self.left,
+            "right": self.right,
+            "default_left": self.default_left,
+            "value": self.value,
+            "roots": self.roots,
+        }
+
+    def save(self, path):
+        np.savez(path, base_score=self.base_score, max_depth=self.max_depth, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        return cls(base_score=float(arrays.pop("base_score")), max_depth=int(arrays.pop("max_depth")), **arrays)
+
+    def __post_init__(self):
+        # lookup tables of the evaluation loop: the child reached is children[2 * node + go_left]
+        object.__setattr__(self, "_children", np.stack([self.right, self.left], axis=1).astype(np.intp).ravel())
+        object.__setattr__(self, "_split_feature", np.maximum(self.feature, 0).astype(np.intp))
+
+    def predict(self, X, missing=np.nan, chunk_size=256):
+        """Sum of the leaf values reached by each row of X in every tree, plus the base score.
+
+        Values equal to `missing` (or NaN) follow each node's default direction."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = np.empty(len(X), dtype=np.float32)
+        for start in range(0, len(X), chunk_size):
+            out[start:start + chunk_size] = self._predict_chunk(X[start:start + chunk_size], missing)
+        return out
+
+    def _predict_chunk(self, X, missing):
+        n, n_features = X.shape
+        values = X.ravel()
+        row_start = (np.arange(n, dtype=np.intp) * n_features)[:, None]
+        node = np.broadcast_to(self.roots.astype(np.intp), (n, len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            # leaves point to themselves, so rows that reached one simply stay there
+            x = values.take(row_start + self._split_feature.take(node))
+            is_missing = np.isnan(x) if np.isnan(missing) else (x == missing) | np.isnan(x)
+            go_left = np.where(is_missing, self.default_left.take(node), x < self.threshold.take(node))
+            node = self._children.take(2 * node + go_left)
+        return self.value.take(node).sum(axis=1, dtype=np.float32) + np.float32(self.base_score)
+
+
+def _depth(lefts, rights):
+    depth, level = 0, [0]
+    while level:
+        children = [c for n in level for c in (lefts[n], rights[n]) if c != -1]
+        if not children:
+            break
+        depth += 1
+        level = children
+    return depth
+
+
+class TreePredictor(FastPredictor):
+    """Compiled preprocessing (see fastpath.py) followed by the flat tree evaluator."""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline)
+        self.forest = FlatForest.from_pipeline(pipeline, self.iteration_range)
+
+    def predict_array(self, X):
+        # zeros are absent entries of the sparse matrix the pipeline gives XGBoost, i.e. missing values
+        return self.forest.predict(X, missing=0.0)
+
+
+def check(pipeline, frame, rtol=1e-5, atol=1e-3):
+    """Compare the flat evaluator with the original model on `frame`, return the largest difference or raise."""
+    expected = pipeline.predict(frame)
+    predicted = TreePredictor(pipeline).predict_frame(frame)
+    difference = float(np.abs(predicted - expected).max()) if len(frame) else 0.0
+    if not np.allclose(predicted, expected, rtol=rtol, atol=atol):
+        raise AssertionError(f"flat trees differ from the model by up to {difference}")
+    return difference
+
+
+if __name__ == "__main__":
+    from joblib import load
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    model_path = sys.argv[2] if len(sys.argv) > 2 else "gbr_model.joblib"
+    pipeline = load(model_path)
+
+    if command == "export":
+        output = sys.argv[3] if len(sys.argv) > 3 else "flat_trees.npz"
+        forest = TreePredictor(pipeline).forest
+        forest.save(output)
+        print(f"{len(forest.roots)} trees, {len(forest.feature)} nodes, depth {forest.max_depth} written to {output}")
+    elif command == "check":
+        from dataset import read_pricing
+        from validation import Vocabulary
+
+        data_path = sys.argv[3] if len(sys.argv) > 3 else "df_pricing.csv"
+        data = read_pricing(data_path).astype({"model_key": object, "fuel": object, "paint_color": object, "car_type": object})
+        data = data[data["model_key"].isin(Vocabulary.from_model(pipeline).values["model_key"])]
+        data = data.drop(columns="rental_price_per_day")
+        for name, frame in [(data_path, data), ("synthetic cars", synthetic_frame(pipeline))]:
+            print(f"{name}: {len(frame)} rows, max difference {check(pipeline, frame):.6f}")
+    else:
+        sys.exit(f"Unknown command {command!r}, use export or check")
@@ -0,0 +1,110 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet
+
+import numpy as np
+import pandas as pd
+
+from batching import FEATURE_COLUMNS
+
+CATEGORICAL_FEATURES = ["model_key", "fuel", "paint_color", "car_type"]
+NUMERICAL_FEATURES = ["mileage", "engine_power"]
+BOOLEAN_FEATURES = [
+    "private_parking_available",
+    "has_gps",
+    "has_air_conditioning",
+    "automatic_car",
+    "has_getaround_connect",
+    "has_speed_regulator",
+    "winter_tires",
+]
+
+_BOOLEANS = {"True": True, "False": False, "true": True, "false": False}
+
+
+def parse_booleans(values):
+    """`values` as booleans: true / false, or their text ("true", "False"...). Anything else, 1 and 0 included, is
+    missing (None)."""
+    return values.map(lambda v: bool(v) if isinstance(v, (bool, np.bool_)) else _BOOLEANS.get(v) if isinstance(v, str) else None)
+
+
+def parse_numbers(values):
+    """`values` as numbers, and the mask of those that are negative. Anything else is missing (NaN)."""
+    if values.dtype == bool:
+        values = pd.Series(np.nan, index=values.index)
+    elif values.dtype == object:
+        # true is not 1
+        values = values.where(~values.map(lambda v: isinstance(v, (bool, np.bool_))))
+    values = pd.to_numeric(values, errors="coerce")
+    return values, (values < 0).to_numpy()
+
+
+def _fitted_encoder(pipeline):
+    # the OneHotEncoder of the 'Preprocessing' ColumnTransformer, whether wrapped in a Pipeline or not
+    preprocessor = pipeline.steps[0][1] if hasattr(pipeline, "steps") else pipeline
+    for _, transformer, columns in preprocessor.transformers_:
+        encoder = transformer.steps[-1][1] if hasattr(transformer, "steps") else transformer
+        if hasattr(encoder, "categories_"):
+            return encoder, list(columns)
+    raise ValueError("No fitted categorical encoder found in the model")
+
+
+@dataclass(frozen=True)
+class Vocabulary:
+    """Allowed values of each categorical feature, built once from the fitted model."""
+    values: Dict[str, FrozenSet[str]]
+    source: str
+
+    @classmethod
+    def from_model(cls, pipeline, source="model"):
+        encoder, columns = _fitted_encoder(pipeline)
+        categories = dict(zip(columns, encoder.categories_))
+        return cls({column: frozenset(categories[column].tolist()) for column in CATEGORICAL_FEATURES}, source)
+
+    @classmethod
+    def from_frame(cls, frame, source="dataset"):
+        return cls({column: frozenset(frame[column].dropna().unique().tolist()) for column in CATEGORICAL_FEATURES}, source)
+
+    def error_message(self, column):
+        return f"{column} must be one of the following: {sorted(self.values[column])}"
+
+    def info(self):
+        return {"source": self.source, **{column: sorted(values) for column, values in self.values.items()}}
+
+
+def validate_frame(frame, vocabulary):
+    """Check the rows of a batch with one vectorized test per rule.
+
+    Returns the valid rows, in the model's column order and dtypes, and a dict
+    {row position: error message} for the invalid ones."""
+    n = len(frame)
+    invalid = np.zeros(n, dtype=bool)
+    messages = defaultdict(list)
+
+    def flag(mask, message):
+        nonlocal invalid
+        invalid |= mask
+        for i in np.flatnonzero(mask):
+            messages[int(i)].append(message)
+
+    clean = {}
+    for column in FEATURE_COLUMNS:
+        if column not in frame:
+            flag(np.ones(n, dtype=bool), f"{column}: field required")
+            continue
+        values = frame[column]
+        if column in CATEGORICAL_FEATURES:
+            flag(~values.isin(vocabulary.values[column]).to_numpy(), f"{column}: {vocabulary.error_message(column)}")
+        elif column in NUMERICAL_FEATURES:
+            values, negative = parse_numbers(values)
+            flag(values.isna().to_numpy(), f"{column}: value is not a valid number")
+            flag(negative, f"{column}: {column} must be positive")
+        elif values.dtype != bool:
+            values = parse_booleans(values)
+            flag(values.isna().to_numpy(), f"{column}: value is not a valid boolean")
+        clean[column] = values
+
+    if invalid.all():
+        return pd.DataFrame(columns=FEATURE_COLUMNS), {i: "; ".join(m) for i, m in messages.items()}
+    valid = pd.DataFrame(clean).loc[~invalid].astype({column: bool for column in BOOLEAN_FEATURES})
+    return valid, {i: "; ".join(m) for i, m in sorted(messages.items())}
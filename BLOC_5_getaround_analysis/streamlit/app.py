@@ -1,11 +1,14 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px 
 import plotly.graph_objects as go
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+import io
+import os
+import threading
 import warnings
+from delay_analysis import ThresholdEngine, Distribution, distributions, append_distributions, delay_costs, DELAY_COLUMN, DELTA_COLUMN
+from storage import read_table, resolve, list_segments, read_segments, concat
 warnings.filterwarnings('ignore')
 
 ### Config
@@ -54,119 +57,365 @@ st.markdown("""
     * threshold: how long should the minimum delay be?
 """)
 
-# Use `st.cache` when loading data is extremely useful
-# because it will cache your data so that your app
-# won't have to reload it each time you refresh your app
+# Everything derived from the datasets is computed once per version of the CSV files and cached:
+# - st.cache_data for small results (a copy is returned on each call, so the page can't alter the cached value)
+# - st.cache_resource for the rentals, the threshold engine and the plotly figures (shared as is, never modified
+#   after creation: copying the whole rental history on every rerun would cost more than the page itself)
+# Matplotlib figures are cached as PNG images: drawing them is most of the cost, so it is done once.
+# Histograms and ECDF curves are drawn from fixed-size summaries (see delay_analysis.Distribution) rather than
+# from the rows, so the charts sent to the browser keep the same size however long the rental history gets.
+# The version argument (modification time and size of the file, and the segments of rows ingested since it was
+# written) is the cache key: new data means new results. The summaries of a new version are the previous ones with
+# the rows of the new segments added (see delay_state and pricing_state), so rentals ingested through the API show
+# up at the next rerun without the whole dataset being processed again.
+# Datasets are read from their typed Parquet/Arrow copies when there are some (see storage.py), from the CSVs otherwise.
+# Widget interactions (e.g. the "Show raw data" checkbox) then only re-render the page.
+
+DELAY_PATH = "./df_delay.csv"
+PRICING_PATH = "./df_pricing.csv"
 
-@st.cache(allow_output_mutation=True)
-def load_data():
-    data = pd.read_csv("./df_delay.csv")
-    return data
 
-st.markdown("---")
-st.markdown('# Load and showcase data')
+def file_version(path):
+    stat = os.stat(resolve(path))
+    return f"{stat.st_mtime_ns}-{stat.st_size}", tuple(list_segments(path))
 
-# Two equal columns:
-col1, col2 = st.columns(2)
+
+@st.cache_resource
+def latest_states():
+    # path -> last state built, shared by all the sessions so that the next version only adds its new segments
+    return {}
 
 
-data_load_state = col1.text('Loading data ...')
-data = load_data()
-data_load_state.text("") # change text from "Loading data..." to "" once the the load_data function has run
-## Run the below code if the check is checked ✅
-if col1.checkbox('Show raw data'):
-    col1.header('- [Delay Analysis](https://full-stack-assets.s3.eu-west-3.amazonaws.com/Deployment/get_around_delay_analysis.xlsx) 👈 Original Data')
-    col1.write(data)
+@st.cache_resource
+def latest_states_lock():
+    # sessions run in threads of the same process: one at a time reads and replaces the last state of a file
+    return threading.Lock()
 
-col1.caption('This dataset have been cleaned from outliers and preprocessed in order to be used for this analysis.')
-with col2:
-    df_pricing = pd.read_csv("./df_pricing.csv")
+
+def incremental_state(path, version, load, append, columns=None):
+    """State of `path` at `version`: the last state built with the rows of the new segments appended if it is of the
+    same file, `load(rows of the file and its segments)` otherwise. Only `columns` are read."""
+    file, segments = version
+    with latest_states_lock():
+        last = latest_states().get(path)
+        if last is not None and last["file"] == file and set(last["segments"]) <= set(segments):
+            new = [segment for segment in segments if segment not in set(last["segments"])]
+            state = append(last, read_segments(path, new, columns)) if new else last
+        else:
+            state = load(concat([read_table(path, columns), read_segments(path, segments, columns) if segments else None]))
+        state = {**state, "file": file, "segments": segments}
+        latest_states()[path] = state
+    return state
+
+
+def load_delay_state(data):
+    paired = data.dropna(subset=[DELTA_COLUMN, DELAY_COLUMN])
+    return {
+        "data": data,
+        # Delays sorted once per checkin type, the impacted and solved counts of every threshold are then binary searches
+        "engine": ThresholdEngine.from_frame(data),
+        # distribution of the late checkouts, in total and for each checkin_type (mobile or connect)
+        "late": distributions(data[data[DELAY_COLUMN] >= 0], DELAY_COLUMN, bins=500),
+        # rentals with both a previous rental and a checkout delay
+        "paired": {variable: distributions(paired, variable) for variable in [DELTA_COLUMN, DELAY_COLUMN]},
+        "cars": set(paired['car_id'].unique()),
+    }
+
+
+def append_delay_state(state, data):
+    paired = data.dropna(subset=[DELTA_COLUMN, DELAY_COLUMN])
+    return {
+        "data": concat([state["data"], data]),
+        "engine": state["engine"].append(data),
+        "late": append_distributions(state["late"], data[data[DELAY_COLUMN] >= 0], DELAY_COLUMN),
+        "paired": {variable: append_distributions(state["paired"][variable], paired, variable) for variable in state["paired"]},
+        "cars": state["cars"] | set(paired['car_id'].unique()),
+    }
+
+
+@st.cache_resource(max_entries=2)
+def delay_state(version):
+    return incremental_state(DELAY_PATH, version, load_delay_state, append_delay_state)
+
+
+def load_pricing_state(data):
+    return {
+        "mileage": Distribution.from_values(data['mileage'], bins=100),
+        "price": Distribution.from_values(data['rental_price_per_day'], bins=100),
+    }
+
+
+def append_pricing_state(state, data):
+    return {
+        "mileage": state["mileage"].append(data['mileage']),
+        "price": state["price"].append(data['rental_price_per_day']),
+    }
+
+
+@st.cache_resource(max_entries=2)
+def pricing_state(version):
+    # only the columns the dashboard shows
+    return incremental_state(PRICING_PATH, version, load_pricing_state, append_pricing_state,
+                             columns=['mileage', 'rental_price_per_day'])
+
+
+# Streamlit downsizes wider images on every run: render them at most this wide
+MAX_IMAGE_WIDTH = 1460
+
+
+def figure_png(fig):
+    # same rendering as st.pyplot (dpi 200), lowered for the figures that would be wider than MAX_IMAGE_WIDTH
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight", dpi=min(200, MAX_IMAGE_WIDTH / fig.get_figwidth()))
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+@st.cache_resource(max_entries=2)
+def load_data(version):
+    return delay_state(version)["data"]
+
+
+@st.cache_data
+def pricing_summary(version):
+    state = pricing_state(version)
+    return {
+        "mileage": state["mileage"],
+        "price_mean": state["price"].mean,
+    }
+
+
+@st.cache_data
+def late_checkouts(version):
+    data = load_data(version)
+    return data[data['delay_at_checkout_in_minutes'] >= 0]
+
+
+@st.cache_data
+def delay_summary(version):
+    return delay_state(version)["late"]
+
+
+def draw_histogram(ax, distribution, **kwargs):
+    # each bin drawn as one value weighted by its count: the same bars as a histogram of the rows
+    edges = distribution.histogram_edges
+    ax.hist(edges[:-1], bins=edges, weights=distribution.histogram_counts, **kwargs)
+
+
+@st.cache_data
+def mileage_histogram(version):
+    mileage = pricing_summary(version)["mileage"]
+    mean, median, std = mileage.mean, mileage.median, mileage.std
     fig = plt.figure()
     ax = fig.add_subplot(111)
     plt.style.use('dark_background')
     #display distribution of mileage
-    plt.figure(figsize=(10,5))
-    ax.hist(df_pricing['mileage'], bins=100, color='gold')
+    draw_histogram(ax, mileage, color='gold')
     #add mean and median vertical lines
-    ax.axvline(df_pricing['mileage'].mean(), color='g', linestyle='dashed', linewidth=1)
-    ax.axvline(df_pricing['mileage'].median(), color='b', linestyle='dashed', linewidth=1)
+    ax.axvline(mean, color='g', linestyle='dashed', linewidth=1)
+    ax.axvline(median, color='b', linestyle='dashed', linewidth=1)
     #text displaying mean and median
-    ax.text(190000, 105, "Mean: {}".format(round(df_pricing['mileage'].mean(),2)), fontsize=10, color='g')
-    ax.text(190000, 100, "Median: {}".format(round(df_pricing['mileage'].median(),2)), fontsize=10, color='b')
+    ax.text(190000, 105, "Mean: {}".format(round(mean,2)), fontsize=10, color='g')
+    ax.text(190000, 100, "Median: {}".format(round(median,2)), fontsize=10, color='b')
     #text displaying standard deviation
-    ax.text(190000, 95, "Standard deviation: {}".format(round(df_pricing['mileage'].std(),2)), fontsize=10, color='r')
+    ax.text(190000, 95, "Standard deviation: {}".format(round(std,2)), fontsize=10, color='r')
     #visualize standard deviation on the histogram
-    ax.axvline(df_pricing['mileage'].mean() + df_pricing['mileage'].std(), color='r', linestyle='dashed', linewidth=1)
-    ax.axvline(df_pricing['mileage'].mean() - df_pricing['mileage'].std(), color='r', linestyle='dashed', linewidth=1)
+    ax.axvline(mean + std, color='r', linestyle='dashed', linewidth=1)
+    ax.axvline(mean - std, color='r', linestyle='dashed', linewidth=1)
     #colorize area of standard deviation
-    ax.axvspan(df_pricing['mileage'].mean() - df_pricing['mileage'].std(), df_pricing['mileage'].mean() + df_pricing['mileage'].std(), alpha=0.2, color='r')
+    ax.axvspan(mean - std, mean + std, alpha=0.2, color='r')
     ax.set_title('Histogram of mileage')
     ax.set_xlabel('mileage')
     ax.set_ylabel('Frequency')
 
     #add legend
-    ax.legend({'Mean':df_pricing['mileage'].mean(),'Median':df_pricing['mileage'].median()})
-    st.pyplot(fig)
+    ax.legend({'Mean':mean,'Median':median})
+    return figure_png(fig)
 
-st.markdown("---")
-st.markdown('# Basic Statistics about dataset')
 
-col1, col2 = st.columns(2)
-with col1:
+@st.cache_data
+def delay_histogram(version):
     #use matplotlib to plot the histogram with gg plot style
-    data1 = data[data['delay_at_checkout_in_minutes'] >= 0]
+    delays = delay_summary(version)["all"]
+    mean, median, std = delays.mean, delays.median, delays.std
     fig = plt.figure()
     ax = fig.add_subplot(111)
     plt.style.use('dark_background')
-    data1['delay_at_checkout_in_minutes'].hist(bins=500)
-    ax.axvline(data1['delay_at_checkout_in_minutes'].mean(), color='g', linestyle='dashed', linewidth=1)
-    ax.axvline(data1['delay_at_checkout_in_minutes'].median(), color='b', linestyle='dashed', linewidth=1)
-    plt.xlim(0,1500)
+    draw_histogram(ax, delays)
+    ax.grid(True)
+    ax.axvline(mean, color='g', linestyle='dashed', linewidth=1)
+    ax.axvline(median, color='b', linestyle='dashed', linewidth=1)
+    ax.set_xlim(0,1500)
     #text annotation
-    ax.text(200, 500, 'Mean = {:.2f}'.format(data1['delay_at_checkout_in_minutes'].mean()), color='g')
-    ax.text(200, 450, 'Median = {:.2f}'.format(data1['delay_at_checkout_in_minutes'].median()), color='b')
+    ax.text(200, 500, 'Mean = {:.2f}'.format(mean), color='g')
+    ax.text(200, 450, 'Median = {:.2f}'.format(median), color='b')
     #add standard deviation vertical lines
-    ax.axvline(data1['delay_at_checkout_in_minutes'].mean() + data1['delay_at_checkout_in_minutes'].std(), color='r', linestyle='dashed', linewidth=1)
-    ax.axvline(data1['delay_at_checkout_in_minutes'].mean() - data1['delay_at_checkout_in_minutes'].std(), color='r', linestyle='dashed', linewidth=1)
+    ax.axvline(mean + std, color='r', linestyle='dashed', linewidth=1)
+    ax.axvline(mean - std, color='r', linestyle='dashed', linewidth=1)
     #color the area between the standard deviation lines
-    ax.axvspan(data1['delay_at_checkout_in_minutes'].mean() - data1['delay_at_checkout_in_minutes'].std(), data1['delay_at_checkout_in_minutes'].mean() + data1['delay_at_checkout_in_minutes'].std(), alpha=0.2, color='red')
+    ax.axvspan(mean - std, mean + std, alpha=0.2, color='red')
     #text annotation
-    ax.text(200, 400, 'Standard deviation = {:.2f}'.format(data1['delay_at_checkout_in_minutes'].std()), color='r')
+    ax.text(200, 400, 'Standard deviation = {:.2f}'.format(std), color='r')
 
     ax.set_title('Histogram of delay_at_checkout_in_minutes')
     ax.set_xlabel('delay_at_checkout_in_minutes')
     ax.set_ylabel('Frequency')
+    return figure_png(fig)
 
-    st.pyplot(fig)
-    
-    st.markdown("---")
-    #separating data into two groups based on checkin_type mobile or connect
-    df_delay_mobile = data1[data1['checkin_type'] == 'mobile']
-    df_delay_connect = data1[data1['checkin_type'] == 'connect']
-    #calculating median of delay_at_checkout_in_minutes for each group
-    st.markdown('Median of delay_at_checkout_in_minutes for mobile checkin_type: {} Min'.format(df_delay_mobile['delay_at_checkout_in_minutes'].median()))
-    st.markdown('Median of delay_at_checkout_in_minutes for connect checkin_type: {} Min'.format(df_delay_connect['delay_at_checkout_in_minutes'].median()))
 
-    #storing the median values in a list
-    medians = [df_delay_mobile['delay_at_checkout_in_minutes'].median(), df_delay_connect['delay_at_checkout_in_minutes'].median()]
+@st.cache_data
+def delay_countplot(version):
+    data1 = late_checkouts(version)
+    fig = plt.figure(figsize=(10,6))
+    ax = sns.countplot(data=data1, x='delay_category', hue='checkin_type', hue_order=['mobile', 'connect'], palette=["#BE6E46", "#7286A0"], order=['Late: 0-15 mins', 'Late: 30-60 mins', 'Late: 1-2 hours', 'Late: > 2 hours'])
+    ax.set_title('Countplot of delay_category')
+    ax.set_xlabel('delay_category')
+    return figure_png(fig)
+
+
+def load_engine(version):
+    return delay_state(version)["engine"]
+
+
+@st.cache_data
+def threshold_summary(version):
+    data = load_data(version)
+    engine = load_engine(version)
+    df_threshold = data.dropna(subset=['time_delta_with_previous_rental_in_minutes'])
+    delta = df_threshold['time_delta_with_previous_rental_in_minutes'] - df_threshold['delay_at_checkout_in_minutes']
+
+    threshold_range = np.arange(0, 60*12, step=15) # 15min intervals for 12 hours
+    sweep = engine.sweep(threshold_range)
+    occurences = engine.conflict_count()
+    return {
+        "sweep": sweep,
+        "occurences": occurences,
+        "occ_percent": occurences / len(data) * 100,
+        "late_30": int((delta < -30).sum()),
+        "impacted_30": int(engine.impacted([30])[0]),
+    }
+
+
+@st.cache_data
+def threshold_figure(version):
+    sweep = threshold_summary(version)["sweep"]
+    threshold_range = sweep['threshold'].to_numpy()
+    impacted_list_total = sweep['impacted_total'].tolist()
+    solved_list_total = sweep['solved_total'].tolist()
+
+    fig, ax = plt.subplots(1, 2, sharex=True, figsize=(20,7))
+    ax[1].plot(threshold_range, sweep['solved_connect'])
+    ax[1].plot(threshold_range, sweep['solved_mobile'])
+    ax[1].plot(threshold_range, solved_list_total)
+    ax[0].plot(threshold_range, sweep['impacted_connect'])
+    ax[0].plot(threshold_range, sweep['impacted_mobile'])
+    ax[0].plot(threshold_range, impacted_list_total)
+    ax[0].set_xlabel('Threshold (min)')
+    ax[0].set_ylabel('Number of impacted cases')
+    ax[1].set_xlabel('Threshold (min)')
+    ax[1].set_ylabel('Number of cases solved')
+    ax[1].legend(['Connect solved','Mobile solved','Total solved'], loc='upper left')
+    ax[0].legend(['Connect impacted','Mobile impacted','Total impacted'], loc='upper left')
+    #add horizontal line and vertical line crossing at point of origin x = 165
+    ax[1].axvline(x=165, color='b', linestyle='--')
+    #find index of threshold that is closest to 165
+    idx = (np.abs(threshold_range - 165)).argmin()
+    ax[1].axhline(y=solved_list_total[idx], color='b', linestyle='--')
+    #add text to show the number of cases solved at that threshold
+    ax[0].text(205, 750, f"{impacted_list_total[idx]} cases impacted at a 165 min Threshold", fontsize=12)
+    ax[1].text(225, 175, f"{solved_list_total[idx]} cases solved at a 165 min Threshold", fontsize=12)
+
+    ax[0].axvline(x=165, color='b', linestyle='--')
+    ax[0].axhline(y=impacted_list_total[idx], color='b', linestyle='--')
+
+    ax[1].axvline(x=120, color='r', linestyle='--')
+    ax[1].axvline(x=180, color='r', linestyle='--')
+    ax[0].axvline(x=120, color='r', linestyle='--')
+    ax[0].axvline(x=180, color='r', linestyle='--')
+    return figure_png(fig)
+
+
+@st.cache_data
+def ecdf_summary(version):
+    return delay_state(version)["paired"]
+
+
+@st.cache_resource
+def ecdf_figure(version, checkin_type):
+    summary = ecdf_summary(version)
+    fig = go.Figure()
+    for variable, color in zip([DELTA_COLUMN, DELAY_COLUMN], ["#BE6E46", "#7286A0"]):
+        distribution = summary[variable][checkin_type]
+        x, y = distribution.ecdf_x, distribution.ecdf_percent
+        # a step line only needs the points where the curve changes, and its last point
+        steps = np.r_[True, np.diff(y) != 0]
+        steps[-1] = True
+        fig.add_trace(go.Scatter(x=x[steps], y=y[steps], name=variable,
+                                 mode='lines', line_shape='hv', line_color=color))
+    fig.update_layout(
+        xaxis_title='threshold (minutes)',
+        yaxis_title='proportion of users (%)',
+        legend_title_text='variable',
+        xaxis_range=(0, 720),
+        )
+    fig.add_vline(x=165, line_dash="dash", line_color="red", line_width=2, annotation_text="Threshold 165 min")
+    return fig
+
+
+@st.cache_data
+def car_count(version):
+    return len(delay_state(version)["cars"])
+
+
+delay_version = file_version(DELAY_PATH)
+pricing_version = file_version(PRICING_PATH)
+
+st.markdown("---")
+st.markdown('# Load and showcase data')
+
+# Two equal columns:
+col1, col2 = st.columns(2)
+
+
+data_load_state = col1.text('Loading data ...')
+data = load_data(delay_version)
+data_load_state.text("") # change text from "Loading data..." to "" once the the load_data function has run
+## Run the below code if the check is checked ✅
+if col1.checkbox('Show raw data'):
+    col1.header('- [Delay Analysis](https://full-stack-assets.s3.eu-west-3.amazonaws.com/Deployment/get_around_delay_analysis.xlsx) 👈 Original Data')
+    col1.write(data)
+
+col1.caption('This dataset have been cleaned from outliers and preprocessed in order to be used for this analysis.')
+with col2:
+    st.image(mileage_histogram(pricing_version))
+
+st.markdown("---")
+st.markdown('# Basic Statistics about dataset')
+
+pricing = pricing_summary(pricing_version)
+delays = delay_summary(delay_version)
+#median of delay_at_checkout_in_minutes and number of data points for each group
+medians = [delays['mobile'].median, delays['connect'].median]
+n = [delays['mobile'].count, delays['connect'].count]
 
-    #calcaulating number of data points in each group
-    n = [len(df_delay_mobile), len(df_delay_connect)]
+col1, col2 = st.columns(2)
+with col1:
+    st.image(delay_histogram(delay_version))
+    
+    st.markdown("---")
+    st.markdown('Median of delay_at_checkout_in_minutes for mobile checkin_type: {:.1f} Min'.format(medians[0]))
+    st.markdown('Median of delay_at_checkout_in_minutes for connect checkin_type: {:.1f} Min'.format(medians[1]))
 
     st.markdown('-'*50)
     #average price of rental_price_per_day for each group
-    st.markdown('Average rental price per day: {:.2f} $ per day'.format(df_pricing['rental_price_per_day'].mean(), ))
+    st.markdown('Average rental price per day: {:.2f} $ per day'.format(pricing["price_mean"], ))
 
     #average price of rental_price_per_day per minute for each group
-    st.markdown('Average rental price per minute: {:.2f} $ per minute'.format(df_pricing['rental_price_per_day'].mean()/1440, ))
+    st.markdown('Average rental price per minute: {:.2f} $ per minute'.format(pricing["price_mean"]/1440, ))
 
 
 with col2:
-    fig = plt.figure(figsize=(10,6))
-    sns.countplot(data=data1, x='delay_category', hue='checkin_type', palette=["#BE6E46", "#7286A0"], order=['Late: 0-15 mins', 'Late: 30-60 mins', 'Late: 1-2 hours', 'Late: > 2 hours'])
-    ax.set_title('Countplot of delay_category')
-    ax.set_xlabel('delay_category')
-    st.pyplot(fig)
+    st.image(delay_countplot(delay_version))
 
 
 
@@ -178,9 +427,11 @@ with col2:
 
 
 st.markdown("---")
-st.markdown('Cost of delays for mobile checkin: {:.2f} $'.format(df_pricing['rental_price_per_day'].mean()/1440 * medians[0] * n[0]))
-st.markdown('Cost of delays for connect checkin: {:.2f} $'.format(df_pricing['rental_price_per_day'].mean()/1440 * medians[1] * n[1]))
-st.markdown('Total cost of delays: {:.2f} $'.format(df_pricing['rental_price_per_day'].mean()/1440 * medians[0] * n[0] + df_pricing['rental_price_per_day'].mean()/1440 * medians[1] * n[1]))
+# price per minute x median delay x number of late checkouts, as the API's /delay/cost
+costs = delay_costs(delays, pricing["price_mean"])
+st.markdown('Cost of delays for mobile checkin: {:.2f} $'.format(costs['mobile']))
+st.markdown('Cost of delays for connect checkin: {:.2f} $'.format(costs['connect']))
+st.markdown('Total cost of delays: {:.2f} $'.format(costs['total']))
 st.markdown('We are seeing that the majority of revenue loss comes from the Mobile App delays, suggesting that a good strategy would be to implement first the threshold for the Mobile App and then for the Connect App.')
 st.markdown("---")
 
@@ -188,122 +439,30 @@ st.markdown("---")
 
 st.markdown('# How long should the minimum delay be ?')
 
-df_threshold = data.dropna(subset=['time_delta_with_previous_rental_in_minutes'])
-df_threshold['delta'] = df_threshold['time_delta_with_previous_rental_in_minutes'] - df_threshold['delay_at_checkout_in_minutes']
-
-
-threshold_range = np.arange(0, 60*12, step=15) # 15min intervals for 12 hours
-impacted_list_mobile = []
-impacted_list_connect = []
-impacted_list_total = []
-solved_list_mobile = []
-solved_list_connect = []
-solved_list_total = []
-
-solved_list = []
-for t in threshold_range:
-    impacted = df_threshold.dropna(subset=['time_delta_with_previous_rental_in_minutes'])
-    connect_impact = impacted[impacted['checkin_type'] == 'connect']
-    mobile_impact = impacted[impacted['checkin_type'] == 'mobile']
-    connect_impact = connect_impact[connect_impact['time_delta_with_previous_rental_in_minutes'] < t]
-    mobile_impact = mobile_impact[mobile_impact['time_delta_with_previous_rental_in_minutes'] < t]
-    impacted = impacted[impacted['time_delta_with_previous_rental_in_minutes'] < t]
-    impacted_list_connect.append(len(connect_impact))
-    impacted_list_mobile.append(len(mobile_impact))
-    impacted_list_total.append(len(impacted))
-
-    solved = df_threshold[df_threshold['delta'] < 0]
-    connect_solved = solved[solved['checkin_type'] == 'connect']
-    mobile_solved = solved[solved['checkin_type'] == 'mobile']
-    connect_solved = connect_solved[connect_solved['delay_at_checkout_in_minutes'] < t]
-    mobile_solved = mobile_solved[mobile_solved['delay_at_checkout_in_minutes'] < t]
-    solved = solved[solved['delay_at_checkout_in_minutes'] < t]
-    solved_list_connect.append(len(connect_solved))
-    solved_list_mobile.append(len(mobile_solved))
-    solved_list_total.append(len(solved))
-
-occurences = len(df_threshold[df_threshold['delta'] < 0])
-occ_percent = occurences / len(data) * 100
-
-st.markdown('Number of occurences: {}'.format(occurences))
-st.markdown('Percentage of occurences: {:.2f} %'.format(occ_percent))
-
-st.markdown(f"{len(df_threshold[df_threshold['delta'] < -30])} drivers are more than 30 minutes late")
-st.markdown(f"Implementing a 30 minutes delay would impact {len(df_threshold[df_threshold['time_delta_with_previous_rental_in_minutes'] < 30])} drivers")
+thresholds = threshold_summary(delay_version)
+
+st.markdown('Number of occurences: {}'.format(thresholds["occurences"]))
+st.markdown('Percentage of occurences: {:.2f} %'.format(thresholds["occ_percent"]))
+
+st.markdown(f"{thresholds['late_30']} drivers are more than 30 minutes late")
+st.markdown(f"Implementing a 30 minutes delay would impact {thresholds['impacted_30']} drivers")
 
 st.markdown('The following graph shows the number of impacted drivers for each threshold, and indicates that an optimal threshold would be around 165 minutes (2h45)')
 
-ax = fig.add_subplot(1, 1, 1)
-fig, ax = plt.subplots(1, 2, sharex=True, figsize=(20,7))
-ax[1].plot(threshold_range, solved_list_connect)
-ax[1].plot(threshold_range, solved_list_mobile)
-ax[1].plot(threshold_range, solved_list_total)
-ax[0].plot(threshold_range, impacted_list_connect)
-ax[0].plot(threshold_range, impacted_list_mobile)
-ax[0].plot(threshold_range, impacted_list_total)
-ax[0].set_xlabel('Threshold (min)')
-ax[0].set_ylabel('Number of impacted cases')
-ax[1].set_xlabel('Threshold (min)')
-ax[1].set_ylabel('Number of cases solved')
-ax[1].legend(['Connect solved','Mobile solved','Total solved'], loc='upper left')
-ax[0].legend(['Connect impacted','Mobile impacted','Total impacted'], loc='upper left')
-#add horizontal line and vertical line crossing at point of origin x = 165
-ax[1].axvline(x=165, color='b', linestyle='--')
-#find index of threshold that is closest to 165
-idx = (np.abs(threshold_range - 165)).argmin()
-ax[1].axhline(y=solved_list_total[idx], color='b', linestyle='--')
-#add text to show the number of cases solved at that threshold
-ax[0].text(205, 750, f"{impacted_list_total[idx]} cases impacted at a 165 min Threshold", fontsize=12)
-ax[1].text(225, 175, f"{solved_list_total[idx]} cases solved at a 165 min Threshold", fontsize=12)
-
-ax[0].axvline(x=165, color='b', linestyle='--')
-ax[0].axhline(y=impacted_list_total[idx], color='b', linestyle='--')
-
-ax[1].axvline(x=120, color='r', linestyle='--')
-ax[1].axvline(x=180, color='r', linestyle='--')
-ax[0].axvline(x=120, color='r', linestyle='--')
-ax[0].axvline(x=180, color='r', linestyle='--')
-st.pyplot(fig)
+st.image(threshold_figure(delay_version))
 
 st.markdown('We can see that the curve of cases solved start to slow significantly after 165 minutes and even more around 180 (which is actually a plateau for Connect cases). Therefore our recommendation would be to implement the threshold at 165 minutes and no more than 180.')
 
-data = data.dropna(subset=["time_delta_with_previous_rental_in_minutes", "delay_at_checkout_in_minutes"])
-data_test = pd.melt(data, id_vars=['car_id', 'rental_id', 'state', 'checkin_type'], value_vars=['time_delta_with_previous_rental_in_minutes', 'delay_at_checkout_in_minutes'])
-
-
-
-fig6 = px.ecdf(
-    data_test[data_test['checkin_type']=='mobile'],
-    x='value',
-    color='variable',
-    ecdfnorm= 'percent',
-    range_x=(0, 720),
-    color_discrete_sequence=[ "#BE6E46", "#7286A0"],
-    labels={"value":'threshold (minutes)', "percent":'proportion of users (%)'}
-    )
-fig6.add_vline(x=165, line_dash="dash", line_color="red", line_width=2, annotation_text="Threshold 165 min")
-
-fig7 = px.ecdf(
-    data_test[data_test['checkin_type']=='connect'],
-    x='value',
-    color='variable',
-    ecdfnorm= 'percent',
-    range_x=(0, 720),
-    color_discrete_sequence=[ "#BE6E46", "#7286A0"],
-    labels={"value":'threshold (minutes)', "percent":'proportion of users (%)'}
-    )
-fig7.add_vline(x=165, line_dash="dash", line_color="red", line_width=2, annotation_text="Threshold 165 min")
-
-st.metric(label="Total number of Cars", value=data_test['car_id'].nunique())
+st.metric(label="Total number of Cars", value=car_count(delay_version))
 col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("Mobile")
-    st.plotly_chart(fig6, use_container_width=True)
+    st.plotly_chart(ecdf_figure(delay_version, 'mobile'), use_container_width=True)
 
 with col2:
    st.subheader("Connect")
-   st.plotly_chart(fig7, use_container_width=True)
+   st.plotly_chart(ecdf_figure(delay_version, 'connect'), use_container_width=True)
 
 
 st.markdown("These plots are Cumulative Distribution Function (ECDF), it allow us to show the percentage of users impacted by the introduction of a threshold for minimum time delay")
@@ -0,0 +1,182 @@
+"""Typed columnar copies of the datasets, and loaders that prefer them to the CSV files.
+
+    python storage.py df_pricing.csv df_delay.csv                # writes df_pricing.parquet and df_delay.parquet
+    python storage.py --format arrow df_delay.csv                # writes df_delay.arrow (uncompressed, memory-mappable)
+    python storage.py get_around_delay_analysis.xlsx             # the raw rentals sheet, parsed once by openpyxl
+
+Columns are stored with compact dtypes (category for text columns, bool, int32). `read_table("df_delay.csv")`
+reads df_delay.arrow or df_delay.parquet when one of them sits next to the CSV and is not older than it, and the
+CSV otherwise. Only the `columns` asked for are read, and Arrow/Parquet files are memory-mapped.
+
+Rows added after the dataset was written are stored as Parquet segments in a `<name>.segments` directory next to
+it, named so that they sort in the order they were written. A segment is written under a hidden name
+(`stage_segment`), read back and checked by the writer, then renamed into place (`commit_segment`). Readers apply
+the segments they have not seen yet on top of what they already loaded (`list_segments`, `read_segments`).
+
+This module is shared by the API and the dashboard (a copy lives in each directory, as each is deployed alone;
+tests/test_shared_files.py checks that the copies are identical).
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import pandas as pd
+
+# dtypes of the columns of both datasets, applied to the columns each file holds
+DTYPES = {
+    # pricing
+    "model_key": "category",
+    "fuel": "category",
+    "paint_color": "category",
+    "car_type": "category",
+    "private_parking_available": "bool",
+    "has_gps": "bool",
+    "has_air_conditioning": "bool",
+    "automatic_car": "bool",
+    "has_getaround_connect": "bool",
+    "has_speed_regulator": "bool",
+    "winter_tires": "bool",
+    "mileage": "int32",
+    "engine_power": "int32",
+    "rental_price_per_day": "int32",
+    # delays (delays and time deltas have missing values: they stay float64)
+    "rental_id": "int32",
+    "car_id": "int32",
+    "checkin_type": "category",
+    "state": "category",
+    "delay_category": "category",
+    "next_rental": "bool",
+}
+
+# columnar formats, in order of preference
+COLUMNAR_EXTENSIONS = (".arrow", ".parquet")
+SEGMENTS_SUFFIX = ".segments"
+
+
+def resolve(path):
+    """The file `read_table(path)` reads: an .arrow or .parquet file with the same name if there is one at least as
+    recent as `path`, else `path` (a copy older than the CSV is stale: the CSV was edited after it was written)."""
+    stem, extension = os.path.splitext(path)
+    if extension in COLUMNAR_EXTENSIONS:
+        return path
+    try:
+        source_mtime = os.path.getmtime(path)
+    except OSError:
+        source_mtime = None
+    for columnar in COLUMNAR_EXTENSIONS:
+        try:
+            if source_mtime is None or os.path.getmtime(stem + columnar) >= source_mtime:
+                return stem + columnar
+        except OSError:
+            continue
+    return path
+
+
+def read_table(path, columns=None, memory_map=True):
+    """Read a dataset with its dtypes, from its columnar copy when there is one. `columns`: the columns to read."""
+    path = resolve(path)
+    extension = os.path.splitext(path)[1]
+    if extension == ".arrow":
+        from pyarrow import feather
+        return feather.read_table(path, columns=columns, memory_map=memory_map).to_pandas()
+    if extension == ".parquet":
+        return pd.read_parquet(path, columns=columns, memory_map=memory_map)
+    return read_source(path, columns)
+
+
+def read_source(path, columns=None):
+    """Read a .csv or .xlsx dataset with its dtypes, ignoring any columnar copy."""
+    if os.path.splitext(path)[1] in (".xlsx", ".xls"):
+        # the raw delay analysis workbook: rentals are on the first sheet
+        frame = pd.read_excel(path, sheet_name=0, usecols=columns)
+        return frame.astype({c: t for c, t in DTYPES.items() if c in frame.columns})
+    header = pd.read_csv(path, nrows=0).columns
+    return pd.read_csv(path, usecols=columns, dtype={c: t for c, t in DTYPES.items() if c in header})
+
+
+def segments_dir(path):
+    """The directory holding the rows appended to the dataset at `path` (whatever its format)."""
+    return os.path.splitext(path)[0] + SEGMENTS_SUFFIX
+
+
+def list_segments(path):
+    """Names of the segments of the dataset at `path`, in the order they were written."""
+    try:
+        names = os.listdir(segments_dir(path))
+    except FileNotFoundError:
+        return []
+    # segments are written under a hidden name, then renamed: only complete ones end with .parquet
+    return sorted(name for name in names if name.endswith(".parquet") and not name.startswith("."))
+
+
+def stage_segment(path, frame):
+    """Write the rows of `frame` as a new segment of the dataset at `path`, under a hidden name that readers ignore.
+    Return its name once committed; `read_segments(path, ["." + name])` reads it before that."""
+    directory = segments_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet"
+    try:
+        frame.astype({c: t for c, t in DTYPES.items() if c in frame.columns}).to_parquet(os.path.join(directory, "." + name), index=False)
+    except Exception:
+        discard_segment(path, name)
+        raise
+    return name
+
+
+def commit_segment(path, name):
+    """Add the staged segment `name` to the dataset at `path`: readers see it from now on."""
+    directory = segments_dir(path)
+    os.replace(os.path.join(directory, "." + name), os.path.join(directory, name))
+
+
+def discard_segment(path, name):
+    """Delete the staged segment `name`, if it was written."""
+    try:
+        os.remove(os.path.join(segments_dir(path), "." + name))
+    except FileNotFoundError:
+        pass
+
+
+def read_segments(path, names, columns=None):
+    """The rows of the segments `names` of the dataset at `path`, in one frame."""
+    directory = segments_dir(path)
+    return concat([pd.read_parquet(os.path.join(directory, name), columns=columns) for name in names])
+
+
+def concat(frames):
+    """Concatenate frames keeping categorical columns categorical (their categories are merged)."""
+    frames = [frame for frame in frames if frame is not None]
+    for column in frames[0].columns if frames else []:
+        if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = pd.api.types.union_categoricals([frame[column] for frame in frames]).categories
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def convert(source, format="parquet"):
+    """Write the columnar copy of `source` (a .csv or .xlsx file) next to it, return its path."""
+    frame = read_source(source)
+    destination = os.path.splitext(source)[0] + "." + format
+    if format == "arrow":
+        # uncompressed, so that reads are zero-copy memory maps
+        frame.to_feather(destination, compression="uncompressed")
+    else:
+        frame.to_parquet(destination, index=False, compression="zstd")
+    return destination
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert datasets to typed Parquet or Arrow files")
+    parser.add_argument("files", nargs="+", help=".csv or .xlsx files to convert")
+    parser.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    args = parser.parse_args(argv)
+    for source in args.files:
+        destination = convert(source, args.format)
+        print(f"{source} -> {destination} ({os.path.getsize(destination)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import os
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API")
+# the API modules import each other by name, as when the API is run from its directory
+sys.path.insert(0, API_DIR)
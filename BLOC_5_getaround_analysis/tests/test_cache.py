@@ -0,0 +1,135 @@
+"""Result cache of the aggregation endpoints: LRU and TTL eviction, invalidation when the dataset changes, ETag/304."""
+import importlib
+import os
+import shutil
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import cache
+from cache import ResultCache, etag_matches
+from dataset import DatasetStore
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API")
+
+CAR = {
+    "model_key": "Citroën", "mileage": 140411, "engine_power": 100, "fuel": "diesel", "paint_color": "black",
+    "car_type": "convertible", "private_parking_available": True, "has_gps": True, "has_air_conditioning": False,
+    "automatic_car": False, "has_getaround_connect": True, "has_speed_regulator": True, "winter_tires": True,
+    "rental_price_per_day": 106,
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_least_recently_used_entry_is_evicted():
+    results = ResultCache(max_entries=2)
+    results.put("a", b"1")
+    results.put("b", b"2")
+    assert results.get("a").body == b"1"
+    results.put("c", b"3")
+    assert results.get("b") is None
+    assert results.get("a").body == b"1" and results.get("c").body == b"3"
+    assert results.evictions == 1
+
+
+def test_entries_expire_after_the_ttl(clock):
+    results = ResultCache(ttl=10)
+    results.put("a", b"1")
+    clock.now += 9.9
+    assert results.get("a") is not None
+    clock.now += 0.2
+    assert results.get("a") is None
+    assert results.expirations == 1 and results.info()["entries"] == 0
+
+
+def test_results_are_computed_once_per_key():
+    results = ResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"mean": 1.5}
+
+    first = results.get_or_compute("k", compute)
+    second = results.get_or_compute("k", compute)
+    assert first is second and len(calls) == 1
+    assert first.body == b'{"mean":1.5}'
+    assert (results.hits, results.misses) == (1, 1)
+
+
+def test_etag_is_the_hash_of_the_body():
+    results = ResultCache()
+    assert results.put("a", b"1").etag == results.put("b", b"1").etag != results.put("c", b"2").etag
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False), ("", False), ('"abc"', True), ('W/"abc"', True), ('"x", "abc"', True), ("*", True), ('"abd"', False),
+])
+def test_if_none_match(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+def test_appended_rows_clear_the_cache(tmp_path):
+    shutil.copy(os.path.join(API_DIR, "df_pricing.csv"), tmp_path / "df_pricing.csv")
+    results = ResultCache()
+    store = DatasetStore(str(tmp_path / "df_pricing.csv"), reload_interval=0)
+    store.listeners.append(results.clear)
+    store.get()
+    results.put("groupby", b"{}")
+    store.append(pd.DataFrame([CAR]).astype({"model_key": "category"}))
+    assert results.get("groupby") is None
+    assert results.invalidations == 1
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("data")
+    for name in ("df_pricing.csv", "df_delay.csv"):
+        shutil.copy(os.path.join(API_DIR, name), directory / name)
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in {
+            "PRICING_MODEL_PATH": os.path.join(API_DIR, "gbr_model.joblib"),
+            "PRICING_DATA_PATH": str(directory / "df_pricing.csv"),
+            "DELAY_DATA_PATH": str(directory / "df_delay.csv"),
+            "DATASET_RELOAD_INTERVAL": "0",
+            "INGEST_POLL_INTERVAL": "0",
+            "JOBS_PROCESSES": "0",
+        }.items():
+            patch.setenv(name, value)
+        app = importlib.import_module("app")
+        with TestClient(app.app) as client:
+            yield client
+
+
+def test_etag_and_304(client):
+    first = client.get("/groupby", params={"column": "fuel", "parameter": "mean"})
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    again = client.get("/groupby", params={"column": "fuel", "parameter": "mean"}, headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["ETag"] == etag
+
+
+def test_ingested_rows_change_the_result(client):
+    params = {"column": "fuel", "parameter": "count"}
+    before = client.get("/groupby", params=params)
+    assert client.post("/ingest/pricing", json=[CAR]).status_code == 200
+    after = client.get("/groupby", params=params, headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert after.json()["mileage"]["diesel"] == before.json()["mileage"]["diesel"] + 1
@@ -0,0 +1,81 @@
+"""The threshold engine must count the same impacted and solved rentals as the per-threshold loop of the
+original dashboard, before and after rentals are appended."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from delay_analysis import CHECKIN_TYPES, DELAY_COLUMN, DELTA_COLUMN, ThresholdEngine
+from storage import read_table
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API")
+
+THRESHOLDS = [
+    np.arange(0, 60 * 12, step=15),
+    # between and on the recorded values, below and beyond all of them
+    np.array([-30, 0, 0.5, 29.999, 30, 30.001, 90.5, 719, 10_000]),
+]
+
+
+@pytest.fixture(scope="module")
+def data():
+    return read_table(os.path.join(API_DIR, "df_delay.csv"))
+
+
+def loop_sweep(data, thresholds):
+    """The sweep as the dashboard computed it before the engine: the rentals filtered again for each threshold."""
+    df_threshold = data.dropna(subset=[DELTA_COLUMN]).copy()
+    df_threshold["delta"] = df_threshold[DELTA_COLUMN] - df_threshold[DELAY_COLUMN]
+    conflicts = df_threshold[df_threshold["delta"] < 0]
+    rows = []
+    for t in thresholds:
+        row = {"threshold": t}
+        for checkin_type in CHECKIN_TYPES:
+            impacted = df_threshold[df_threshold["checkin_type"] == checkin_type]
+            solved = conflicts[conflicts["checkin_type"] == checkin_type]
+            row[f"impacted_{checkin_type}"] = len(impacted[impacted[DELTA_COLUMN] < t])
+            row[f"solved_{checkin_type}"] = len(solved[solved[DELAY_COLUMN] < t])
+        row["impacted_total"] = len(df_threshold[df_threshold[DELTA_COLUMN] < t])
+        row["solved_total"] = len(conflicts[conflicts[DELAY_COLUMN] < t])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def assert_same_sweep(engine, data, thresholds):
+    expected = loop_sweep(data, thresholds)
+    sweep = engine.sweep(thresholds)
+    for column in expected.columns.drop("threshold"):
+        np.testing.assert_array_equal(sweep[column].to_numpy(), expected[column].to_numpy(), err_msg=column)
+
+
+@pytest.mark.parametrize("thresholds", THRESHOLDS, ids=["dashboard", "edges"])
+def test_sweep_matches_the_loop(data, thresholds):
+    assert_same_sweep(ThresholdEngine.from_frame(data), data, thresholds)
+
+
+def test_counts(data):
+    engine = ThresholdEngine.from_frame(data)
+    following = data.dropna(subset=[DELTA_COLUMN])
+    assert engine.rentals == len(data)
+    assert engine.following() == len(following)
+    assert engine.conflict_count() == int((following[DELTA_COLUMN] < following[DELAY_COLUMN]).sum())
+    assert engine.following("connect") + engine.following("mobile") == engine.following()
+    assert engine.impacted([60], "unknown").tolist() == [0]
+
+
+@pytest.mark.parametrize("split", [0.5, 0.9, 0.999])
+def test_appended_rentals_match_a_full_rebuild(data, split):
+    # shuffled, so that the appended values land between the previous ones
+    shuffled = data.sample(frac=1, random_state=0)
+    head = int(len(shuffled) * split)
+    engine = ThresholdEngine.from_frame(shuffled.iloc[:head]).append(shuffled.iloc[head:])
+    assert engine.rentals == len(data)
+    assert_same_sweep(engine, data, THRESHOLDS[0])
+
+
+def test_append_of_a_new_checkin_type(data):
+    mobile = data[data["checkin_type"] == "mobile"]
+    engine = ThresholdEngine.from_frame(mobile).append(data[data["checkin_type"] == "connect"])
+    assert sorted(engine.checkin_types) == sorted(CHECKIN_TYPES)
+    assert_same_sweep(engine, data, THRESHOLDS[0])
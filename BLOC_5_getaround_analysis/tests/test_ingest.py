@@ -0,0 +1,157 @@
+"""Rows posted to /ingest or dropped in INGEST_DIR are checked as a whole before anything is written."""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from joblib import load
+
+from dataset import DatasetStore, DelayDataset, PricingDataset
+from delay_analysis import DELAY_COLUMN, RELATIVE_ACCURACY
+from ingest import ingest, prepare
+from storage import list_segments, read_segments
+from validation import Vocabulary
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API")
+
+RENTAL = {
+    "rental_id": 600000, "car_id": 12345, "checkin_type": "mobile", "state": "ended",
+    DELAY_COLUMN: 35, "previous_ended_rental_id": None, "time_delta_with_previous_rental_in_minutes": None,
+}
+CAR = {
+    "model_key": "Citroën", "mileage": 140411, "engine_power": 100, "fuel": "diesel", "paint_color": "black",
+    "car_type": "convertible", "private_parking_available": True, "has_gps": True, "has_air_conditioning": False,
+    "automatic_car": False, "has_getaround_connect": True, "has_speed_regulator": True, "winter_tires": True,
+    "rental_price_per_day": 106,
+}
+
+
+@pytest.fixture(scope="module")
+def vocabulary():
+    return Vocabulary.from_model(load(os.path.join(API_DIR, "gbr_model.joblib")))
+
+
+@pytest.fixture
+def delays(tmp_path):
+    shutil.copy(os.path.join(API_DIR, "df_delay.csv"), tmp_path / "df_delay.csv")
+    return DatasetStore(str(tmp_path / "df_delay.csv"), reload_interval=0, loader=DelayDataset.load)
+
+
+@pytest.fixture
+def pricing(tmp_path):
+    shutil.copy(os.path.join(API_DIR, "df_pricing.csv"), tmp_path / "df_pricing.csv")
+    return DatasetStore(str(tmp_path / "df_pricing.csv"), reload_interval=0, loader=PricingDataset.load)
+
+
+def test_valid_rows_are_prepared(vocabulary):
+    frame = prepare("delay", pd.DataFrame([RENTAL, {**RENTAL, DELAY_COLUMN: -10, "previous_ended_rental_id": 5}]))
+    assert frame["delay_category"].tolist() == ["Late: 30-60 mins", "Early"]
+    assert frame["next_rental"].tolist() == [False, True]
+    assert len(prepare("pricing", pd.DataFrame([CAR]), vocabulary)) == 1
+
+
+@pytest.mark.parametrize("column", ["rental_id", "car_id", "previous_ended_rental_id"])
+def test_ids_beyond_int32_are_rejected(column):
+    with pytest.raises(ValueError, match=f"{column}: must be at most 2147483647"):
+        prepare("delay", pd.DataFrame([RENTAL, {**RENTAL, column: 1e12}]))
+
+
+@pytest.mark.parametrize("column", ["mileage", "engine_power", "rental_price_per_day"])
+def test_pricing_numbers_beyond_int32_are_rejected(vocabulary, column):
+    with pytest.raises(ValueError, match=rf"{column}: must be at most 2147483647 \(rows \[0\]\)"):
+        prepare("pricing", pd.DataFrame([{**CAR, column: 2**31}]), vocabulary)
+
+
+@pytest.mark.parametrize("column, value", [("model_key", "Tesla"), ("fuel", "kerosene"), ("car_type", "bus")])
+def test_pricing_categories_must_be_known_to_the_model(vocabulary, column, value):
+    with pytest.raises(ValueError, match=f"{column}: must be one of"):
+        prepare("pricing", pd.DataFrame([CAR, {**CAR, column: value}]), vocabulary)
+
+
+def test_invalid_rows_write_nothing(delays):
+    before = delays.get()
+    with pytest.raises(ValueError):
+        ingest(delays, "delay", pd.DataFrame([RENTAL, {**RENTAL, "rental_id": 1e12}]))
+    assert list_segments(before.path) == []
+    assert len(delays.get().frame) == len(before.frame)
+
+
+def test_ingested_rows_keep_their_values(delays):
+    assert ingest(delays, "delay", pd.DataFrame([{**RENTAL, "rental_id": 2**31 - 1}]))["rows"] == 1
+    path = delays.get().path
+    assert read_segments(path, list_segments(path))["rental_id"].tolist() == [2**31 - 1]
+
+
+def test_unknown_model_key_is_not_appended(pricing, vocabulary):
+    rows = len(pricing.get().frame)
+    with pytest.raises(ValueError, match="model_key"):
+        ingest(pricing, "pricing", pd.DataFrame([{**CAR, "model_key": "Tesla"}]), vocabulary)
+    assert len(pricing.get().frame) == rows
+    assert ingest(pricing, "pricing", pd.DataFrame([CAR]), vocabulary)["total_rows"] == rows + 1
+
+
+@pytest.mark.parametrize("row, message", [
+    ({"checkin_type": "bike"}, "checkin_type: must be one of"),
+    ({"state": "lost"}, "state: must be one of"),
+    ({"rental_id": 1.5}, "rental_id: must be an integer"),
+    ({"rental_id": True}, "rental_id: must be an integer"),
+    ({"car_id": -3}, "car_id: must be positive"),
+    ({DELAY_COLUMN: "late"}, f"{DELAY_COLUMN}: must be a number"),
+    ({"car_id": None}, "car_id: must be an integer"),
+])
+def test_invalid_rentals_are_rejected(row, message):
+    with pytest.raises(ValueError, match=message):
+        prepare("delay", pd.DataFrame([RENTAL, {**RENTAL, **row}]))
+
+
+@pytest.mark.parametrize("row, message", [
+    ({"has_gps": 1}, "has_gps: must be a boolean"),
+    ({"has_gps": "yes"}, "has_gps: must be a boolean"),
+    ({"mileage": -1}, "mileage: must be positive"),
+    ({"mileage": "far"}, "mileage: must be an integer"),
+])
+def test_invalid_cars_are_rejected(vocabulary, row, message):
+    with pytest.raises(ValueError, match=message):
+        prepare("pricing", pd.DataFrame([CAR, {**CAR, **row}]), vocabulary)
+
+
+def test_missing_columns_are_listed():
+    with pytest.raises(ValueError, match="car_id: field required; checkin_type: field required"):
+        prepare("delay", pd.DataFrame([{"rental_id": 1}]))
+
+
+def test_early_returns_and_missing_delays_are_accepted():
+    frame = prepare("delay", pd.DataFrame([{**RENTAL, DELAY_COLUMN: -45.0}, {**RENTAL, DELAY_COLUMN: None}]))
+    assert frame[DELAY_COLUMN].iloc[0] == -45
+    assert pd.isna(frame[DELAY_COLUMN].iloc[1])
+
+
+def test_late_checkout_summaries_after_ingest(delays):
+    # the summaries of the loaded file updated with the ingested rentals only: counts are exact, quantiles within
+    # the accuracy of the sketch
+    before = delays.get()
+    rng = np.random.default_rng(0)
+    new = pd.DataFrame([
+        {**RENTAL, "rental_id": 700000 + i, "checkin_type": checkin_type, DELAY_COLUMN: float(delay)}
+        for i, (checkin_type, delay) in enumerate(zip(rng.choice(["mobile", "connect"], 2000), rng.exponential(90, 2000).round()))
+    ])
+    ingest(delays, "delay", new)
+    dataset = delays.get()
+    assert len(dataset.frame) == len(before.frame) + len(new)
+    frame = dataset.frame
+    for key in ["all", "mobile", "connect"]:
+        late = frame[frame[DELAY_COLUMN] >= 0]
+        if key != "all":
+            late = late[late["checkin_type"] == key]
+        values = np.sort(late[DELAY_COLUMN].to_numpy())
+        summary = dataset.late_checkouts[key]
+        assert summary.count == len(values)
+        assert summary.mean == pytest.approx(values.mean())
+        assert summary.std == pytest.approx(values.std(ddof=1))
+        assert summary.histogram_counts.sum() == len(values)
+        np.testing.assert_array_equal(summary.ecdf_counts, np.searchsorted(values, summary.ecdf_x, side="right"))
+        for q, estimate in summary.quantiles.items():
+            # the sketch returns the value of rank q * (n - 1), within its relative accuracy
+            exact = np.quantile(values, q, method="lower")
+            assert abs(estimate - exact) <= RELATIVE_ACCURACY * abs(exact) + 1e-9, (key, q)
@@ -0,0 +1,109 @@
+"""Concurrent predictions grouped by the MicroBatcher: each caller gets the prediction of its own record."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from microbatch import MicroBatcher
+
+
+def double(records):
+    return [record["x"] * 2 for record in records]
+
+
+async def started(predict_fn, **kwargs):
+    batcher = MicroBatcher(predict_fn, **kwargs)
+    await batcher.start()
+    return batcher
+
+
+def test_concurrent_requests_share_batches():
+    async def scenario():
+        batcher = await started(double, max_batch_size=16, max_wait=0.05)
+        results = await asyncio.gather(*(batcher.submit({"x": i}) for i in range(40)))
+        await batcher.stop()
+        return results, batcher.stats
+    results, stats = asyncio.run(scenario())
+    assert results == [2 * i for i in range(40)]
+    assert stats.requests == 40
+    assert sum(size * n for size, n in stats.batch_sizes.items()) == 40
+    assert stats.max_batch_size == 16
+    assert stats.batches < 40
+
+
+def test_each_caller_gets_its_own_prediction():
+    # several worker threads, batches finishing out of order: the results still go to the right callers
+    def slow_double(records):
+        time.sleep(0.001 * (records[0]["x"] % 7))
+        return double(records)
+
+    async def one(batcher, i):
+        await asyncio.sleep(0.0005 * (i % 5))
+        return i, await batcher.submit({"x": i})
+
+    async def scenario():
+        batcher = await started(slow_double, max_batch_size=4, max_wait=0.002, workers=3)
+        results = await asyncio.gather(*(one(batcher, i) for i in range(60)))
+        await batcher.stop()
+        return results
+    assert all(result == 2 * i for i, result in asyncio.run(scenario()))
+
+
+def test_records_of_a_batch_are_predicted_in_submission_order():
+    seen = []
+
+    def record_order(records):
+        seen.append([record["x"] for record in records])
+        return double(records)
+
+    async def scenario():
+        batcher = await started(record_order, max_batch_size=100, max_wait=0.05)
+        await asyncio.gather(*(batcher.submit({"x": i}) for i in range(10)))
+        await batcher.stop()
+    asyncio.run(scenario())
+    assert [x for batch in seen for x in batch] == list(range(10))
+
+
+def test_a_bad_record_only_fails_its_caller():
+    def strict(records):
+        if any(record["x"] < 0 for record in records):
+            raise ValueError("negative")
+        return double(records)
+
+    async def scenario():
+        batcher = await started(strict, max_batch_size=8, max_wait=0.05)
+        results = await asyncio.gather(*(batcher.submit({"x": x}) for x in [1, -1, 3]), return_exceptions=True)
+        await batcher.stop()
+        return results, batcher.stats
+    results, stats = asyncio.run(scenario())
+    assert results[0] == 2 and results[2] == 6
+    assert isinstance(results[1], ValueError)
+    assert stats.failed_batches == 1
+
+
+def test_stop_fails_the_queued_requests():
+    release = threading.Event()
+
+    def blocked(records):
+        release.wait(5)
+        return double(records)
+
+    async def scenario():
+        batcher = await started(blocked, max_batch_size=1, max_wait=0, workers=1)
+        tasks = [asyncio.create_task(batcher.submit({"x": i})) for i in range(4)]
+        await asyncio.sleep(0.05)
+        # the first record is being predicted, the others wait for the worker
+        stopping = asyncio.create_task(batcher.stop())
+        await asyncio.sleep(0.05)
+        release.set()
+        await stopping
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    results = asyncio.run(scenario())
+    assert results[0] == 0
+    assert all(isinstance(result, RuntimeError) for result in results[1:])
+
+
+def test_submit_needs_a_started_batcher():
+    with pytest.raises(RuntimeError, match="not started"):
+        asyncio.run(MicroBatcher(double).submit({"x": 1}))
@@ -0,0 +1,100 @@
+"""The compiled predictors (fastpath.FastPredictor and trees.TreePredictor) must price every car as the sklearn
+pipeline does, and reject the cars it rejects."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from joblib import load
+
+from batching import FEATURE_COLUMNS
+from dataset import read_pricing
+from fastpath import FastPredictor, check_parity, synthetic_frame
+from trees import TreePredictor, check
+from validation import BOOLEAN_FEATURES, CATEGORICAL_FEATURES, Vocabulary
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API")
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return load(os.path.join(API_DIR, "gbr_model.joblib"))
+
+
+@pytest.fixture(scope="module")
+def vocabulary(pipeline):
+    return Vocabulary.from_model(pipeline)
+
+
+@pytest.fixture(scope="module")
+def dataset(pipeline, vocabulary):
+    data = read_pricing(os.path.join(API_DIR, "df_pricing.csv"))
+    data = data.astype({column: object for column in CATEGORICAL_FEATURES})
+    # the dataset holds a few model keys the model was not fitted on
+    return data[data["model_key"].isin(vocabulary.values["model_key"])][FEATURE_COLUMNS].reset_index(drop=True)
+
+
+def edge_cars(vocabulary):
+    """Cars at the limits: zero and extreme mileage / engine power, every flag off and on, first and last
+    category of each categorical feature."""
+    cars = []
+    for mileage, engine_power in [(0, 0), (0, 450), (1, 1), (1_000_000, 0), (10_000_000, 1000), (2.5, 99.5)]:
+        for flags in (False, True):
+            for pick in (min, max):
+                car = {column: pick(vocabulary.values[column]) for column in CATEGORICAL_FEATURES}
+                car.update({column: flags for column in BOOLEAN_FEATURES})
+                car.update(mileage=mileage, engine_power=engine_power)
+                cars.append(car)
+    return pd.DataFrame(cars)[FEATURE_COLUMNS]
+
+
+def test_dataset_parity(pipeline, dataset):
+    assert check_parity(pipeline, dataset) == []
+
+
+def test_synthetic_parity(pipeline):
+    assert check_parity(pipeline, synthetic_frame(pipeline)) == []
+
+
+def test_edge_cars_parity(pipeline, vocabulary):
+    assert check_parity(pipeline, edge_cars(vocabulary)) == []
+
+
+def test_single_car_parity(pipeline, dataset):
+    # a batch of one, as most /predict calls are
+    assert check_parity(pipeline, dataset.iloc[:1]) == []
+
+
+@pytest.mark.parametrize("column", CATEGORICAL_FEATURES)
+def test_unseen_category_is_rejected(pipeline, dataset, column):
+    car = dataset.iloc[:1].copy()
+    car[column] = "unknown value"
+    with pytest.raises(ValueError):
+        pipeline.predict(car)
+    predictor = FastPredictor(pipeline)
+    with pytest.raises(ValueError, match="unknown categories"):
+        predictor.predict_frame(car)
+    with pytest.raises(ValueError, match="unknown categories"):
+        predictor.predict_records(car.to_dict("records"))
+    with pytest.raises(ValueError, match="unknown categories"):
+        TreePredictor(pipeline).predict_frame(car)
+
+
+@pytest.mark.parametrize("frame", ["dataset", "synthetic", "edge"])
+def test_flat_trees_parity(pipeline, vocabulary, dataset, frame):
+    frames = {"dataset": dataset, "synthetic": synthetic_frame(pipeline), "edge": edge_cars(vocabulary)}
+    assert check(pipeline, frames[frame]) < 1e-2
+
+
+def test_empty_frame(pipeline, dataset):
+    assert len(FastPredictor(pipeline).predict_frame(dataset.iloc[:0])) == 0
+    assert len(TreePredictor(pipeline).predict_frame(dataset.iloc[:0])) == 0
+
+
+def test_reused_buffer_parity(pipeline, dataset):
+    # records of successive calls are encoded into the same array: nothing of a larger batch may leak into the next
+    predictor = FastPredictor(pipeline)
+    for start, stop in [(0, 50), (50, 53), (100, 101), (200, 300), (300, 302)]:
+        batch = dataset.iloc[start:stop]
+        np.testing.assert_allclose(predictor.predict_records(batch.to_dict("records")), pipeline.predict(batch), rtol=1e-5, atol=1e-3)
+    assert len(predictor._buffers.array) == 128
@@ -0,0 +1,88 @@
+"""Pagination, field projection and formats of the row endpoints (/preview, /filter-by)."""
+import asyncio
+import io
+import json
+
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+
+from responses import rows_response
+
+FRAME = pd.DataFrame({"model_key": [f"car {i}" for i in range(25)], "mileage": range(0, 2500, 100), "has_gps": [i % 2 == 0 for i in range(25)]})
+
+
+def respond(offset=0, limit=None, fields=None, format="records", max_page_size=10, chunk_size=4):
+    return rows_response(FRAME, offset, limit, fields, format, max_page_size, chunk_size)
+
+
+def streamed(response):
+    async def collect():
+        return "".join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(collect())
+
+
+def test_records_cursor_walks_every_row_once():
+    rows, offset, pages = [], 0, 0
+    while offset is not None:
+        page = json.loads(respond(offset=offset, limit=7).body)
+        assert page["total"] == 25
+        rows += page["rows"]
+        offset = page["next_offset"]
+        pages += 1
+    assert pages == 4
+    assert [row["mileage"] for row in rows] == list(range(0, 2500, 100))
+
+
+def test_next_offset_headers():
+    response = respond(offset=5, limit=10)
+    assert response.headers["X-Total-Count"] == "25"
+    assert response.headers["X-Next-Offset"] == "15"
+    assert "X-Next-Offset" not in respond(offset=15, limit=10).headers
+
+
+def test_records_default_to_one_page():
+    page = json.loads(respond().body)
+    assert len(page["rows"]) == 10 and page["next_offset"] == 10
+
+
+def test_dict_without_limit_returns_every_row():
+    # the historical format cannot tell the client there is more: nothing is cut
+    response = respond(format="dict")
+    assert len(json.loads(response.body)["mileage"]) == 25
+    assert "X-Next-Offset" not in response.headers
+    assert list(json.loads(respond(offset=20, format="dict").body)["mileage"]) == ["20", "21", "22", "23", "24"]
+
+
+def test_dict_page_keeps_row_labels():
+    body = json.loads(respond(offset=3, limit=2, format="dict").body)
+    assert body["mileage"] == {"3": 300, "4": 400}
+
+
+@pytest.mark.parametrize("format", ["dict", "records"])
+def test_pages_larger_than_the_maximum_are_rejected(format):
+    with pytest.raises(HTTPException) as error:
+        respond(limit=11, format=format)
+    assert error.value.status_code == 422
+
+
+@pytest.mark.parametrize("kwargs", [{"limit": 0}, {"limit": -1}, {"offset": -1}, {"format": "xml"}, {"fields": "mileage,price"}])
+def test_invalid_parameters_are_rejected(kwargs):
+    with pytest.raises(HTTPException) as error:
+        respond(**kwargs)
+    assert error.value.status_code == 422
+
+
+def test_fields_are_projected_in_the_requested_order():
+    page = json.loads(respond(limit=2, fields=" mileage , model_key").body)
+    assert page["rows"] == [{"mileage": 0, "model_key": "car 0"}, {"mileage": 100, "model_key": "car 1"}]
+
+
+def test_ndjson_streams_the_whole_selection_in_chunks():
+    lines = streamed(respond(offset=3, format="ndjson", fields="mileage")).splitlines()
+    assert [json.loads(line) for line in lines] == [{"mileage": m} for m in range(300, 2500, 100)]
+
+
+def test_csv_streams_a_header_then_the_rows():
+    text = streamed(respond(offset=20, limit=3, format="csv"))
+    assert pd.read_csv(io.StringIO(text)).equals(FRAME.iloc[20:23].reset_index(drop=True))
@@ -0,0 +1,88 @@
+"""What-if grid of /predict/sensitivity: the car and its variations, priced in one call as they would be one by one."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from joblib import load
+
+from batching import FEATURE_COLUMNS
+from fastpath import PipelinePredictor
+from sensitivity import build_grid, price_curves, sweep_values
+from validation import Vocabulary
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API")
+
+CAR = {
+    "model_key": "Citroën", "mileage": 140411, "engine_power": 100, "fuel": "diesel", "paint_color": "black",
+    "car_type": "convertible", "private_parking_available": True, "has_gps": True, "has_air_conditioning": False,
+    "automatic_car": False, "has_getaround_connect": True, "has_speed_regulator": True, "winter_tires": True,
+}
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return load(os.path.join(API_DIR, "gbr_model.joblib"))
+
+
+@pytest.fixture(scope="module")
+def vocabulary(pipeline):
+    return Vocabulary.from_model(pipeline)
+
+
+def test_grid_holds_the_car_then_each_variation():
+    sweeps = {"mileage": [0, 50000], "fuel": ["petrol"], "has_gps": [False, True]}
+    grid, offsets = build_grid(CAR, sweeps)
+    assert list(grid.columns) == FEATURE_COLUMNS
+    assert len(grid) == 6
+    assert offsets == {"mileage": 1, "fuel": 3, "has_gps": 4}
+    assert grid.iloc[0].to_dict() == {**CAR, "mileage": float(CAR["mileage"]), "engine_power": float(CAR["engine_power"])}
+    for feature, values in sweeps.items():
+        block = grid.iloc[offsets[feature]:offsets[feature] + len(values)]
+        assert block[feature].tolist() == values
+        # the other features are those of the car
+        others = block.drop(columns=feature)
+        assert (others == grid.iloc[0].drop(feature)).all().all()
+
+
+def test_curves_match_pricing_each_variation_alone(pipeline, vocabulary):
+    sweeps = {
+        "mileage": sweep_values("mileage", vocabulary, start=0, stop=300000, step=50000),
+        "fuel": sweep_values("fuel", vocabulary),
+        "has_gps": sweep_values("has_gps", vocabulary),
+    }
+    result = price_curves(PipelinePredictor(pipeline), CAR, sweeps)
+    price = pipeline.predict(pd.DataFrame([CAR])[FEATURE_COLUMNS])[0]
+    assert result["prediction"] == pytest.approx(price, rel=1e-6)
+    assert result["points"] == 1 + sum(len(values) for values in sweeps.values())
+    for feature, values in sweeps.items():
+        curve = result["curves"][feature]
+        expected = [pipeline.predict(pd.DataFrame([{**CAR, feature: value}])[FEATURE_COLUMNS])[0] for value in values]
+        np.testing.assert_allclose(curve["predictions"], expected, rtol=1e-6)
+        np.testing.assert_allclose(curve["differences"], np.asarray(expected) - price, rtol=1e-6, atol=1e-6)
+
+
+def test_default_sweeps(vocabulary):
+    assert sweep_values("has_gps", vocabulary) == [False, True]
+    assert sweep_values("fuel", vocabulary) == sorted(vocabulary.values["fuel"])
+    assert sweep_values("mileage", vocabulary, start=0, stop=1, step=0.25) == [0, 0.25, 0.5, 0.75]
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    ({"feature": "color"}, "feature must be one of"),
+    ({"feature": "mileage"}, "values or start, stop and step are needed"),
+    ({"feature": "fuel", "start": 0, "stop": 10, "step": 1}, "only apply to"),
+    ({"feature": "mileage", "values": [1000], "start": 0, "stop": 10, "step": 1}, "either values or start, stop and step"),
+    ({"feature": "mileage", "start": 0, "stop": 10}, "positive step"),
+    ({"feature": "mileage", "start": 0, "stop": 10, "step": -1}, "positive step"),
+    ({"feature": "mileage", "start": 10, "stop": 0, "step": 1}, "stop greater than start"),
+    ({"feature": "mileage", "start": 0, "stop": 1e12, "step": 1, "max_values": 100}, "at most 100"),
+    ({"feature": "mileage", "values": list(range(101)), "max_values": 100}, "at most 100"),
+    ({"feature": "mileage", "values": [-1]}, "positive numbers"),
+    ({"feature": "mileage", "values": [True]}, "positive numbers"),
+    ({"feature": "has_gps", "values": [1]}, "true or false"),
+    ({"feature": "fuel", "values": ["kerosene"]}, "fuel"),
+])
+def test_invalid_sweeps_are_rejected(vocabulary, kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        sweep_values(vocabulary=vocabulary, **kwargs)
@@ -0,0 +1,15 @@
+"""The API and the dashboard are deployed separately, each from its own directory, so each holds a copy of the
+modules and datasets they share. The copies must stay identical: edit one, then copy it over the other."""
+import filecmp
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED_FILES = ["delay_analysis.py", "storage.py", "df_delay.csv", "df_pricing.csv"]
+
+
+@pytest.mark.parametrize("name", SHARED_FILES)
+def test_api_and_dashboard_copies_are_identical(name):
+    api, dashboard = os.path.join(ROOT, "API", name), os.path.join(ROOT, "streamlit", name)
+    assert filecmp.cmp(api, dashboard, shallow=False), f"API/{name} and streamlit/{name} differ"